@@ -1,61 +1,66 @@
 from flask import Flask, render_template, Response, request, jsonify, redirect, url_for, flash, session, abort
-import cv2
 import os
-import time
-import smtplib
 import atexit
-import urllib.request   
-import numpy as np
-from email.message import EmailMessage
 from dotenv import load_dotenv
-from twilio.rest import Client
-from openai import OpenAI
-import subprocess
 import json
-from flask import send_file
-from reportlab.platypus import SimpleDocTemplate, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+import hashlib
 import sqlite3
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import openpyxl
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Image,
-    Table, TableStyle
-)
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
 import shutil
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import re
 import sqlite3
+from camera import CaptureEngine, make_camera_source
+from recorder import RecordingPipeline, mjpeg_playback
+from media import init_media, send_media, is_past_survey
+from thumbnails import DerivativeCache, VARIANTS, IMAGE_EXTENSIONS
+from listing import DirectoryIndex
+from storage_index import StorageIndex
+from storage_watch import StatsBroker, StorageWatcher
+from mapping_jobs import MappingJobQueue, ACTIVE_STATES
+from odm_worker import run_odm_job, make_scheduler, dataset_fingerprint, read_run_manifest, ODM_OPTIONS
+from result_cache import MappingResultCache
+from volume_engine import stockpile_volume, stockpile_volumes, load_stockpiles, survey_change
+from volume_store import StockpileVolumeStore
+from raster_tiles import TileServer, TILE_LAYERS, UnsupportedTiff, render_preview
+from chat_stream import ChatStreamer
+from chat_router import IntentRouter, ResponseCache
+from notifications import NotificationOutbox, SmtpTransport, TwilioTransport
+from reports import ReportRenderQueue, ReportArtifactStore, render_volume_report, render_survey_request, report_piles
 
 
 # Load environment variables from .env
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# ✅ Chat completions stream from one async client; OPENAI_BASE_URL can point at a local fake server
+chat_streamer = ChatStreamer(
+    os.getenv("OPENAI_API_KEY"),
+    model=os.getenv("CHAT_MODEL", "gpt-4o-mini"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", 8)),
+    queue_wait=float(os.getenv("CHAT_QUEUE_WAIT", 5)),
+    timeout=float(os.getenv("CHAT_TIMEOUT", 60)),
+    read_timeout=float(os.getenv("CHAT_READ_TIMEOUT", 20))
+)
+# ✅ Commands and platform queries are answered locally; repeated free-form prompts from the cache
+chat_router = IntentRouter(min_confidence=float(os.getenv("CHAT_INTENT_CONFIDENCE", IntentRouter.default_confidence)))
+chat_cache = ResponseCache(
+    max_entries=int(os.getenv("CHAT_CACHE_ENTRIES", 500)),
+    ttl=int(os.getenv("CHAT_CACHE_TTL", 3600))
+)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "garuda_secret_key_secure_123") # Default if not in .env
+init_media(app)
 
-video_writer = None   # ✅ ADD THIS LINE
-
-fourcc = cv2.VideoWriter_fourcc(*'XVID')
 last_image_time = 0
-# =========================
-# GLOBAL MAPPING STATUS
-# =========================
-MAPPING_STATUS = {
-    "running": False,
-    "completed": False,
-    "volume": None,
-    "map_image": None,
-    "geo_image": None
-}
-
+img_counter = 0
+CAPTURE_INTERVAL = int(os.getenv("CAPTURE_INTERVAL", 5))   # seconds between still captures
+RECORD_VIDEO = os.getenv("RECORD_VIDEO", "1") == "1"
+STREAM_MODE = os.getenv("STREAM_MODE", "passthrough")        # passthrough | reencode
 # Security Setup
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
@@ -132,24 +137,39 @@ def init_db():
   # =========================
 # NOTIFICATION FUNCTIONS
 # =========================
+# ✅ Email/WhatsApp go through a persisted outbox; one dispatcher per process keeps
+# the SMTP session and Twilio HTTP connection open between messages.
+# SMTP_HOST/SMTP_PORT/SMTP_SSL and TWILIO_API_BASE can point at a local sink or stub.
+notifications = NotificationOutbox(
+    DB_NAME,
+    {
+        "email": SmtpTransport(
+            os.getenv("SMTP_HOST", "smtp.gmail.com"),
+            int(os.getenv("SMTP_PORT", 465)),
+            user=os.getenv("SMTP_USER", os.getenv("EMAIL_ADDRESS")),
+            password=os.getenv("EMAIL_PASSWORD"),
+            sender=os.getenv("EMAIL_ADDRESS"),
+            use_ssl=os.getenv("SMTP_SSL", "1") == "1",
+            starttls=os.getenv("SMTP_STARTTLS", "0") == "1"
+        ),
+        "whatsapp": TwilioTransport(
+            os.getenv("TWILIO_ACCOUNT_SID"),
+            os.getenv("TWILIO_AUTH_TOKEN"),
+            os.getenv("TWILIO_WHATSAPP_NUMBER"),
+            base_url=os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+        ),
+    },
+    batch_size=int(os.getenv("NOTIFY_BATCH_SIZE", 20)),
+    max_attempts=int(os.getenv("NOTIFY_MAX_ATTEMPTS", 5))
+)
+notifications.start()
 
 # =========================
 # EMAIL FUNCTION
 # =========================
-def send_confirmation_email(message, user_email, pdf_path=None):
+def send_confirmation_email(message, user_email, pdf_path=None, pdf_name=None):
+    """Queue the confirmation email on the outbox; returns the notification id (None on error)."""
     try:
-        EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
-        EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-
-        if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
-            print("❌ Email credentials not found in .env file")
-            return False
-
-        msg = EmailMessage()
-        msg["Subject"] = "✅ Drone Survey Request Received"
-        msg["From"] = EMAIL_ADDRESS
-        msg["To"] = user_email
-
         # ✅ Enhanced email body with volume if present
         email_body = f"""
 Hello,
@@ -200,38 +220,22 @@ Thank you,
 Garuda Aerospace Drone Monitoring System
 """
 
-        msg.set_content(email_body)
-        
-        # ✅ Attach PDF Report
-        if pdf_path:
-            if os.path.exists(pdf_path):
-                try:
-                    pdf_filename = os.path.basename(pdf_path)
-                    with open(pdf_path, "rb") as f:
-                        pdf_data = f.read()
-                        msg.add_attachment(
-                            pdf_data,
-                            maintype="application",
-                            subtype="pdf",
-                            filename=pdf_filename
-                        )
-                    print(f"✅ PDF attached: {pdf_filename} ({len(pdf_data)} bytes)")
-                except Exception as attach_error:
-                    print(f"⚠️ Error attaching PDF: {attach_error}")
-            else:
-                print(f"⚠️ PDF file not found: {pdf_path}")
-
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.send_message(msg)
+        # ✅ Attach PDF Report (read by the dispatcher when it sends)
+        if pdf_path and not os.path.exists(pdf_path):
+            print(f"⚠️ PDF file not found: {pdf_path}")
+            pdf_path = None
 
-        print(f"✅ Email Sent To: {user_email}")
-        return True
+        return notifications.enqueue(
+            "email", user_email, email_body,
+            subject="✅ Drone Survey Request Received",
+            attachment_path=pdf_path,
+            attachment_name=pdf_name or (os.path.basename(pdf_path) if pdf_path else None)
+        )
     except Exception as e:
         print(f"❌ Email Error: {e}")
         import traceback
         traceback.print_exc()
-        return False
+        return None
 
 # =========================
 # WHATSAPP FUNCTION
@@ -240,17 +244,8 @@ Garuda Aerospace Drone Monitoring System
 # WHATSAPP FUNCTION (FIXED)
 # =========================
 def send_whatsapp_message_with_pdf(message, phone_number, pdf_url):
+    """Queue the WhatsApp text + PDF link on the outbox; returns the notification id (None on error)."""
     try:
-        TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-        TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-        TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_NUMBER")
-
-        if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_WHATSAPP_FROM:
-            print("❌ Twilio credentials not found in .env file")
-            return False
-
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
         # Normalize phone number
         phone_number = phone_number.replace(" ", "").replace("-", "")
 
@@ -277,25 +272,17 @@ def send_whatsapp_message_with_pdf(message, phone_number, pdf_url):
             "Garuda Aerospace Drone Monitoring System"
         )
 
-        print(f"📱 Sending WhatsApp to: {to_number}")
+        print(f"📱 Queueing WhatsApp to: {to_number}")
         print(f"📎 PDF URL: {pdf_url}")
 
         # ✅ Send Message + PDF Together
-        msg = client.messages.create(
-            from_=TWILIO_WHATSAPP_FROM,
-            to=to_number,
-            body=whatsapp_text,
-            media_url=[pdf_url]   # ✅ PDF Attachment
-        )
-
-        print(f"✅ WhatsApp Text + PDF Sent Successfully: {msg.sid}")
-        return True
+        return notifications.enqueue("whatsapp", to_number, whatsapp_text, media_url=pdf_url)
 
     except Exception as e:
         print(f"❌ WhatsApp Send Error: {e}")
         import traceback
         traceback.print_exc()
-        return False
+        return None
 
 
 
@@ -303,93 +290,136 @@ def send_whatsapp_message_with_pdf(message, phone_number, pdf_url):
 # =========================
 # EXISTING DRONE LOGIC
 # =========================
-SHOT_URL = "http://10.75.165.104:8080/shot.jpg"
-today = datetime.now().strftime("%Y-%m-%d")
-BASE_DIR = os.path.join("storage", today)
-IMG_DIR = os.path.join(BASE_DIR, "images")
-VID_DIR = os.path.join(BASE_DIR, "videos")
-REQ_DIR = os.path.join(BASE_DIR, "requests")
-
-os.makedirs(IMG_DIR, exist_ok=True)
-os.makedirs(VID_DIR, exist_ok=True)
-os.makedirs(REQ_DIR, exist_ok=True)
-
-def run_odm_mapping(date_folder):
-    storage_path = os.path.join(os.getcwd(), "storage")
-    dataset_name = date_folder
-    output_folder = os.path.join(storage_path, dataset_name)
-
-    # ✅ Check if Docker is available
-    docker_check = subprocess.run("docker ps", shell=True, capture_output=True)
-    if docker_check.returncode != 0:
-        print("⚠️ Docker not found or not running. Entering SIMULATION MODE.")
-        time.sleep(3) # Simulate some processing time
-        return output_folder # Return path even if empty for simulation
-
-    cmd = f"""
-    docker run --rm -v "{storage_path}":/datasets opendronemap/odm \
-    --project-path /datasets \
-    --fast-orthophoto \
-    --resize-to 1200 \
-    --matcher-neighbors 4 \
-    {date_folder}
-    """
-
-
-    print("🚀 Running ODM Mapping for:", dataset_name)
-    subprocess.run(cmd, shell=True)
-    return output_folder
-
-
-def run_odm_mapping_background(date_folder, user_email, user_phone=None):
-    global MAPPING_STATUS
+SHOT_URL = os.getenv("SHOT_URL", "http://10.75.165.104:8080/shot.jpg")
+STREAM_URL = os.getenv("STREAM_URL", "http://10.75.165.104:8080/video")
+CAMERA_SOURCE = os.getenv("CAMERA_SOURCE", "snapshot")      # snapshot | mjpeg
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mjpeg')
 
-    try:
-        # ✅ Update status
-        MAPPING_STATUS["running"] = True
-        MAPPING_STATUS["completed"] = False
-        MAPPING_STATUS["error"] = None
 
-        print("🚀 ODM Mapping Started for:", date_folder)
+def survey_dir(kind, date=None):
+    """storage/<date>/<kind> for today (evaluated per call, so it follows midnight)."""
+    path = os.path.join("storage", date or datetime.now().strftime("%Y-%m-%d"), kind)
+    os.makedirs(path, exist_ok=True)
+    return path
 
-        # ✅ Run ODM Mapping
-        output_path = run_odm_mapping(date_folder)
 
-        # ✅ Extract Volume After Mapping
-        volume = extract_volume(output_path)
+# ✅ PDF reports render in the background; styles and logo are loaded once per process
+report_queue = ReportRenderQueue(DB_NAME, workers=int(os.getenv("REPORT_WORKERS", 2)))
+report_queue.start()
 
-        # ✅ Generate PDF ONLY ONCE (After Volume Calculation)
-        pdf_path = generate_pdf_report(volume, user_email)
+# ✅ Report PDFs are stored once per content hash, with a per-job manifest
+report_artifacts = ReportArtifactStore(DB_NAME, os.getenv("REPORT_DIR", os.path.join("storage", "reports")))
+report_artifacts.init_schema()
 
+def publish_mapping_preview(job_id, ortho_src):
+    """Copy an orthophoto to the job's preview (and the "latest" one); returns its URL."""
+    if not ortho_src or not os.path.exists(ortho_src):
+        print("⚠️ Orthophoto not found, using fallback image...")
+        return "/static/mapping.png"
 
-        # ✅ Save Orthophoto Preview
-        ortho_src = os.path.join(output_path, "odm_orthophoto", "odm_orthophoto.png")
-        ortho_dest = os.path.join("static", "mapping.png")
+    os.makedirs(MAPPING_PREVIEW_DIR, exist_ok=True)
+    job_preview = os.path.join(MAPPING_PREVIEW_DIR, f"{job_id}.png")
+    if ortho_src.lower().endswith(".tif"):
+        # ✅ Downscaled from the memory-mapped GeoTIFF, never the full-size raster
+        try:
+            render_preview(ortho_src, job_preview, max_side=MAPPING_PREVIEW_SIZE)
+        except (UnsupportedTiff, OSError) as e:
+            print(f"⚠️ Orthophoto preview failed: {e}")
+            return "/static/mapping.png"
+    else:
+        shutil.copy(ortho_src, job_preview)
+    # The "latest" copy is the rendered preview, never the source raster
+    shutil.copy(job_preview, os.path.join("static", "mapping.png"))
+    return "/" + job_preview.replace(os.sep, "/")
 
-        if os.path.exists(ortho_src):
-            shutil.copy(ortho_src, ortho_dest)
-        else:
-            print("⚠️ Orthophoto not found, using fallback image...")
 
-        # ✅ Mission Geo Image (First Dataset Image)
-        images_dir = os.path.join(os.getcwd(), "storage", date_folder, "images")
-        mission_geo = "/static/geo_latest.jpg"
+def mission_geo_image(date_folder):
+    images_dir = os.path.join(os.getcwd(), "storage", date_folder, "images")
+    mission_geo = "/static/geo_latest.jpg"
 
-        if os.path.exists(images_dir):
-            imgs = [f for f in os.listdir(images_dir)
-                    if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    if os.path.exists(images_dir):
+        imgs = [f for f in os.listdir(images_dir)
+                if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+
+        if imgs:
+            mission_geo = f"/media/{date_folder}/images/{imgs[0]}"
+    return mission_geo
+
+
+def mapping_cache_key(fingerprint, date_folder):
+    """Dataset fingerprint plus everything else the volume depends on (boundary, base method)."""
+    h = hashlib.sha256(fingerprint.encode())
+    h.update(VOLUME_BASE_METHOD.encode())
+    polygon_path = stockpile_boundaries_path(date_folder)
+    if polygon_path:
+        with open(polygon_path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cached_mapping_result(date_folder, user_email, user_phone=None):
+    """Completed job built from the result cache, or None if this image set was never mapped."""
+    images_dir = os.path.join("storage", date_folder, "images")
+    fingerprint, image_count = dataset_fingerprint(images_dir, ODM_OPTIONS)
+    if not image_count:
+        return None
+    key = mapping_cache_key(fingerprint, date_folder)
+    cached = mapping_cache.get(key)
+    if not cached:
+        return None
+
+    job = mapping_jobs.record_completed(date_folder, user_email, user_phone, odm_action="cached")
+    # The PDF is per requester, so it is rendered on first download instead of here
+    result = {
+        "volume": cached["volume"],
+        "map_image": publish_mapping_preview(job["id"], cached["orthophoto"]),
+        "geo_image": mission_geo_image(date_folder)
+    }
+    mapping_jobs.update_result(job["id"], result)
+    stockpile_store.copy_survey(cached["date_folder"], date_folder, job_id=job["id"])
+    print(f"♻️ Mapping result for {date_folder} served from cache ({key[:12]})")
+    return mapping_jobs.get(job["id"])
+
+
+def finish_mapping_job(job):
+    """Turns a reconstructed dataset into volume, previews, PDF and email; returns its artifacts."""
+    date_folder = job["date_folder"]
+    user_email = job["requester"]
+    output_path = job["output_path"]
+
+    # ✅ Extract Volume After Mapping (total of every stockpile, per-pile rows saved alongside)
+    volume = extract_volume(output_path, date_folder, job_id=job["id"])
+    mapping_jobs.record_event(job["id"], "volume", f"Calculated volume: {volume} m³", volume=volume)
+
+    # ✅ Material movement since the previous survey (background, does not delay the report)
+    queue_dsm_change(date_folder)
+
+    # ✅ Generate PDF ONLY ONCE (After Volume Calculation)
+    pdf_path = generate_pdf_report(volume, user_email, job_id=job["id"], survey_date=date_folder,
+                                   piles=stockpile_store.for_survey(date_folder))
+    mapping_jobs.record_event(job["id"], "report", "PDF report ready", report=f"/api/mapping/jobs/{job['id']}/report")
+
+    # ✅ Save Orthophoto Preview (per job, plus the "latest" copy)
+    ortho_src = os.path.join(output_path, "odm_orthophoto", "odm_orthophoto.tif")
+    if not os.path.exists(ortho_src):
+        ortho_src = os.path.join(output_path, "odm_orthophoto", "odm_orthophoto.png")
+    map_image = publish_mapping_preview(job["id"], ortho_src)
 
-            if imgs:
-                mission_geo = f"/media/{date_folder}/images/{imgs[0]}"
+    # ✅ Mission Geo Image (First Dataset Image)
+    mission_geo = mission_geo_image(date_folder)
 
-        # ✅ Store Results for Status Command
-        MAPPING_STATUS["volume"] = volume
-        MAPPING_STATUS["map_image"] = "/static/mapping.png"
-        MAPPING_STATUS["geo_image"] = mission_geo
+    # ✅ Remember the result for repeat requests on the same images (real ODM runs only)
+    manifest = read_run_manifest(output_path)
+    if manifest and manifest.get("status") == "completed" and isinstance(volume, (int, float)):
+        try:
+            mapping_cache.put(mapping_cache_key(manifest["fingerprint"], date_folder), date_folder, output_path, volume)
+        except Exception as e:
+            print(f"⚠️ Mapping cache store failed: {e}")
 
-        # ====================================================
-        # ✅ SEND EMAIL ONLY ONCE (After Mapping Complete)
-        # ====================================================
+    # ====================================================
+    # ✅ SEND EMAIL ONLY ONCE (After Mapping Complete)
+    # ====================================================
+    if user_email:
         send_confirmation_email(
             f"""
 ✅ Drone Mapping Completed Successfully!
@@ -403,27 +433,179 @@ Your PDF Report is attached.
             pdf_path
         )
 
-        print("📧 PDF Report Sent Successfully to:", user_email)
+        mapping_jobs.record_event(job["id"], "notification", f"Report email queued for {user_email}")
+        print("📧 PDF Report Queued for:", user_email)
+
+    print(f"✅ Mapping Completed for {date_folder}! Volume: {volume} m³")
+    return {
+        "volume": volume,
+        "map_image": map_image,
+        "geo_image": mission_geo,
+        "pdf_path": pdf_path,
+        "output_path": output_path
+    }
+
 
-        # ====================================================
-        # ❌ WhatsApp Removed (Optional)
-        # ====================================================
-        # If you want WhatsApp later, we can add again
+def run_mapping_job(job):
+    """Inline mode: reconstruct and finish in this process."""
+    progress = lambda *args, **kwargs: mapping_jobs.record_event(job["id"], *args, **kwargs)
+    telemetry = lambda summary: mapping_jobs.update_telemetry(job["id"], summary)
+    job = dict(job, **run_odm_job(job, "storage", progress=progress, telemetry=telemetry))
+    return finish_mapping_job(job)
 
-        # ✅ Final Status Update
-        MAPPING_STATUS["completed"] = True
-        print(f"✅ Mapping Completed for {date_folder}! Volume: {volume} m³")
 
+MAPPING_PREVIEW_DIR = os.path.join("static", "mapping")
+MAPPING_PREVIEW_SIZE = int(os.getenv("MAPPING_PREVIEW_SIZE", 2048))
+
+# ✅ Orthophoto/DEM map tiles, read window by window from memory-mapped GeoTIFFs
+tile_server = TileServer(
+    "storage", os.getenv("TILE_CACHE_DIR", os.path.join("storage", ".tiles")),
+    tile_size=int(os.getenv("TILE_SIZE", 256)),
+    max_bytes=int(os.getenv("TILE_CACHE_MB", 2048)) * 1024 * 1024
+)
+
+# ✅ Finished results keyed by image set + ODM options, so repeat requests skip ODM entirely
+mapping_cache = MappingResultCache(
+    DB_NAME, os.getenv("MAPPING_CACHE_DIR", os.path.join("storage", ".mapping_cache")),
+    max_bytes=int(os.getenv("MAPPING_CACHE_MB", 5120)) * 1024 * 1024,
+    max_age_days=int(os.getenv("MAPPING_CACHE_DAYS", 90))
+)
+mapping_cache.init_schema()
+# How each pipeline state reads in chat replies
+MAPPING_STAGE_LABELS = {
+    "queued": "waiting for a worker",
+    "running": "ODM reconstruction",
+    "reconstructed": "reconstruction done, waiting for volume and report",
+    "finishing": "calculating volume and report",
+}
+# "service": ODM runs in odm_worker.py, the web app only finishes jobs
+# "inline": the web app runs ODM itself (single-box development)
+MAPPING_EXECUTOR = os.getenv("MAPPING_EXECUTOR", "service")
+
+# ✅ Mapping jobs live in SQLite so status survives restarts and gunicorn fan-out
+if MAPPING_EXECUTOR == "inline":
+    mapping_jobs = MappingJobQueue(
+        DB_NAME, run_mapping_job,
+        stage="all",
+        admission=make_scheduler("storage"),
+        workers=int(os.getenv("MAPPING_WORKERS", 1)),
+        max_running=int(os.getenv("MAPPING_MAX_RUNNING", 2))
+    )
+else:
+    mapping_jobs = MappingJobQueue(
+        DB_NAME, finish_mapping_job,
+        stage="finish",
+        workers=int(os.getenv("MAPPING_WORKERS", 1)),
+        max_running=int(os.getenv("MAPPING_MAX_RUNNING", 2))
+    )
+mapping_jobs.start()
+
+
+VOLUME_BASE_METHOD = os.getenv("VOLUME_BASE_METHOD", "plane")     # lowest | average_edge | plane | tin | dtm
+VOLUME_TILE_SIZE = int(os.getenv("VOLUME_TILE_SIZE", 1024))
+VOLUME_WORKERS = int(os.getenv("VOLUME_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Site-wide stockpile boundaries (GeoJSON FeatureCollection), used when a survey has none of its own
+SITE_STOCKPILES = os.getenv("STOCKPILES_GEOJSON", os.path.join("storage", "stockpiles.geojson"))
+
+# ✅ Per-pile volumes for every survey date
+stockpile_store = StockpileVolumeStore(DB_NAME)
+stockpile_store.init_schema()
+
+
+# DSM-to-DSM change detection between survey dates
+DSM_CHANGE_DIR = os.getenv("DSM_CHANGE_DIR", os.path.join("storage", ".changes"))
+DSM_CHANGE_MIN_M = float(os.getenv("DSM_CHANGE_MIN_M", 0.05))   # elevation noise floor
+change_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dsm-change")
+
+
+def stockpile_polygon_path(date_folder):
+    return os.path.join("storage", date_folder, "stockpile.geojson")
+
+
+def survey_dsm_path(date_folder):
+    return os.path.join("storage", date_folder, "odm_dem", "dsm.tif")
+
+
+def previous_dsm_survey(date_folder):
+    """Latest earlier survey date that has a DSM, or None."""
+    earlier = sorted((s["date"] for s in storage_index.all_surveys() if s["date"] < date_folder), reverse=True)
+    for date in earlier:
+        if os.path.exists(survey_dsm_path(date)):
+            return date
+    return None
+
+
+def dsm_change_heatmap_path(date_from, date_to):
+    return os.path.join(DSM_CHANGE_DIR, f"{date_from}_{date_to}.png")
+
+
+def run_dsm_change(date_from, date_to):
+    """Difference two surveys' DSMs and store site/per-pile stats plus the heatmap."""
+    try:
+        result = survey_change(
+            os.path.join("storage", date_from), os.path.join("storage", date_to),
+            stockpile_boundaries_path(date_to), tile_size=VOLUME_TILE_SIZE,
+            min_change=DSM_CHANGE_MIN_M, heatmap_path=dsm_change_heatmap_path(date_from, date_to)
+        )
+        if result is None:
+            print(f"⚠️ DSM change {date_from} → {date_to} skipped: missing DSM")
+            return None
+        stockpile_store.save_change(date_from, date_to, result)
+        site = result["site"]
+        print(f"📈 DSM change {date_from} → {date_to}: +{site['added_m3']} m³ / -{site['removed_m3']} m³ "
+              f"over {site['changed_area_m2']} m² in {result['seconds']}s")
+        return result
     except Exception as e:
-        print("❌ Mapping Error:", e)
-        MAPPING_STATUS["error"] = str(e)
+        print(f"⚠️ DSM change {date_from} → {date_to} failed: {e}")
+        return None
+
+
+def queue_dsm_change(date_to, date_from=None):
+    """Schedule a differencing run against ``date_from`` (default: the previous survey with a DSM)."""
+    if not os.path.exists(survey_dsm_path(date_to)):
+        return None
+    date_from = date_from or previous_dsm_survey(date_to)
+    if not date_from:
+        return None
+    change_executor.submit(run_dsm_change, date_from, date_to)
+    return date_from
+
+
+def stockpile_boundaries_path(date_folder):
+    """The survey's own stockpile file, else the site-wide one, else None."""
+    for path in (stockpile_polygon_path(date_folder), SITE_STOCKPILES):
+        if os.path.exists(path):
+            return path
+    return None
 
-    finally:
-        MAPPING_STATUS["running"] = False
 
+def extract_volume(output_path, date_folder=None, job_id=None):
+    date_folder = date_folder or os.path.basename(os.path.normpath(output_path))
 
+    # ✅ One volume per stockpile, computed in parallel over a shared DSM window
+    polygons_path = stockpile_boundaries_path(date_folder)
+    try:
+        piles = stockpile_volumes(output_path, polygons_path, base=VOLUME_BASE_METHOD,
+                                  tile_size=VOLUME_TILE_SIZE, workers=VOLUME_WORKERS)
+        if piles:
+            stockpile_store.save(date_folder, piles, job_id=job_id)
+            for pile in piles:
+                print(f"📐 {pile['name']}: cut {pile['cut_m3']} m³, fill {pile['fill_m3']} m³, "
+                      f"max height {pile['max_height_m']} m over {pile['area_m2']} m²")
+            return round(sum(pile["cut_m3"] for pile in piles), 2)
+    except Exception as e:
+        print(f"⚠️ Stockpile volumes failed, measuring the whole DSM instead: {e}")
+
+    # ✅ Measure the DSM against a base surface over the whole raster
+    try:
+        result = stockpile_volume(output_path, None, base=VOLUME_BASE_METHOD, tile_size=VOLUME_TILE_SIZE)
+        if result is not None:
+            print(f"📐 DSM volume ({result['base']} base): cut {result['cut_m3']} m³, "
+                  f"fill {result['fill_m3']} m³ over {result['area_m2']} m² in {result['seconds']}s")
+            return round(result["cut_m3"], 2)
+    except Exception as e:
+        print(f"⚠️ DSM volume computation failed, falling back to ODM stats: {e}")
 
-def extract_volume(output_path):
     stats_file = os.path.join(output_path, "odm_report", "stats.json")
 
     if not os.path.exists(stats_file):
@@ -449,169 +631,136 @@ def extract_volume(output_path):
     return "❌ Volume Not Available"
 
 
-def generate_pdf_report(volume_value, user_email="Unknown", location="Mining Site"):
-
-    pdf_path = os.path.join(BASE_DIR, "volume_report.pdf")
-    doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-
-    # ============================
-    # ✅ Company Logo + Header
-    # ============================
-    logo_path = "static/logo.png"
-    if os.path.exists(logo_path):
-        logo = Image(logo_path, width=2*inch, height=1*inch)
-        story.append(logo)
-
-    story.append(Paragraph(
-        "<b>Garuda Aerospace Pvt Ltd</b><br/>AI Drone Mining Monitoring System",
-        styles["Heading2"]
-    ))
-    story.append(Spacer(1, 15))
-
-    # ============================
-    # ✅ Report Title
-    # ============================
-    story.append(Paragraph("📌 Drone Mining Survey Volume Report", styles["Title"]))
-    story.append(Spacer(1, 20))
-
-    # ============================
-    # ✅ Client + Survey Info Table
-    # ============================
-    info_data = [
-        ["Report Generated For", user_email],
-        ["Survey Location", location],
-        ["Survey Date", today],
-        ["Processing Engine", "OpenDroneMap + AI Volume Estimation"]
-    ]
+def generate_pdf_report(volume_value, user_email="Unknown", location="Mining Site", job_id=None, piles=None,
+                        survey_date=None):
+    """Volume report for a mapping job, stored under its content hash; returns the PDF path."""
+    survey_date = survey_date or datetime.now().strftime("%Y-%m-%d")
+    inputs = {
+        "volume_value": volume_value,
+        "user_email": user_email,
+        "location": location,
+        "survey_date": survey_date,
+        "piles": report_piles(piles),
+    }
+    owner = f"mapping:{job_id}" if job_id else f"volume:{survey_date}"
+
+    # Callers are already off the request path (mapping workers), so render here but keep the timing
+    pdf_path = report_queue.run(
+        "volume",
+        lambda: report_artifacts.render(owner, "volume", render_volume_report, inputs,
+                                        download_name=f"volume_report_{survey_date}.pdf"),
+        requester=user_email
+    )
 
-    info_table = Table(info_data, colWidths=[180, 270])
-    info_table.setStyle(TableStyle([
-        ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-        ("BACKGROUND", (0,0), (0,-1), colors.lightgrey),
-        ("FONTNAME", (0,0), (0,-1), "Helvetica-Bold"),
-        ("ALIGN", (0,0), (-1,-1), "LEFT"),
-    ]))
-
-    story.append(info_table)
-    story.append(Spacer(1, 20))
-
-    # ============================
-    # ✅ Volume Highlight Box
-    # ============================
-    story.append(Paragraph(
-        f"<b>📊 Estimated Stockpile Volume:</b> "
-        f"<font size=14 color='blue'>{volume_value} m³</font>",
-        styles["Heading1"]
-    ))
-    story.append(Spacer(1, 25))
-
-    # ============================
-    # ✅ Summary Paragraph
-    # ============================
-    story.append(Paragraph("📝 Survey Summary", styles["Heading2"]))
-    story.append(Paragraph(
-        f"""
-        This report was automatically generated using drone imagery and AI-powered
-        3D mapping technology.
-
-        The calculated stockpile volume for the mining site is estimated as:
-
-        <b>{volume_value} cubic meters</b>.
-        """,
-        styles["Normal"]
-    ))
-
-    story.append(Spacer(1, 25))
-
-    # ============================
-    # ✅ Signature & Stamp Section
-    # ============================
-    story.append(Paragraph("✍ Authorized Signature", styles["Heading2"]))
-    story.append(Spacer(1, 25))
-
-    sign_data = [
-        ["Project Engineer", "____________________"],
-        ["Approved By (Admin)", "____________________"],
-        ["Company Stamp", "____________________"]
-    ]
+    print("✅ Lightweight Professional PDF Generated:", pdf_path)
+    return pdf_path
 
-    sign_table = Table(sign_data, colWidths=[200, 250])
-    sign_table.setStyle(TableStyle([
-        ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-        ("BACKGROUND", (0,0), (0,-1), colors.lightgrey),
-    ]))
 
-    story.append(sign_table)
-    story.append(Spacer(1, 20))
+def mapping_report_path(job):
+    """PDF of a completed mapping job; cached results render theirs on first use."""
+    pdf_path = job["pdf_path"]
+    if not pdf_path or not os.path.exists(pdf_path):
+        pdf_path = generate_pdf_report(job["volume"], job["requester"], job_id=job["id"],
+                                       survey_date=job["date_folder"],
+                                       piles=stockpile_store.for_survey(job["date_folder"]))
+        mapping_jobs.update_result(job["id"], {"pdf_path": pdf_path})
+    return pdf_path
 
-    # ============================
-    # ✅ Footer
-    # ============================
-    story.append(Paragraph(
-        "Generated by Garuda Aerospace AI Drone Monitoring System | Confidential Report",
-        styles["Italic"]
-    ))
 
-    # Build PDF
-    doc.build(story)
+def send_latest_report(**kwargs):
+    """Report of the most recently completed mapping job (the "latest report" routes)."""
+    job = mapping_jobs.latest(state="completed")
+    if not job:
+        return None
+    pdf_path = mapping_report_path(job)
+    artifact = stored_report(pdf_path)
+    kwargs.setdefault("download_name", artifact["download_name"] if artifact else None)
+    return send_media(pdf_path, mimetype="application/pdf", **kwargs)
 
-    print("✅ Lightweight Professional PDF Generated:", pdf_path)
-    return pdf_path
 
+# ✅ Thumbnail / preview cache for survey galleries
+derivatives = DerivativeCache(
+    os.getenv("DERIVATIVE_CACHE_DIR", os.path.join("storage", ".derivatives")),
+    max_bytes=int(os.getenv("DERIVATIVE_CACHE_MB", 2048)) * 1024 * 1024,
+    fmt=os.getenv("DERIVATIVE_FORMAT", "WEBP")
+)
+THUMBNAILS_ON_CAPTURE = os.getenv("THUMBNAILS_ON_CAPTURE", "1") == "1"
 
-def generate_frames():
-    global video_writer, last_image_time, img_counter
 
-    while True:
-        try:
-            img_resp = urllib.request.urlopen(SHOT_URL, timeout=5)
-            img_np = np.array(bytearray(img_resp.read()), dtype=np.uint8)
-            frame = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+# ✅ Per-survey counts/bytes kept in SQLite instead of walking storage on every poll
+storage_index = StorageIndex(
+    DB_NAME, "storage", IMAGE_EXTENSIONS, VIDEO_EXTENSIONS,
+    reconcile_interval=int(os.getenv("STORAGE_RECONCILE_SECONDS", 60))
+)
+storage_index.start()
+
+# ✅ Push live counters to dashboards as files land (inotify, or polling fallback)
+stats_broker = StatsBroker(storage_index)
+storage_watcher = StorageWatcher(
+    storage_index, stats_broker, "storage",
+    mode=os.getenv("STORAGE_WATCH", "auto"),               # auto | inotify | poll
+    poll_interval=int(os.getenv("STORAGE_POLL_SECONDS", 5))
+)
+storage_watcher.start()
 
-            if frame is None:
-                continue
 
-        except Exception as e:
-            time.sleep(1)
-            continue
+def on_still_captured(paths):
+    # First path is the dated capture; the second is static/geo_latest.jpg
+    storage_index.record_file(paths[0])
+    if THUMBNAILS_ON_CAPTURE:
+        derivatives.submit(paths[0])
+
 
-        current_time = time.time()
+def on_segment_closed(info):
+    storage_index.record_file(info["path"], rescan_dir=True)
 
-        # ✅ Start video if not started
-        if video_writer is None:
-            h, w, _ = frame.shape
 
-            video_filename = datetime.now().strftime("%Y%m%d_%H%M%S") + ".avi"
-            video_path = os.path.join(VID_DIR, video_filename)
+# ✅ Disk writes happen on the recording thread, never on the stream
+recorder = RecordingPipeline(
+    lambda: survey_dir("videos"),   # re-read per frame: a new survey folder starts a new segment at midnight
+    backend=os.getenv("RECORD_BACKEND", "auto"),          # auto | fmp4 | mjpeg | opencv
+    fps=lambda: capture_engine.source.fps,
+    max_frames=int(os.getenv("RECORD_QUEUE_FRAMES", 64)),
+    segment_seconds=int(os.getenv("VIDEO_SEGMENT_SECONDS", 300)),
+    segment_bytes=int(os.getenv("VIDEO_SEGMENT_MB", 512)) * 1024 * 1024,
+    on_still=on_still_captured,
+    on_segment=on_segment_closed
+)
 
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            video_writer = cv2.VideoWriter(video_path, fourcc, 20.0, (w, h))
 
-            print("New Video Started:", video_filename)
+def record_frame(captured):
+    """Runs once per camera frame on the capture thread (video + still capture)."""
+    global last_image_time, img_counter
 
-        # ✅ Write video frame
-        video_writer.write(frame)
+    # ✅ Queue video frame
+    if RECORD_VIDEO:
+        recorder.submit_frame(captured)
 
-        # ✅ Capture image every interval
-        if current_time - last_image_time >= CAPTURE_INTERVAL:
-            img_counter += 1
+    # ✅ Capture image every interval
+    if captured.timestamp - last_image_time >= CAPTURE_INTERVAL:
+        img_counter += 1
 
-            img_name = datetime.now().strftime("%Y%m%d_%H%M%S")
-            img_file = f"{img_name}_{img_counter:03d}.jpg"
+        img_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        img_file = f"{img_name}_{img_counter:03d}.jpg"
 
-            cv2.imwrite(os.path.join(IMG_DIR, img_file), frame)
+        latest_geo = os.path.join("static", "geo_latest.jpg")
+        recorder.submit_still(captured, [os.path.join(survey_dir("images"), img_file), latest_geo])
 
-            latest_geo = os.path.join("static", "geo_latest.jpg")
-            cv2.imwrite(latest_geo, frame)
+        last_image_time = captured.timestamp
 
-            last_image_time = current_time
 
-        # ✅ Stream frame for browser
-        ret, buffer = cv2.imencode(".jpg", frame)
-        frame_bytes = buffer.tobytes()
+# ✅ One shared camera connection for every viewer
+capture_engine = CaptureEngine(
+    make_camera_source(CAMERA_SOURCE, SHOT_URL, STREAM_URL),
+    frame_handler=record_frame,
+    mode=STREAM_MODE,
+    buffer_size=int(os.getenv("FRAME_BUFFER_SIZE", 8))
+)
+
 
+def generate_frames():
+    # ✅ Stream already-encoded frames from the shared capture thread
+    for frame_bytes in capture_engine.subscribe():
         yield (b"--frame\r\n"
                b"Content-Type: image/jpeg\r\n\r\n" +
                frame_bytes +
@@ -633,26 +782,17 @@ def get_mapping_preview(output_path):
     return None
 
 def cleanup():
-    global video_writer
-    if video_writer is not None:
-        video_writer.release()
-        print("✅ Video writer released safely.")
+    recorder.close()
+    print("✅ Video writer released safely.")
+
+atexit.register(cleanup)
 
 def get_statistics():
     try:
-        image_count = 0
-        if os.path.exists(IMG_DIR):
-            image_count = len([f for f in os.listdir(IMG_DIR) if f.endswith(('.jpg', '.png', '.jpeg'))])
-        video_count = 0
-        if os.path.exists(VID_DIR):
-            video_count = len([f for f in os.listdir(VID_DIR) if f.endswith(('.avi', '.mp4', '.mov'))])
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(BASE_DIR):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if os.path.exists(fp): total_size += os.path.getsize(fp)
-        storage_used_mb = total_size / (1024 * 1024)
-        return {"images": image_count, "videos": video_count, "storage_mb": round(storage_used_mb, 2)}
+        # ✅ Constant-time read from the storage index
+        stats = storage_index.survey_stats(datetime.now().strftime("%Y-%m-%d"))
+        storage_used_mb = stats["bytes"] / (1024 * 1024)
+        return {"images": stats["images"], "videos": stats["videos"], "storage_mb": round(storage_used_mb, 2)}
     except:
         return {"images": 0, "videos": 0, "storage_mb": 0}
 
@@ -770,30 +910,20 @@ def dashboard():
 @app.route("/survey_logs")
 @login_required
 def survey_logs():
-    storage_path = "storage"
-    logs = []
-    if os.path.exists(storage_path):
-        # Filter for YYYY-MM-DD format directories
-        logs = [d for d in os.listdir(storage_path) if os.path.isdir(os.path.join(storage_path, d)) and re.match(r"\d{4}-\d{2}-\d{2}", d)]
-        logs.sort(reverse=True)
-    return render_template('survey_logs.html', logs=logs)
+    # ✅ Missions are fetched page by page from /api/surveys
+    return render_template('survey_logs.html')
 
 @app.route("/survey_logs/<date>")
 @login_required
 def survey_detail(date):
-    storage_path = os.path.join("storage", date)
-    images_dir = os.path.join(storage_path, "images")
-    videos_dir = os.path.join(storage_path, "videos")
-    
-    images = []
-    if os.path.exists(images_dir):
-        images = [f for f in os.listdir(images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    
-    videos = []
-    if os.path.exists(videos_dir):
-        videos = [f for f in os.listdir(videos_dir) if f.lower().endswith(('.mp4', '.avi', '.mov'))]
-        
-    return render_template('survey_detail.html', date=date, images=images, videos=videos)
+    images_dir = os.path.join("storage", date, "images")
+
+    # ✅ Build thumbnails in the background the first time a survey is opened
+    if os.path.isdir(images_dir):
+        derivatives.warm(images_dir)
+
+    # ✅ Images and videos are fetched page by page from /api/surveys/<date>/media
+    return render_template('survey_detail.html', date=date)
 
 @app.route("/media/<date>/<type>/<filename>")
 @login_required
@@ -805,33 +935,230 @@ def serve_media(date, type, filename):
     directory = os.path.join("storage", date, type)
     if not os.path.exists(os.path.join(directory, filename)):
         abort(404)
-        
-    return send_file(os.path.join(directory, filename))
+
+    # ✅ MJPEG segments play back from any offset via their frame index
+    if filename.endswith(".mjpeg") and not request.args.get("download"):
+        start = request.args.get("start", 0, type=float)
+        return Response(
+            mjpeg_playback(os.path.join(directory, filename), start=start),
+            mimetype="multipart/x-mixed-replace; boundary=frame"
+        )
+
+    # ✅ Captures are write-once; videos are final once the survey day is over
+    immutable = type == "images" or is_past_survey(date)
+    return send_media(os.path.join(directory, filename), immutable=immutable)
+
+# =========================
+# SURVEY LISTING API
+# =========================
+directory_index = DirectoryIndex()
+
+def _page_args():
+    limit = max(1, min(request.args.get("limit", 50, type=int), 200))
+    return request.args.get("cursor"), limit
+
+@app.route("/api/surveys", methods=["GET"])
+@login_required
+def api_surveys():
+    cursor, limit = _page_args()
+    try:
+        page, next_cursor, total = directory_index.surveys("storage", cursor, limit)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    items = [{"date": name, "url": url_for("survey_detail", date=name)} for _, name, _ in page]
+    return jsonify({"status": "success", "data": {"items": items, "next_cursor": next_cursor, "total": total}})
+
+@app.route("/api/surveys/<date>/media", methods=["GET"])
+@login_required
+def api_survey_media(date):
+    media_type = request.args.get("type", "all")
+    if media_type not in ("images", "videos", "all"):
+        return jsonify({"status": "error", "message": "type must be images, videos or all"}), 400
+
+    storage_path = os.path.join("storage", date)
+    sources = []
+    if media_type in ("images", "all"):
+        sources.append((os.path.join(storage_path, "images"), "images", IMAGE_EXTENSIONS))
+    if media_type in ("videos", "all"):
+        sources.append((os.path.join(storage_path, "videos"), "videos", VIDEO_EXTENSIONS))
+
+    cursor, limit = _page_args()
+    descending = request.args.get("order", "asc") == "desc"
+    try:
+        page, next_cursor, total = directory_index.page(sources, cursor, limit, descending)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    items = []
+    for captured_at, name, kind in page:
+        item = {
+            "name": name,
+            "type": kind,
+            "captured_at": datetime.fromtimestamp(captured_at).isoformat(timespec="seconds"),
+            "url": url_for("serve_media", date=date, type=kind, filename=name),
+        }
+        if kind == "images":
+            item["thumb"] = url_for("serve_thumbnail", date=date, variant="thumb", filename=name)
+            item["preview"] = url_for("serve_thumbnail", date=date, variant="preview", filename=name)
+        items.append(item)
+
+    return jsonify({"status": "success", "data": {"items": items, "next_cursor": next_cursor, "total": total}})
+
+@app.route("/api/surveys/<date>/stockpile", methods=["GET", "POST"])
+@login_required
+def api_survey_stockpile(date):
+    if not re.match(r"^\d{4}-\d{2}-\d{2}$", date):
+        abort(404)
+    polygon_path = stockpile_polygon_path(date)
+
+    if request.method == "GET":
+        boundaries = stockpile_boundaries_path(date)
+        piles = [{"name": name, "polygon": points} for name, points in load_stockpiles(boundaries)] if boundaries else []
+        return jsonify({
+            "status": "success",
+            "data": piles[0]["polygon"] if piles else None,
+            "piles": piles,
+            "volumes": stockpile_store.for_survey(date),
+            "base": VOLUME_BASE_METHOD
+        })
+
+    # Boundaries in the DSM's projected CRS: GeoJSON FeatureCollection (one named Feature
+    # per stockpile), a single Polygon/Feature, or [[x, y], ...]
+    data = request.json or {}
+    geometry = data.get("polygon", data)
+    tmp_path = polygon_path + ".tmp"
+    os.makedirs(os.path.dirname(polygon_path), exist_ok=True)
+    with open(tmp_path, "w") as f:
+        json.dump(geometry, f)
+    try:
+        piles = load_stockpiles(tmp_path)
+    except (ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+        os.remove(tmp_path)
+        return jsonify({"status": "error", "message": f"Invalid polygon: {e}"}), 400
+    os.replace(tmp_path, polygon_path)
+    return jsonify({
+        "status": "success",
+        "data": piles[0][1],
+        "piles": [{"name": name, "polygon": points} for name, points in piles],
+        "base": VOLUME_BASE_METHOD
+    })
+
+# =========================
+# VOLUME TRENDS & CHANGE DETECTION API
+# =========================
+@app.route("/api/volumes/trends", methods=["GET"])
+@login_required
+def api_volume_trends():
+    # Site total plus the list of piles; each series is a single row read
+    return jsonify({"status": "success", "data": {"site": stockpile_store.trend(), "piles": stockpile_store.piles()}})
+
+@app.route("/api/volumes/trends/<pile>", methods=["GET"])
+@login_required
+def api_volume_trend(pile):
+    trend = stockpile_store.trend(pile)
+    if trend is None:
+        return jsonify({"status": "error", "message": f"No volumes recorded for {pile}"}), 404
+    return jsonify({"status": "success", "data": trend})
+
+@app.route("/api/changes", methods=["GET", "POST"])
+@login_required
+def api_dsm_changes():
+    if request.method == "POST":
+        data = request.json or {}
+        date_to = data.get("to", "")
+        date_from = data.get("from")
+        if not re.match(r"^\d{4}-\d{2}-\d{2}$", date_to) or (date_from and not re.match(r"^\d{4}-\d{2}-\d{2}$", date_from)):
+            return jsonify({"status": "error", "message": "from/to must be YYYY-MM-DD"}), 400
+        queued_from = queue_dsm_change(date_to, date_from)
+        if not queued_from:
+            return jsonify({"status": "error", "message": "Both surveys need a reconstructed DSM"}), 404
+        return jsonify({"status": "success", "data": {"from": queued_from, "to": date_to}}), 202
+
+    limit = max(1, min(request.args.get("limit", 20, type=int), 200))
+    changes = stockpile_store.changes(request.args.get("from"), request.args.get("to"), limit=limit)
+    for change in changes:
+        change["heatmap_url"] = url_for("dsm_change_heatmap", date_from=change["date_from"],
+                                        date_to=change["date_to"]) if change.pop("heatmap_path") else None
+    return jsonify({"status": "success", "data": changes})
+
+@app.route("/api/changes/<date_from>/<date_to>/heatmap.png")
+@login_required
+def dsm_change_heatmap(date_from, date_to):
+    if not re.match(r"^\d{4}-\d{2}-\d{2}$", date_from) or not re.match(r"^\d{4}-\d{2}-\d{2}$", date_to):
+        abort(404)
+    path = dsm_change_heatmap_path(date_from, date_to)
+    if not os.path.exists(path):
+        abort(404)
+    return send_media(path, mimetype="image/png")
+
+@app.route("/tiles/<date>/meta.json")
+@login_required
+def tile_meta(date):
+    layer = request.args.get("layer", "ortho")
+    if not re.match(r"^\d{4}-\d{2}-\d{2}$", date) or layer not in TILE_LAYERS:
+        abort(404)
+    try:
+        pyramid = tile_server.pyramid(date, layer)
+    except UnsupportedTiff as e:
+        return jsonify({"status": "error", "message": str(e)}), 415
+    if pyramid is None:
+        return jsonify({"status": "error", "message": f"No {layer} raster for {date}"}), 404
+
+    meta = pyramid.meta()
+    # Leaflet/OpenLayers URL template for this exact raster version
+    meta["url"] = f"/tiles/{date}/{{z}}/{{x}}/{{y}}.png?layer={layer}&v={meta['version']}"
+    return jsonify({"status": "success", "data": meta})
+
+@app.route("/tiles/<date>/<int:z>/<int:x>/<int:y>.png")
+@login_required
+def tile(date, z, x, y):
+    layer = request.args.get("layer", "ortho")
+    if not re.match(r"^\d{4}-\d{2}-\d{2}$", date) or layer not in TILE_LAYERS:
+        abort(404)
+    try:
+        pyramid = tile_server.pyramid(date, layer)
+        path = tile_server.tile(date, layer, z, x, y) if pyramid else None
+    except UnsupportedTiff:
+        abort(415)
+    if path is None:
+        abort(404)
+
+    # ✅ Versioned URLs (?v= from meta.json) never change content, so cache them forever
+    return send_media(path, mimetype="image/png", immutable=request.args.get("v") == pyramid.version)
+
+@app.route("/media/<date>/thumbs/<variant>/<filename>")
+@login_required
+def serve_thumbnail(date, variant, filename):
+    if variant not in VARIANTS:
+        abort(404)
+
+    source = os.path.join("storage", date, "images", filename)
+    if not os.path.exists(source):
+        abort(404)
+
+    try:
+        path = derivatives.get(source, variant)
+    except Exception as e:
+        print(f"⚠️ Thumbnail failed, serving original: {e}")
+        return send_media(source, immutable=True)
+
+    # ✅ Content-addressed, so safe to cache forever
+    return send_media(path, mimetype=derivatives.mimetype, immutable=True)
 
 @app.route("/analytics")
 @login_required
 def analytics():
-    # Basic aggregate analytics
-    storage_path = "storage"
-    total_surveys = 0
+    # Basic aggregate analytics (read from the storage index)
     total_storage_mb = 0
     survey_data = []
-    
-    if os.path.exists(storage_path):
-        dirs = [d for d in os.listdir(storage_path) if os.path.isdir(os.path.join(storage_path, d)) and re.match(r"\d{4}-\d{2}-\d{2}", d)]
-        total_surveys = len(dirs)
-        
-        for d in dirs:
-            dir_path = os.path.join(storage_path, d)
-            size = 0
-            for path, dirs_sub, files in os.walk(dir_path):
-                for f in files:
-                    fp = os.path.join(path, f)
-                    size += os.path.getsize(fp)
-            mb = round(size / (1024 * 1024), 2)
-            total_storage_mb += mb
-            survey_data.append({"date": d, "size": mb})
-            
+
+    for survey in storage_index.all_surveys():
+        mb = round(survey["bytes"] / (1024 * 1024), 2)
+        total_storage_mb += mb
+        survey_data.append({"date": survey["date"], "size": mb})
+
+    total_surveys = len(survey_data)
     return render_template('analytics.html', total_surveys=total_surveys, total_storage=round(total_storage_mb, 2), survey_data=survey_data)
 
 @app.route("/settings")
@@ -864,7 +1191,8 @@ def admin_dashboard():
     
     conn.close()
     
-    return render_template('admin_dashboard.html', users=all_users, pending_count=pending, users_count=total, total_logins=total_logins)
+    return render_template('admin_dashboard.html', users=all_users, pending_count=pending, users_count=total, total_logins=total_logins,
+                           mapping_cache=mapping_cache.stats())
 
 @app.route("/admin/approve/<int:user_id>")
 @login_required
@@ -914,17 +1242,133 @@ def video():
         return redirect(url_for('login'))
     return Response(generate_frames(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
+@app.route("/api/stream_stats", methods=["GET"])
+@login_required
+def api_stream_stats():
+    stats = capture_engine.stats()
+    stats["recorder"] = recorder.stats()
+    stats["derivatives"] = derivatives.stats()
+    stats["tiles"] = tile_server.stats()
+    stats["storage_watch"] = storage_watcher.stats()
+    stats["mapping"] = mapping_jobs.stats()
+    stats["reports"] = report_queue.stats()
+    stats["reports"]["artifacts"] = report_artifacts.stats()
+    stats["notifications"] = notifications.stats()
+    stats["chat"] = dict(chat_streamer.stats(), router=chat_router.stats(), cache=chat_cache.stats())
+    return jsonify({"status": "success", "data": stats})
+
+@app.route("/api/stream_mode", methods=["POST"])
+@login_required
+def api_stream_mode():
+    if current_user.role != 'admin':
+        abort(403)
+    mode = (request.json or {}).get("mode", "")
+    try:
+        capture_engine.set_mode(mode)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "mode": capture_engine.mode})
+
 @app.route("/api/statistics", methods=["GET"])
 @login_required
 def api_statistics():
     stats = get_statistics()
     return jsonify({"status": "success", "data": stats})
 
+@app.route("/api/statistics/stream", methods=["GET"])
+@login_required
+def api_statistics_stream():
+    survey = request.args.get("date") or datetime.now().strftime("%Y-%m-%d")
+    return Response(
+        stats_broker.subscribe(survey),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/mapping/jobs", methods=["GET"])
+@login_required
+def api_mapping_jobs():
+    # Admins see everyone's jobs, users only their own
+    requester = None if current_user.role == 'admin' else current_user.email
+    jobs = mapping_jobs.list(
+        requester=requester,
+        state=request.args.get("state") or None,
+        limit=max(1, min(request.args.get("limit", 50, type=int), 200))
+    )
+    return jsonify({"status": "success", "data": jobs})
+
+@app.route("/api/mapping/jobs/<job_id>", methods=["GET"])
+@login_required
+def api_mapping_job(job_id):
+    job = mapping_jobs.get(job_id)
+    if not job or (current_user.role != 'admin' and job["requester"] != current_user.email):
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "success", "data": job})
+
+@app.route("/api/mapping/jobs/<job_id>/stages", methods=["GET"])
+@login_required
+def api_mapping_job_stages(job_id):
+    """Per-stage ODM wall time, peak memory and image counts of one run."""
+    job = mapping_jobs.get(job_id)
+    if not job or (current_user.role != 'admin' and job["requester"] != current_user.email):
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "success", "data": mapping_jobs.telemetry(job_id)})
+
+@app.route("/api/mapping/stages", methods=["GET"])
+@login_required
+def api_mapping_stages():
+    """Which ODM stages the recent runs spent their time in."""
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    return jsonify({"status": "success", "data": mapping_jobs.stage_timings(limit)})
+
+@app.route("/api/mapping/jobs/<job_id>/events", methods=["GET"])
+@login_required
+def api_mapping_job_events(job_id):
+    """Push a job's progress (queued, ODM stages, volume, report, email) until it finishes."""
+    job = mapping_jobs.get(job_id)
+    if not job or (current_user.role != 'admin' and job["requester"] != current_user.email):
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    # EventSource resends the last id it saw when it reconnects
+    after_id = request.headers.get("Last-Event-ID") or request.args.get("after") or 0
+    try:
+        after_id = int(after_id)
+    except ValueError:
+        after_id = 0
+    return Response(
+        mapping_jobs.subscribe(job_id, after_id=after_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/mapping/jobs/<job_id>/report", methods=["GET"])
+@login_required
+def api_mapping_job_report(job_id):
+    job = mapping_jobs.get(job_id)
+    if not job or (current_user.role != 'admin' and job["requester"] != current_user.email):
+        abort(404)
+    if job["state"] != "completed":
+        abort(404)
+    pdf_path = mapping_report_path(job)
+    if not stored_report(pdf_path):
+        # Reports rendered before the artifact store live in the survey folder
+        return send_media(pdf_path, mimetype="application/pdf")
+    # ✅ Point at the content-addressed copy, which is cacheable forever
+    return redirect(report_url(pdf_path))
+
+@app.route("/api/admin/mapping_cache", methods=["GET", "POST"])
+@login_required
+def api_mapping_cache():
+    if current_user.role != 'admin':
+        abort(403)
+    if request.method == "POST":
+        action = (request.json or {}).get("action", "evict")
+        evicted = mapping_cache.evict(clear=action == "clear")
+        return jsonify({"status": "success", "evicted": evicted, "data": mapping_cache.stats()})
+    return jsonify({"status": "success", "data": mapping_cache.stats()})
+
 @app.route("/chat_ai", methods=["POST"])
 @login_required
 def chat_ai():
-    global MAPPING_STATUS
-
     data = request.json
     user_msg = data.get("message", "").strip().lower()
 
@@ -935,22 +1379,40 @@ def chat_ai():
     if not user_msg:
         return jsonify({"reply": "⚠️ Please type something!"})
 
+    # ✅ Patterns, then the local classifier; None falls through to the LLM
+    intent, source, confidence = chat_router.route(user_msg)
+
     # ======================================
     # ✅ 1️⃣ STATUS COMMAND (Always Priority)
     # ======================================
-    if "status" in user_msg:
+    if intent == "status":
+        job = mapping_jobs.get(data["job_id"]) if data.get("job_id") else mapping_jobs.latest(requester=user_email)
 
-        if MAPPING_STATUS["completed"]:
+        if job and job["state"] == "completed":
             return jsonify({
                 "reply": "✅ Mapping Completed Successfully!",
-                "volume": MAPPING_STATUS["volume"],
-                "map_image": MAPPING_STATUS["map_image"],
-                "geo_image": MAPPING_STATUS["geo_image"]
+                "job_id": job["id"],
+                "volume": job["volume"],
+                "map_image": job["map_image"],
+                "geo_image": job["geo_image"],
+                "date_folder": job["date_folder"]
+            })
+
+        elif job and job["state"] in ACTIVE_STATES:
+            stage = MAPPING_STAGE_LABELS.get(job["state"], job["state"])
+            latest = mapping_jobs.latest_event(job["id"])
+            if latest and latest["message"] and latest["stage"] not in ("queued", job["state"]):
+                stage += f": {latest['message']}"
+            return jsonify({
+                "reply": f"⏳ Still Processing {job['date_folder']} ({stage})... please wait.",
+                "job_id": job["id"],
+                "state": job["state"]
             })
 
-        elif MAPPING_STATUS["running"]:
+        elif job and job["state"] == "failed":
             return jsonify({
-                "reply": "⏳ Still Processing... please wait."
+                "reply": f"❌ Mapping failed for {job['date_folder']}: {job['error']}",
+                "job_id": job["id"]
             })
 
         else:
@@ -961,21 +1423,7 @@ def chat_ai():
     # ======================================
     # ✅ 2️⃣ START MAPPING COMMAND
     # ======================================
-    mapping_keywords = [
-        "generate mapping",
-        "start mapping",
-        "3d mapping",
-        "generate volume",
-        "calculate volume"
-    ]
-
-    if any(cmd in user_msg for cmd in mapping_keywords):
-
-        # ✅ Prevent double start
-        if MAPPING_STATUS["running"]:
-            return jsonify({
-                "reply": "⏳ Mapping already running... please wait."
-            })
+    if intent == "mapping":
 
         # ✅ Detect date folder
         date_folder = detect_date_from_message(user_msg)
@@ -985,182 +1433,248 @@ def chat_ai():
                 "reply": "⚠️ Please specify date. Example: 'generate mapping for 2026-02-10'"
             })
 
-        # ✅ Start Background Thread
-        threading.Thread(
-            target=run_odm_mapping_background,
-            args=(date_folder, user_email, user_phone)
-        ).start()
+        # ✅ Same images as a finished run? Answer straight from the result cache
+        job = cached_mapping_result(date_folder, user_email, user_phone)
+        if job:
+            return jsonify({
+                "reply": f"""
+✅ Mapping Completed Successfully! (cached result)
+
+📅 Target Date: {date_folder}
+🆔 Job ID: {job["id"]}
+📊 Calculated Volume: {job["volume"]} m³
+""",
+                "job_id": job["id"],
+                "volume": job["volume"],
+                "map_image": job["map_image"],
+                "geo_image": job["geo_image"],
+                "date_folder": job["date_folder"]
+            })
+
+        # ✅ Queue the job (one active job per date; other dates run in parallel)
+        job, created = mapping_jobs.submit(date_folder, user_email, user_phone)
+
+        if not created:
+            return jsonify({
+                "reply": f"⏳ Mapping for {date_folder} already {job['state']}... please wait.",
+                "job_id": job["id"]
+            })
 
         return jsonify({
             "reply": f"""
 🚀 Mapping Initialized Successfully!
 
 📅 Target Date: {date_folder}
+🆔 Job ID: {job["id"]}
 📧 Report will be sent to: {user_email}
 
 ⏳ Processing started...
 Your 3D map + Geo image will update automatically.
 
 Type **status** anytime.
-"""
+""",
+            "job_id": job["id"]
         })
 
     # ======================================
-    # ✅ 3️⃣ NORMAL AI CHAT MODE
+    # ✅ 3️⃣ CAPTURE STATISTICS QUERY
     # ======================================
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.7,
-        max_tokens=400,
-        messages=[
-            {"role": "system", "content": "You are Garuda Aerospace AI Assistant."},
-            {"role": "user", "content": user_msg}
-        ]
-    )
+    if intent == "statistics":
+        date_folder = detect_date_from_message(user_msg) or datetime.now().strftime("%Y-%m-%d")
+        stats = storage_index.survey_stats(date_folder)
+        return jsonify({
+            "reply": f"""
+📸 Capture Statistics for {date_folder}
+
+🖼 Images: {stats["images"]}
+🎥 Videos: {stats["videos"]}
+💾 Storage Used: {round(stats["bytes"] / (1024 * 1024), 2)} MB
+""",
+            "intent": intent
+        })
+
+    # ======================================
+    # ✅ 4️⃣ VOLUME QUERY
+    # ======================================
+    if intent == "volume":
+        date_folder = detect_date_from_message(user_msg)
+        piles = stockpile_store.for_survey(date_folder) if date_folder else []
+        if piles:
+            total = round(sum(p["cut_m3"] for p in piles), 2)
+            breakdown = "\n".join(f"⛰ {p['pile']}: {p['cut_m3']:,.2f} m³" for p in piles)
+            return jsonify({
+                "reply": f"📊 Stockpile Volume for {date_folder}: {total} m³\n\n{breakdown}",
+                "intent": intent,
+                "volume": total,
+                "date_folder": date_folder
+            })
+
+        job = mapping_jobs.latest(requester=user_email, state="completed") or mapping_jobs.latest(state="completed")
+        if date_folder or not job:
+            return jsonify({
+                "reply": f"⚠️ No measured volume{' for ' + date_folder if date_folder else ''} yet. "
+                         f"Type 'generate mapping for YYYY-MM-DD'.",
+                "intent": intent
+            })
+        return jsonify({
+            "reply": f"📊 Latest Measured Volume ({job['date_folder']}): {job['volume']} m³",
+            "intent": intent,
+            "job_id": job["id"],
+            "volume": job["volume"],
+            "map_image": job["map_image"],
+            "geo_image": job["geo_image"],
+            "date_folder": job["date_folder"]
+        })
 
+    # ======================================
+    # ✅ 5️⃣ NORMAL AI CHAT MODE (cached, streamed)
+    # ======================================
+    messages = [
+        {"role": "system", "content": "You are Garuda Aerospace AI Assistant."},
+        {"role": "user", "content": user_msg}
+    ]
+    cache_key = chat_cache.key(user_msg, chat_streamer.model)
+    cached = chat_cache.get(cache_key)
+    streaming = "text/event-stream" in request.headers.get("Accept", "")
+
+    if cached is not None:
+        if streaming:
+            return Response(
+                cached_chat_events(cached),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        return jsonify({"reply": cached, "cached": True})
+
+    if streaming:
+        return Response(
+            chat_events(messages, cache_key),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    try:
+        reply, metrics = chat_streamer.complete(messages, temperature=0.7, max_tokens=400)
+    except Exception as e:
+        print(f"❌ AI chat error: {e}")
+        return jsonify({"reply": f"⚠️ {e}"}), 503
+    if metrics["status"] == "ok":
+        chat_cache.put(cache_key, reply, metrics["total_ms"])
     return jsonify({
-        "reply": response.choices[0].message.content
+        "reply": reply,
+        "metrics": metrics
+    })
+
+
+def chat_events(messages, cache_key=None):
+    """SSE relay: start (request id), token*, optional error, done (ttft/total latency)."""
+    parts = []
+    for kind, data in chat_streamer.stream(messages, temperature=0.7, max_tokens=400):
+        if kind == "token":
+            parts.append(data)
+        elif kind == "done" and cache_key and data["status"] == "ok":
+            chat_cache.put(cache_key, "".join(parts), data["total_ms"])
+        yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+def cached_chat_events(reply):
+    """The same event sequence for a reply served from the response cache."""
+    yield f"event: start\ndata: {json.dumps({'id': None, 'cached': True})}\n\n"
+    yield f"event: token\ndata: {json.dumps(reply)}\n\n"
+    yield f"event: done\ndata: {json.dumps({'cached': True, 'status': 'ok'})}\n\n"
+
+
+@app.route("/api/chat/metrics", methods=["GET"])
+@login_required
+def api_chat_metrics():
+    if current_user.role != 'admin':
+        abort(403)
+    return jsonify({
+        "status": "success",
+        "data": dict(chat_streamer.stats(), router=chat_router.stats(), cache=chat_cache.stats()),
+        "recent": chat_streamer.recent()
     })
 
 
 # =========================
 # SURVEY REQUEST HANDLER
 # =========================
-def generate_survey_pdf(mission_objectives, operator_email, timestamp, volume=None):
-    """Generate PDF for survey request with optional volume"""
-    pdf_path = os.path.join(REQ_DIR, f"survey_request_{timestamp}.pdf")
-    doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-
-    # ============================
-    # ✅ Company Header
-    # ============================
-    logo_path = "static/logo.png"
-    if os.path.exists(logo_path):
-        logo = Image(logo_path, width=2*inch, height=1*inch)
-        story.append(logo)
-
-    story.append(Paragraph(
-        "<b>Garuda Aerospace Pvt Ltd</b><br/>Drone Survey Request Form",
-        styles["Heading2"]
-    ))
-    story.append(Spacer(1, 15))
-
-    # ============================
-    # ✅ Survey Request Title
-    # ============================
-    story.append(Paragraph("📋 Drone Survey Mission Request", styles["Title"]))
-    story.append(Spacer(1, 20))
-
-    # ============================
-    # ✅ Request Details Table
-    # ============================
-    request_data = [
-        ["Request ID", timestamp],
-        ["Operator Email", operator_email],
-        ["Request Date", datetime.now().strftime("%Y-%m-%d")],
-        ["Request Time", datetime.now().strftime("%H:%M:%S")],
-        ["Status", "Processing" if volume else "Pending Processing"]
-    ]
+def survey_pdf_name(timestamp):
+    return f"survey_request_{timestamp}.pdf"
 
-    req_table = Table(request_data, colWidths=[180, 270])
-    req_table.setStyle(TableStyle([
-        ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-        ("BACKGROUND", (0,0), (0,-1), colors.lightgrey),
-        ("FONTNAME", (0,0), (0,-1), "Helvetica-Bold"),
-        ("ALIGN", (0,0), (-1,-1), "LEFT"),
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-    ]))
-
-    story.append(req_table)
-    story.append(Spacer(1, 20))
-
-    # ============================
-    # ✅ Volume Calculation (if available)
-    # ============================
-    if volume:
-        story.append(Paragraph("📊 Volume Calculation Results", styles["Heading2"]))
-        story.append(Spacer(1, 10))
-        
-        volume_data = [
-            ["Estimated Stockpile Volume", f"<b>{volume} m³</b>"],
-            ["Calculation Method", "OpenDroneMap + AI Volume Estimation"],
-            ["Confidence Level", "High (3D Point Cloud Analysis)"]
-        ]
-        
-        volume_table = Table(volume_data, colWidths=[180, 270])
-        volume_table.setStyle(TableStyle([
-            ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-            ("BACKGROUND", (0,0), (0,-1), colors.lightblue),
-            ("FONTNAME", (0,0), (0,-1), "Helvetica-Bold"),
-            ("ALIGN", (0,0), (-1,-1), "LEFT"),
-            ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ]))
-        
-        story.append(volume_table)
-        story.append(Spacer(1, 20))
-
-    # ============================
-    # ✅ Mission Objectives
-    # ============================
-    story.append(Paragraph("📌 Mission Objectives & Coordinates", styles["Heading2"]))
-    story.append(Paragraph(
-        mission_objectives if mission_objectives else "No specific coordinates provided",
-        styles["Normal"]
-    ))
-    story.append(Spacer(1, 20))
-
-    # ============================
-    # ✅ Instructions
-    # ============================
-    story.append(Paragraph("📝 Next Steps", styles["Heading2"]))
-    if volume:
-        next_steps = """
-        1. <b>Volume Confirmed:</b> Your survey volume has been calculated and is shown above.
-        <br/><br/>
-        2. <b>Documentation:</b> This PDF serves as your official survey report with volume confirmation.
-        <br/><br/>
-        3. <b>Delivery:</b> Complete 3D maps, detailed analysis, and geotagged images will be sent within 24 hours.
-        <br/><br/>
-        4. <b>Contact:</b> For questions, reply to this email or contact our team.
-        """
-    else:
-        next_steps = """
-        1. <b>Confirmation:</b> Your survey request has been received and logged in our system.
-        <br/><br/>
-        2. <b>Processing:</b> Our team will begin drone mapping operations at the specified location.
-        <br/><br/>
-        3. <b>Delivery:</b> 3D maps, volume analysis, and geotagged images will be sent within 24-48 hours.
-        <br/><br/>
-        4. <b>Contact:</b> For updates, reply to this email or contact our team.
-        """
-    
-    story.append(Paragraph(next_steps, styles["Normal"]))
-    story.append(Spacer(1, 25))
-
-    # ============================
-    # ✅ Footer with Contact Info
-    # ============================
-    story.append(Paragraph(
-        "<b>Contact Information:</b><br/>Email: support@garuda.aero<br/>WhatsApp: +91-XXXXXXXXXX<br/><br/>"
-        "Generated by Garuda Aerospace AI Drone Monitoring System | Confidential Report",
-        styles["Italic"]
-    ))
-
-    # Build PDF
-    doc.build(story)
+
+def generate_survey_pdf(mission_objectives, operator_email, timestamp, volume=None, requested_at=None):
+    """Generate PDF for survey request with optional volume"""
+    inputs = {
+        "mission_objectives": mission_objectives,
+        "operator_email": operator_email,
+        "timestamp": timestamp,
+        "volume": volume,
+        "requested_at": requested_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    pdf_path = report_artifacts.render(f"request:{timestamp}", "survey_request", render_survey_request, inputs,
+                                       download_name=survey_pdf_name(timestamp))
     print(f"✅ Survey Request PDF Generated: {pdf_path}")
     return pdf_path
 
 
+def deliver_survey_request(pdf_path, timestamp, message, email, phone, volume):
+    """Queue the rendered request PDF for email + WhatsApp and log it; returns the notification ids."""
+    # ✅ Prepare email message with volume info if available
+    message_with_volume = f"Mission Objectives:\n{message}"
+    if volume:
+        message_with_volume += f"\n\n📊 Volume Calculation: {volume} m³"
+
+    # ✅ Send Email with PDF
+    print("\n📧 Queueing email...")
+    email_id = send_confirmation_email(
+        message=message_with_volume,
+        user_email=email,
+        pdf_path=pdf_path,
+        pdf_name=survey_pdf_name(timestamp)
+    )
+
+    # ✅ Send WhatsApp with PDF (if phone provided)
+    whatsapp_id = None
+    if phone:
+        try:
+            # Using localhost for development - change to actual domain in production
+            pdf_url = f"http://localhost:5000{report_url(pdf_path)}"
+
+            whatsapp_message = f"Your Drone Survey Request has been received!\n\n📋 Request ID: {timestamp}\n\nObjectives:\n{message}"
+            if volume:
+                whatsapp_message += f"\n\n📊 Volume: {volume} m³"
+
+            print(f"\n📱 Queueing WhatsApp...")
+            whatsapp_id = send_whatsapp_message_with_pdf(
+                message=whatsapp_message,
+                phone_number=phone,
+                pdf_url=pdf_url
+            )
+        except Exception as e:
+            print(f"⚠️ WhatsApp send error (non-critical): {e}")
+            import traceback
+            traceback.print_exc()
+            whatsapp_id = None
+
+    # ✅ Log the request
+    try:
+        log_file = os.path.join(survey_dir("requests"), "survey_log.txt")
+        with open(log_file, "a") as f:
+            volume_str = f"Volume: {volume} m³" if volume else "Volume: Pending"
+            f.write(f"[{timestamp}] Email: {email} | Phone: {phone} | {volume_str} | Email Notification: {email_id} | WhatsApp Notification: {whatsapp_id}\n")
+        print(f"✅ Request logged to {log_file}")
+    except Exception as e:
+        print(f"⚠️ Logging error: {e}")
+
+    return {"email": email_id, "whatsapp": whatsapp_id}
+
+
 @app.route("/ai_request", methods=["POST"])
 @login_required
 def ai_request():
-    """Handle survey request: Generate PDF and send via email + WhatsApp"""
+    """Handle survey request: queue the PDF, email and WhatsApp, answer with the job id"""
     try:
-        global MAPPING_STATUS
-        
         data = request.json
         message = data.get("message", "").strip()
         email = data.get("email", "").strip()
@@ -1179,96 +1693,41 @@ def ai_request():
             }), 400
 
         # ✅ Generate unique timestamp for request ID
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
+        now = datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+        requested_at = now.strftime("%Y-%m-%d %H:%M:%S")
+
         print(f"📌 Request ID: {timestamp}")
-        
-        # ✅ Get volume from MAPPING_STATUS if available
-        volume = MAPPING_STATUS.get("volume")
-        print(f"📊 Current Volume in MAPPING_STATUS: {volume}")
-        
-        # ✅ Generate Survey PDF with volume if available
-        try:
-            pdf_path = generate_survey_pdf(message, email, timestamp, volume=volume)
-            print(f"✅ PDF Generated: {pdf_path}")
-            print(f"   File exists: {os.path.exists(pdf_path)}")
-            if os.path.exists(pdf_path):
-                print(f"   File size: {os.path.getsize(pdf_path)} bytes")
-        except Exception as pdf_error:
-            print(f"❌ Error generating PDF: {pdf_error}")
-            import traceback
-            traceback.print_exc()
-            raise pdf_error
 
-        # ✅ Prepare email message with volume info if available
-        message_with_volume = f"Mission Objectives:\n{message}"
-        if volume:
-            message_with_volume += f"\n\n📊 Volume Calculation: {volume} m³"
-
-        # ✅ Send Email with PDF
-        print("\n📧 Sending email...")
-        email_success = send_confirmation_email(
-            message=message_with_volume,
-            user_email=email,
-            pdf_path=pdf_path
+        # ✅ Get volume from the most recent completed mapping job
+        last_job = mapping_jobs.latest(state="completed")
+        volume = last_job["volume"] if last_job else None
+        print(f"📊 Latest mapped volume: {volume}")
+
+        # ✅ Render + deliver in the background; the client polls /api/reports/<job_id>
+        job_id = report_queue.submit(
+            "survey_request",
+            lambda: generate_survey_pdf(message, email, timestamp, volume=volume, requested_at=requested_at),
+            requester=current_user.email,
+            deliver=lambda pdf_path: deliver_survey_request(pdf_path, timestamp, message, email, phone, volume)
         )
+        pdf_name = survey_pdf_name(timestamp)
 
-        # ✅ Send WhatsApp with PDF (if phone provided)
-        whatsapp_success = False
-        if phone:
-            try:
-                # Get public URL for PDF - use relative path that will be served
-                pdf_filename = os.path.basename(pdf_path)
-                request_date = datetime.now().strftime('%Y-%m-%d')
-                # Using localhost for development - change to actual domain in production
-                pdf_url = f"http://localhost:5000/download_survey_pdf/{request_date}/{pdf_filename}"
-                
-                whatsapp_message = f"Your Drone Survey Request has been received!\n\n📋 Request ID: {timestamp}\n\nObjectives:\n{message}"
-                if volume:
-                    whatsapp_message += f"\n\n📊 Volume: {volume} m³"
-                
-                print(f"\n📱 Sending WhatsApp...")
-                whatsapp_success = send_whatsapp_message_with_pdf(
-                    message=whatsapp_message,
-                    phone_number=phone,
-                    pdf_url=pdf_url
-                )
-                print(f"✅ WhatsApp sent successfully to {phone}")
-            except Exception as e:
-                print(f"⚠️ WhatsApp send error (non-critical): {e}")
-                import traceback
-                traceback.print_exc()
-                whatsapp_success = False
-
-        # ✅ Log the request
-        try:
-            log_file = os.path.join(REQ_DIR, "survey_log.txt")
-            with open(log_file, "a") as f:
-                volume_str = f"Volume: {volume} m³" if volume else "Volume: Pending"
-                f.write(f"[{timestamp}] Email: {email} | Phone: {phone} | {volume_str} | Email Success: {email_success} | WhatsApp Success: {whatsapp_success}\n")
-            print(f"✅ Request logged to {log_file}")
-        except Exception as e:
-            print(f"⚠️ Logging error: {e}")
-
-        # ✅ Return response
-        response_text = f"✅ Survey Request Transmitted!\n\n"
-        response_text += f"📧 Email Sent: {'Yes ✓' if email_success else 'Failed ✗'}\n"
-        response_text += f"📱 WhatsApp Sent: {'Yes ✓' if whatsapp_success else 'Failed ✗'}\n"
+        response_text = f"✅ Survey Request Queued!\n\n"
         if volume:
             response_text += f"📊 Volume Included: {volume} m³ ✓\n"
         else:
             response_text += f"📊 Volume: Pending (Run mapping first)\n"
         response_text += f"📋 Request ID: {timestamp}\n"
-        response_text += f"\n📄 PDF: {os.path.basename(pdf_path)}"
-
-        print(f"\n✅ Final Response: {response_text}\n")
+        response_text += f"\n📄 PDF: {pdf_name} (sending by email and WhatsApp...)"
 
         return jsonify({
-            "status": "success",
+            "status": "queued",
             "message": response_text,
-            "file": os.path.basename(pdf_path),
+            "job_id": job_id,
+            "file": pdf_name,
             "volume": volume
-        }), 200
+        }), 202
 
     except Exception as e:
         print(f"\n❌ Survey Request Error: {e}")
@@ -1280,13 +1739,58 @@ def ai_request():
         }), 500
 
 
+@app.route("/api/reports/<int:job_id>", methods=["GET"])
+@login_required
+def api_report_job(job_id):
+    job = report_queue.get(job_id)
+    if not job or (current_user.role != 'admin' and job["requester"] != current_user.email):
+        return jsonify({"status": "error", "message": "Report not found"}), 404
+    pdf_path = job.pop("pdf_path")
+    artifact = stored_report(pdf_path) if pdf_path else None
+    job["file"] = artifact["download_name"] if artifact else None
+    job["url"] = report_url(pdf_path) if artifact else None
+    # ✅ Delivery state of each queued notification (pending / sending / sent / failed)
+    if job["delivery"]:
+        for channel, notification_id in job["delivery"].items():
+            notification = notifications.get(notification_id) if notification_id else None
+            job["delivery"][channel] = notification["state"] if notification else "not sent"
+    return jsonify({"status": "success", "data": job})
+
+
 @app.route("/download_report")
 @login_required
 def download_report():
-    pdf_path = os.path.join(BASE_DIR, "volume_report.pdf") # Case sensitive fix
-    if not os.path.exists(pdf_path):
+    rv = send_latest_report(as_attachment=True)
+    if rv is None:
         return "⚠️ Report not generated yet!"
-    return send_file(pdf_path, as_attachment=True)
+    return rv
+
+
+def report_url(pdf_path):
+    """Immutable download URL of a stored report PDF."""
+    return url_for("report_artifact", sha256=os.path.splitext(os.path.basename(pdf_path))[0])
+
+
+def stored_report(pdf_path):
+    """Manifest entry behind a report path (None for PDFs outside the artifact store)."""
+    return report_artifacts.by_sha(os.path.splitext(os.path.basename(pdf_path))[0])
+
+
+@app.route("/reports/<sha256>.pdf")
+def report_artifact(sha256):
+    """Content-addressed report download: the URL names the bytes, so it never changes."""
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        abort(404)
+    artifact = report_artifacts.by_sha(sha256)
+    if not artifact or not os.path.exists(artifact["path"]):
+        abort(404)
+    return send_media(
+        artifact["path"],
+        mimetype="application/pdf",
+        as_attachment=request.args.get("download") == "1",
+        download_name=artifact["download_name"],
+        immutable=True
+    )
 
 
 @app.route("/download_survey_pdf/<date>/<filename>")
@@ -1298,7 +1802,8 @@ def download_survey_pdf(date, filename):
         if not os.path.exists(pdf_path):
             return jsonify({"error": "PDF not found"}), 404
         
-        return send_file(pdf_path, as_attachment=True, mimetype="application/pdf")
+        # ✅ Request PDFs are timestamped and never rewritten
+        return send_media(pdf_path, as_attachment=True, mimetype="application/pdf", immutable=True)
     except Exception as e:
         print(f"Error downloading survey PDF: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1306,28 +1811,17 @@ def download_survey_pdf(date, filename):
 
 @app.route("/volume_report.pdf")
 def volume_report():
-    pdf_path = os.path.join(BASE_DIR, "volume_report.pdf")
-
-    if not os.path.exists(pdf_path):
+    rv = send_latest_report(as_attachment=False)
+    if rv is None:
         return "PDF Not Ready Yet", 404
-
-    return send_file(
-        pdf_path,
-        mimetype="application/pdf",
-        as_attachment=False
-    )
+    return rv
 
 @app.route("/twilio_pdf")
 def twilio_pdf():
-    pdf_path = os.path.join(BASE_DIR, "volume_report.pdf")
-
-    if not os.path.exists(pdf_path):
+    rv = send_latest_report()
+    if rv is None:
         return "PDF Not Ready", 404
-
-    return send_file(
-        pdf_path,
-        mimetype="application/pdf"
-    )
+    return rv
 
 
 @app.route("/admin-login", methods=["GET", "POST"])
@@ -1361,22 +1855,17 @@ def admin_login():
 
 @app.route("/report_pdf")
 def report_pdf():
-    pdf_path = os.path.join(BASE_DIR, "volume_report.pdf")
-    return send_file(pdf_path, mimetype="application/pdf")
+    rv = send_latest_report()
+    if rv is None:
+        return "PDF Not Ready", 404
+    return rv
 
 @app.route("/public_report")
 def public_report():
-    pdf_path = os.path.join(BASE_DIR, "volume_report.pdf")
-
-    if not os.path.exists(pdf_path):
+    rv = send_latest_report(as_attachment=True, download_name="Mining_Report.pdf")
+    if rv is None:
         return "Report not ready yet!"
-
-    return send_file(
-        pdf_path,
-        mimetype="application/pdf",
-        as_attachment=True,
-        download_name="Mining_Report.pdf"
-    )
+    return rv
 
 @app.route("/setup-admin")
 def setup_admin():
@@ -0,0 +1,392 @@
+import collections
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+import requests
+
+
+# =========================
+# SHARED FRAME BUFFER
+# =========================
+class FrameHub:
+    """Bounded ring buffer of encoded JPEG frames shared by every /video viewer."""
+
+    def __init__(self, size=8):
+        self._frames = collections.deque(maxlen=size)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.subscribers = 0
+        self.dropped = 0
+
+    def publish(self, jpeg_bytes):
+        with self._cond:
+            self._seq += 1
+            self._frames.append((self._seq, jpeg_bytes))
+            self._cond.notify_all()
+
+    def next_frame(self, last_seq, timeout=5.0):
+        """Return (seq, jpeg) newer than last_seq, or (last_seq, None) on timeout.
+
+        A viewer that fell behind the whole ring jumps straight to the newest
+        frame, so slow clients drop frames instead of holding up the producer.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq, timeout):
+                return last_seq, None
+
+            oldest_seq = self._frames[0][0]
+            if last_seq < oldest_seq - 1:
+                self.dropped += self._seq - last_seq - 1
+                return self._frames[-1]
+
+            return self._frames[last_seq - oldest_seq + 1]
+
+    def latest_seq(self):
+        with self._cond:
+            return self._seq
+
+
+# =========================
+# CAMERA SOURCES
+# =========================
+class CameraSource:
+    """Base camera connection with measured FPS and exponential reconnect backoff."""
+
+    kind = "base"
+
+    def __init__(self, url, timeout=5, backoff_base=0.5, backoff_max=30.0):
+        self.url = url
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = None
+        self.fps = 0.0
+        self.frames = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.last_error = None
+        self._consecutive_failures = 0
+        self._last_frame_time = None
+
+    def _session(self):
+        if self.session is None:
+            # Keep-alive connection pool, reused for every request to the camera
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self.reconnects += 1
+        return self.session
+
+    def _mark_frame(self):
+        now = time.time()
+        if self._last_frame_time is not None:
+            dt = now - self._last_frame_time
+            if dt > 0:
+                # Exponential moving average so the figure reacts within a second or two
+                self.fps = 1.0 / dt if self.fps == 0 else self.fps * 0.9 + (1.0 / dt) * 0.1
+        self._last_frame_time = now
+        self.frames += 1
+        self._consecutive_failures = 0
+
+    def fail(self, error):
+        """Record a failed read, drop the connection and return seconds to wait."""
+        self.failures += 1
+        self._consecutive_failures += 1
+        self.last_error = str(error)
+        self._last_frame_time = None
+        self.close()
+        return min(self.backoff_max, self.backoff_base * (2 ** (self._consecutive_failures - 1)))
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "url": self.url,
+            "fps": round(self.fps, 2),
+            "frames": self.frames,
+            "failures": self.failures,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
+
+
+class SnapshotSource(CameraSource):
+    """Polls a single-image endpoint (IP Webcam /shot.jpg) over one keep-alive session."""
+
+    kind = "snapshot"
+
+    def read(self):
+        resp = self._session().get(self.url, timeout=self.timeout)
+        resp.raise_for_status()
+        self._mark_frame()
+        return resp.content
+
+
+class MjpegSource(CameraSource):
+    """Reads frames from one long-lived multipart MJPEG stream (IP Webcam /video)."""
+
+    kind = "mjpeg"
+
+    SOI = b"\xff\xd8"
+    EOI = b"\xff\xd9"
+    CONTENT_LENGTH = re.compile(rb"content-length:\s*(\d+)", re.IGNORECASE)
+
+    def __init__(self, url, chunk_size=16384, max_frame_bytes=8 * 1024 * 1024, **kwargs):
+        super().__init__(url, **kwargs)
+        self.chunk_size = chunk_size
+        self.max_frame_bytes = max_frame_bytes
+        self._chunks = None
+        self._buffer = b""
+
+    def _open(self):
+        resp = self._session().get(self.url, timeout=self.timeout, stream=True)
+        resp.raise_for_status()
+        self._chunks = resp.iter_content(chunk_size=self.chunk_size)
+        self._buffer = b""
+
+    def _fill(self):
+        chunk = next(self._chunks)
+        self._buffer += chunk
+        if len(self._buffer) > self.max_frame_bytes:
+            raise IOError("MJPEG stream lost frame sync")
+
+    def _next_jpeg(self):
+        """Split the next JPEG out of the stream.
+
+        Uses the part's Content-Length header when the camera sends one and
+        falls back to scanning for the JPEG end-of-image marker otherwise.
+        """
+        while True:
+            start = self._buffer.find(self.SOI)
+            if start == -1:
+                self._fill()
+                continue
+
+            match = None
+            for match in self.CONTENT_LENGTH.finditer(self._buffer, 0, start):
+                pass
+
+            if match is not None:
+                end = start + int(match.group(1))
+                while len(self._buffer) < end:
+                    self._fill()
+            else:
+                eoi = self._buffer.find(self.EOI, start + 2)
+                while eoi == -1:
+                    self._fill()
+                    eoi = self._buffer.find(self.EOI, start + 2)
+                end = eoi + 2
+
+            jpeg = self._buffer[start:end]
+            self._buffer = self._buffer[end:]
+            return jpeg
+
+    def read(self):
+        if self._chunks is None:
+            self._open()
+        try:
+            jpeg = self._next_jpeg()
+        except StopIteration:
+            raise IOError("MJPEG stream closed by camera")
+        self._mark_frame()
+        return jpeg
+
+    def close(self):
+        self._chunks = None
+        self._buffer = b""
+        super().close()
+
+
+def make_camera_source(kind, shot_url, stream_url):
+    if kind == "mjpeg":
+        return MjpegSource(stream_url)
+    return SnapshotSource(shot_url)
+
+
+# =========================
+# CAPTURED FRAME
+# =========================
+class CapturedFrame:
+    """One camera shot: original JPEG bytes plus a lazily decoded image.
+
+    Consumers that can work with the JPEG (MJPEG recording, still capture,
+    passthrough streaming) never pay for a decode; the first access to
+    ``image`` decodes once and charges the CPU time to ``cpu_account``.
+    """
+
+    def __init__(self, jpeg, timestamp, cpu_account=None):
+        self.jpeg = jpeg
+        self.timestamp = timestamp
+        self._image = None
+        self._decoded = False
+        self._cpu_account = cpu_account
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        with self._lock:
+            if not self._decoded:
+                t0 = time.thread_time()
+                self._image = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                self._decoded = True
+                if self._cpu_account is not None:
+                    self._cpu_account["decode"] += time.thread_time() - t0
+                    self._cpu_account["decoded"] += 1
+            return self._image
+
+
+# =========================
+# SINGLE-PRODUCER CAPTURE ENGINE
+# =========================
+class CaptureEngine:
+    """One background thread polls the drone camera and fans frames out to viewers.
+
+    ``frame_handler(captured)`` is called once per camera shot with a
+    ``CapturedFrame`` (video recording, still capture), so it never runs more
+    than once per shot no matter how many browsers are watching.
+
+    In ``passthrough`` mode the camera's own JPEG bytes go straight to viewers
+    and a frame is only decoded if a consumer asks for ``captured.image``.
+    ``reencode`` mode keeps the old decode + ``cv2.imencode`` path.
+    """
+
+    MODES = ("passthrough", "reencode")
+
+    def __init__(self, source, frame_handler=None, mode="passthrough",
+                 buffer_size=8, idle_timeout=10.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown stream mode: {mode}")
+        self.source = source
+        self.frame_handler = frame_handler
+        self.mode = mode
+        self.idle_timeout = idle_timeout
+        self.hub = FrameHub(buffer_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_viewer_time = 0
+        # Per-mode CPU accounting: frames, decoded frames, decode/encode/handler CPU seconds
+        self._cpu = {m: {"frames": 0, "decoded": 0, "decode": 0.0, "encode": 0.0, "handler": 0.0}
+                     for m in self.MODES}
+
+    def set_mode(self, mode):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown stream mode: {mode}")
+        self.mode = mode
+        print("🎞️ Stream mode:", mode)
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="capture-engine", daemon=True)
+                self._thread.start()
+                print(f"🎥 Capture engine started: {self.source.kind} {self.source.url}")
+
+    def _has_viewers(self):
+        with self._lock:
+            if self.hub.subscribers > 0:
+                self._last_viewer_time = time.time()
+                return True
+            return time.time() - self._last_viewer_time < self.idle_timeout
+
+    def _process(self, jpeg_bytes, now):
+        mode = self.mode
+        acct = self._cpu[mode]
+        captured = CapturedFrame(jpeg_bytes, now, acct)
+
+        if mode == "reencode":
+            frame = captured.image
+            if frame is None:
+                return
+            t0 = time.thread_time()
+            ret, buffer = cv2.imencode(".jpg", frame)
+            acct["encode"] += time.thread_time() - t0
+            if not ret:
+                return
+            jpeg_bytes = buffer.tobytes()
+
+        if self.frame_handler is not None:
+            decode_before = acct["decode"]
+            t0 = time.thread_time()
+            try:
+                self.frame_handler(captured)
+            except Exception as e:
+                print(f"⚠️ Frame handler error: {e}")
+            # A decode triggered by the handler is already booked under "decode"
+            acct["handler"] += time.thread_time() - t0 - (acct["decode"] - decode_before)
+
+        acct["frames"] += 1
+        self.hub.publish(jpeg_bytes)
+
+    def _run(self):
+        while self._has_viewers():
+            try:
+                jpeg_bytes = self.source.read()
+            except Exception as e:
+                delay = self.source.fail(e)
+                print(f"⚠️ Camera read failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if jpeg_bytes:
+                self._process(jpeg_bytes, time.time())
+
+        self.source.close()
+        print("⏸️ Capture engine idle, camera released.")
+
+    def subscribe(self):
+        """Yield encoded JPEG frames for one viewer until the client disconnects."""
+        with self._lock:
+            self.hub.subscribers += 1
+            self._last_viewer_time = time.time()
+        self._ensure_running()
+
+        last_seq = self.hub.latest_seq()
+        try:
+            while True:
+                last_seq, jpeg = self.hub.next_frame(last_seq)
+                if jpeg is None:
+                    # Producer may have gone idle between viewers
+                    self._ensure_running()
+                    continue
+                yield jpeg
+        finally:
+            with self._lock:
+                self.hub.subscribers -= 1
+
+    def cpu_stats(self):
+        """Average CPU milliseconds per streamed frame, for each stream mode."""
+        result = {}
+        for mode, acct in self._cpu.items():
+            frames = acct["frames"]
+            total = acct["decode"] + acct["encode"] + acct["handler"]
+            result[mode] = {
+                "frames": frames,
+                "decoded_frames": acct["decoded"],
+                "decode_ms": round(acct["decode"] * 1000 / frames, 3) if frames else 0,
+                "encode_ms": round(acct["encode"] * 1000 / frames, 3) if frames else 0,
+                "handler_ms": round(acct["handler"] * 1000 / frames, 3) if frames else 0,
+                "cpu_ms_per_frame": round(total * 1000 / frames, 3) if frames else 0,
+            }
+        return result
+
+    def stats(self):
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "mode": self.mode,
+            "subscribers": self.hub.subscribers,
+            "frames": self.hub.latest_seq(),
+            "dropped": self.hub.dropped,
+            "cpu": self.cpu_stats(),
+            "source": self.source.stats(),
+        }
@@ -0,0 +1,219 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+# =========================
+# CHAT INTENT ROUTER
+# =========================
+# Commands with side effects (starting a mapping run) only ever come from a pattern;
+# the classifier may only pick read-only intents.
+INTENT_PATTERNS = [
+    # A bare "status" (what the old dashboard sent) or the status of something of ours
+    ("status", re.compile(r"^(?:check\s+|show\s+|get\s+)?status$|\b(?:mapping|map|job|reconstruction|odm)\s+status\b"
+                          r"|\bstatus\s+(?:of|on|for)\s+(?:my|the|this)\s+(?:mapping|map|job|reconstruction|survey)\b")),
+    ("mapping", re.compile(r"\b(?:generate|start|run)\s+(?:3d\s+)?mapping\b|\b3d\s+mapping\b"
+                           r"|\b(?:generate|calculate)\s+volume\b")),
+    ("statistics", re.compile(r"\bhow\s+many\s+(?:images|photos|pictures|videos|clips)\s+"
+                              r"(?:were|have\s+been|has\s+been|did|got|are\s+(?:stored|saved))\b"
+                              r"|\b(?:storage|disk)\s+(?:used|usage)\b|\b(?:capture|survey)\s+stat(?:istic)?s\b")),
+    ("volume", re.compile(r"\b(?:latest|last|current)\s+(?:stockpile\s+)?volume\b"
+                          r"|\bvolume\s+(?:of|for|on)\s+(?:the\s+)?(?:latest|last|\d{4}-\d{2}-\d{2}|today|yesterday)\b")),
+]
+
+CLASSIFIER_INTENTS = ("status", "statistics", "volume")
+# The classifier only answers locally when the message also names one of our nouns or
+# verbs for that intent: "what is the volume of the moon" scores as volume but names no pile.
+# Generic words ("current", "last", "count", "processing") never qualify on their own.
+INTENT_DOMAIN_TOKENS = {
+    "status": {"mapping", "map", "job", "reconstruction", "odm", "orthophoto"},
+    "statistics": {"captured", "taken", "recorded", "storage", "disk"},
+    "volume": {"stockpile", "stockpiles", "pile", "material", "measured", "measure"},
+}
+
+TRAINING_EXAMPLES = {
+    "status": [
+        "is my mapping done", "how is the mapping job going", "progress of the processing",
+        "check progress", "is it finished yet", "any update on my map", "is the job complete",
+        "has the reconstruction finished", "where is my map", "still processing",
+    ],
+    "statistics": [
+        "how many images were captured today", "number of photos taken", "how much storage is used",
+        "storage space left", "video count", "capture statistics for today", "photos count",
+        "how many clips recorded", "images and videos today", "disk usage of the survey",
+    ],
+    "volume": [
+        "what is the stockpile volume", "show me the volume", "how much material is in the pile",
+        "cubic meters measured", "volume of the last survey", "what was the measured volume",
+        "latest volume result", "stockpile size", "how big is the stockpile", "current material volume",
+        "what is the pile volume", "tell me the stockpile volume", "stockpile volume please",
+        "what volume did the survey measure", "volume on site",
+    ],
+    "other": [
+        "what is drone mapping", "explain photogrammetry", "who are you", "what does garuda aerospace do",
+        "tell me about lidar", "how accurate is drone surveying", "what drones do you use",
+        "how does opendroneMap work", "what is an orthophoto", "safety rules for flying drones",
+        "can you help me plan a flight", "what is gsd", "hello", "thanks",
+        "how accurate is the volume estimation", "how is volume calculated", "explain the volume method",
+        "what is the volume of the moon", "volume of a sphere", "what is the volume of a cone",
+        "how do you convert volume to tonnes", "turn up the volume", "what does volume mean",
+        "how many images do i need for a good map", "how many photos should i take", "what image overlap is needed",
+        "how many pictures for a 3d model", "what camera settings for survey images", "how big should images be",
+    ],
+}
+
+# Asking how something works or what is needed, not for one of our numbers: always the LLM's
+GENERAL_QUESTION = re.compile(r"\b(?:calculated|computed|calculate|need|needed|should|explain|mean|means|formula|why)\b")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_prompt(text):
+    """Lowercase, drop punctuation, collapse whitespace: the key shared by equivalent prompts."""
+    return " ".join(_TOKEN.findall((text or "").lower()))
+
+
+class IntentClassifier:
+    """Multinomial naive Bayes over word unigrams and bigrams, trained on a few phrases per intent."""
+
+    def __init__(self, examples):
+        self.labels = list(examples)
+        self.word_counts = {label: Counter() for label in self.labels}
+        self.totals = {}
+        self.priors = {}
+        vocabulary = set()
+        total_examples = sum(len(v) for v in examples.values())
+        for label, phrases in examples.items():
+            for phrase in phrases:
+                features = self._features(phrase)
+                self.word_counts[label].update(features)
+                vocabulary.update(features)
+            self.totals[label] = sum(self.word_counts[label].values())
+            self.priors[label] = math.log(len(phrases) / total_examples)
+        self.vocabulary_size = len(vocabulary)
+
+    @staticmethod
+    def _features(text):
+        words = _TOKEN.findall(text.lower())
+        return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+    def predict(self, text):
+        """(label, probability) of the most likely intent."""
+        features = self._features(text)
+        if not features:
+            return "other", 1.0
+        scores = {}
+        for label in self.labels:
+            denominator = self.totals[label] + self.vocabulary_size
+            counts = self.word_counts[label]
+            scores[label] = self.priors[label] + sum(math.log((counts[f] + 1) / denominator) for f in features)
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        probability = 1 / sum(math.exp(s - top) for s in scores.values())
+        return best, probability
+
+
+class IntentRouter:
+    """Resolves chat messages to local intents: compiled patterns first, then the classifier.
+
+    A classifier guess is only used when it is confident, the message names
+    something of ours (``INTENT_DOMAIN_TOKENS``) and it is not a general
+    question; anything else goes to the LLM.
+    """
+
+    default_confidence = 0.9
+
+    def __init__(self, min_confidence=None):
+        self.min_confidence = self.default_confidence if min_confidence is None else min_confidence
+        self.classifier = IntentClassifier(TRAINING_EXAMPLES)
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def route(self, message):
+        """(intent, source, confidence); intent is None when the LLM should answer."""
+        normalized = normalize_prompt(message)
+        for intent, pattern in INTENT_PATTERNS:
+            if pattern.search(normalized):
+                return self._count(intent, "pattern", 1.0)
+
+        label, probability = self.classifier.predict(normalized)
+        if (label in CLASSIFIER_INTENTS and probability >= self.min_confidence
+                and INTENT_DOMAIN_TOKENS[label] & set(normalized.split())
+                and not GENERAL_QUESTION.search(normalized)):
+            return self._count(label, "classifier", round(probability, 3))
+        return self._count(None, "llm", round(probability, 3))
+
+    def _count(self, intent, source, confidence):
+        with self._lock:
+            self._counts[f"{source}:{intent or 'chat'}"] += 1
+        return intent, source, confidence
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        local = sum(v for k, v in counts.items() if not k.startswith("llm:"))
+        return {"routed": counts, "local_share": round(local / total, 3) if total else None}
+
+
+# =========================
+# LLM RESPONSE CACHE
+# =========================
+class ResponseCache:
+    """Replies to normalised prompts, kept for ``ttl`` seconds, least recently used evicted first.
+
+    Each entry remembers how long the original generation took, so a hit
+    adds that to ``saved_ms``.
+    """
+
+    def __init__(self, max_entries=500, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (reply, generation ms, stored at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def key(prompt, model):
+        return f"{model}:{normalize_prompt(prompt)}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[2] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[1] or 0
+            return entry[0]
+
+    def put(self, key, reply, generation_ms=None):
+        with self._lock:
+            self._entries[key] = (reply, generation_ms, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "saved_ms": round(self.saved_ms, 1),
+            }
@@ -0,0 +1,190 @@
+import asyncio
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+import httpx
+from openai import APITimeoutError, AsyncOpenAI
+
+
+# =========================
+# STREAMING CHAT COMPLETIONS
+# =========================
+class ChatBusy(RuntimeError):
+    """No generation slot came free within ``queue_wait``."""
+
+
+class ChatStreamer:
+    """Streams chat completions from one asyncio loop shared by every request.
+
+    A background thread runs the event loop with a single ``AsyncOpenAI``
+    client (pooled HTTP connections). ``stream`` hands a request to that loop
+    and yields events as they arrive, so the calling worker thread only
+    relays tokens. ``max_concurrent`` caps generations in flight per process;
+    a request that cannot get a slot within ``queue_wait`` seconds is turned
+    away instead of piling up. Each request's time to first token and total
+    latency are kept for ``recent()``/``stats()``.
+
+    ``base_url`` lets a local fake completion server stand in for OpenAI.
+    """
+
+    def __init__(self, api_key, model="gpt-4o-mini", base_url=None, max_concurrent=8, queue_wait=5,
+                 timeout=60, read_timeout=20, history=200):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.max_concurrent = max_concurrent
+        self.queue_wait = queue_wait
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._rejected = 0
+        self._loop = None
+        self._client = None
+        self._slots = None
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+
+    # ---------- event loop ----------
+    def start(self):
+        # Two first requests at once must not each start a loop (and each get their own slots)
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            threading.Thread(target=self._run_loop, name="chat-stream", daemon=True).start()
+            self._ready.wait()
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._client = AsyncOpenAI(
+            api_key=self.api_key or "missing",
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout, connect=5.0, read=self.read_timeout),
+            max_retries=0
+        )
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._loop = loop
+        self._ready.set()
+        loop.run_forever()
+
+    async def _generate(self, record, messages, options, events):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_wait)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._rejected += 1
+            raise ChatBusy("AI assistant is busy, please try again in a moment")
+
+        with self._lock:
+            self._active += 1
+        try:
+            record["queued_ms"] = round((time.perf_counter() - record["_t0"]) * 1000, 1)
+            stream = await self._client.chat.completions.create(
+                model=self.model, messages=messages, stream=True, **options
+            )
+            async for chunk in stream:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                if record["ttft_ms"] is None:
+                    record["ttft_ms"] = round((time.perf_counter() - record["_t0"]) * 1000, 1)
+                record["chunks"] += 1
+                events.put(("token", text))
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._active -= 1
+
+    async def _run(self, record, messages, options, events):
+        try:
+            await asyncio.wait_for(self._generate(record, messages, options, events), self.timeout)
+            record["status"] = "ok"
+        except asyncio.CancelledError:
+            record["status"] = "cancelled"
+            raise
+        except ChatBusy as e:
+            record["status"] = "rejected"
+            events.put(("error", str(e)))
+        except (asyncio.TimeoutError, APITimeoutError, httpx.TimeoutException):
+            record["status"] = "timeout"
+            events.put(("error", "AI response timed out"))
+        except Exception as e:
+            record["status"] = "error"
+            events.put(("error", str(e) or type(e).__name__))
+        finally:
+            record["total_ms"] = round((time.perf_counter() - record.pop("_t0")) * 1000, 1)
+            with self._lock:
+                self._history.append(record)
+            events.put(("done", None))
+
+    # ---------- request side ----------
+    def stream(self, messages, **options):
+        """Yield ``(event, data)``: ("token", text)..., optional ("error", message), then ("done", metrics)."""
+        self.start()
+        record = {
+            "id": uuid.uuid4().hex[:12], "model": self.model, "started_at": time.time(), "_t0": time.perf_counter(),
+            "queued_ms": None, "ttft_ms": None, "total_ms": None, "chunks": 0, "status": "running",
+        }
+        yield "start", {"id": record["id"]}
+
+        events = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._run(record, messages, options, events), self._loop)
+        try:
+            while True:
+                kind, data = events.get()
+                if kind == "done":
+                    yield "done", {k: record[k] for k in ("id", "queued_ms", "ttft_ms", "total_ms", "chunks", "status")}
+                    return
+                yield kind, data
+        finally:
+            # The browser went away mid-stream: stop generating for it
+            if not future.done():
+                future.cancel()
+
+    def complete(self, messages, **options):
+        """Whole reply as one string (clients that do not read event streams)."""
+        parts, error, metrics = [], None, None
+        for kind, data in self.stream(messages, **options):
+            if kind == "token":
+                parts.append(data)
+            elif kind == "error":
+                error = data
+            elif kind == "done":
+                metrics = data
+        if error and not parts:
+            raise RuntimeError(error)
+        return "".join(parts), metrics
+
+    # ---------- metrics ----------
+    def recent(self, limit=20):
+        with self._lock:
+            return list(self._history)[-limit:][::-1]
+
+    def stats(self):
+        with self._lock:
+            history = list(self._history)
+            active, rejected = self._active, self._rejected
+        ok = [r for r in history if r["status"] == "ok"]
+        ttft = sorted(r["ttft_ms"] for r in ok if r["ttft_ms"] is not None)
+        total = sorted(r["total_ms"] for r in ok)
+
+        def summary(values):
+            if not values:
+                return None
+            return {"avg": round(sum(values) / len(values), 1), "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))]}
+
+        return {
+            "active": active,
+            "max_concurrent": self.max_concurrent,
+            "rejected": rejected,
+            "requests": len(history),
+            "errors": sum(1 for r in history if r["status"] in ("error", "timeout")),
+            "ttft_ms": summary(ttft),
+            "total_ms": summary(total),
+        }
@@ -0,0 +1,182 @@
+"""Stand-in for the ODM container, for running the mapping pipeline without Docker.
+
+Accepts the same arguments the worker passes to ODM and writes the outputs
+the app reads back: orthophoto (GeoTIFF plus PNG preview), a float32 DSM/DTM
+pair in ``odm_dem`` and ``odm_report/stats.json``. The DSM is flat ground at
+FAKE_GROUND_Z with one 100 x 100 x 2 m box on it (20000 m³) on a 1 m grid,
+so volumes, tiles and survey comparisons have something known to measure.
+
+    ODM_COMMAND="python fake_odm.py" python odm_worker.py
+
+FAKE_ODM_SECONDS sets how long a run takes, FAKE_ODM_FAIL=1 makes it fail in the meshing stage.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+
+def tiny_png(width=64, height=64, rgb=(90, 110, 80)):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+# =========================
+# GEOTIFF OUTPUT
+# =========================
+FAKE_DEM_SIZE = 160        # pixels (1 m) per side
+FAKE_BOX = (30, 130, 2.0)  # box from pixel 30 to 130 in both axes, 2 m tall
+FAKE_ORIGIN = (500000.0, 4000000.0)
+FAKE_NODATA = -9999.0
+
+
+def write_geotiff(path, width, height, rows, samples=1, float32=True, origin=FAKE_ORIGIN,
+                  pixel=1.0, nodata=None, rows_per_strip=16):
+    """North-up little-endian GeoTIFF, Deflate strips; ``rows`` yields each row's packed bytes."""
+    bits = 32 if float32 else 8
+    strips, chunk = [], b""
+    for i, row in enumerate(rows, 1):
+        chunk += row
+        if i % rows_per_strip == 0 or i == height:
+            strips.append(zlib.compress(chunk))
+            chunk = b""
+
+    # Layout: header, strips, then the IFD and its out-of-line values
+    offsets, at = [], 8
+    for strip in strips:
+        offsets.append(at)
+        at += len(strip)
+    ifd_at = at + at % 2
+    tags = [
+        (256, 4, [width]),
+        (257, 4, [height]),
+        (258, 3, [bits] * samples),
+        (259, 3, [8]),
+        (262, 3, [2 if samples >= 3 else 1]),
+        (273, 4, offsets),
+        (277, 3, [samples]),
+        (278, 4, [rows_per_strip]),
+        (279, 4, [len(strip) for strip in strips]),
+        (284, 3, [1]),
+        (339, 3, [3 if float32 else 1] * samples),
+        (33550, 12, [pixel, pixel, 0.0]),
+        (33922, 12, [0.0, 0.0, 0.0, origin[0], origin[1], 0.0]),
+        # GeoKeyDirectory: projected, pixel-is-area, WGS 84 / UTM 33N
+        (34735, 3, [1, 1, 0, 3, 1024, 0, 1, 1, 1025, 0, 1, 1, 3072, 0, 1, 32633]),
+    ]
+    if nodata is not None:
+        tags.append((42113, 2, f"{nodata:g}".encode() + b"\x00"))
+
+    codes = {2: "s", 3: "H", 4: "I", 12: "d"}
+    extra_at = ifd_at + 2 + 12 * len(tags) + 4
+    entries, extra = [], b""
+    for tag, ftype, values in tags:
+        code = codes[ftype]
+        raw = bytes(values) if code == "s" else struct.pack(f"<{len(values)}{code}", *values)
+        if len(raw) <= 4:
+            entries.append(struct.pack("<HHI", tag, ftype, len(values)) + raw.ljust(4, b"\x00"))
+        else:
+            entries.append(struct.pack("<HHII", tag, ftype, len(values), extra_at + len(extra)))
+            extra += raw + b"\x00" * (len(raw) % 2)
+
+    with open(path, "wb") as f:
+        f.write(b"II" + struct.pack("<HI", 42, ifd_at))
+        for strip in strips:
+            f.write(strip)
+        f.write(b"\x00" * (ifd_at - at))
+        f.write(struct.pack("<H", len(tags)) + b"".join(entries) + struct.pack("<I", 0))
+        f.write(extra)
+
+
+def fake_dem_rows(ground, box=True):
+    lo, hi, height = FAKE_BOX
+    for r in range(FAKE_DEM_SIZE):
+        on_box = box and lo <= r < hi
+        yield struct.pack(f"<{FAKE_DEM_SIZE}f", *(ground + height if on_box and lo <= c < hi else ground
+                                                   for c in range(FAKE_DEM_SIZE)))
+
+
+def fake_ortho_rows():
+    lo, hi, _ = FAKE_BOX
+    for r in range(FAKE_DEM_SIZE):
+        yield b"".join(bytes((170, 150, 120) if lo <= r < hi and lo <= c < hi else (90, 110, 80))
+                       for c in range(FAKE_DEM_SIZE))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--project-path", required=True)
+    parser.add_argument("--max-concurrency", type=int, default=1)
+    parser.add_argument("--resize-to")
+    parser.add_argument("--matcher-neighbors")
+    parser.add_argument("--fast-orthophoto", action="store_true")
+    parser.add_argument("--rerun-from")
+    parser.add_argument("--rerun-all", action="store_true")
+    parser.add_argument("--split", type=int)
+    parser.add_argument("--split-overlap", type=int)
+    parser.add_argument("--sm-cluster")
+    parser.add_argument("dataset")
+    args, _ = parser.parse_known_args()
+
+    project = os.path.join(args.project_path, args.dataset)
+    images_dir = os.path.join(project, "images")
+    images = len(os.listdir(images_dir)) if os.path.isdir(images_dir) else 0
+    print(f"[fake-odm] {args.dataset}: {images} images, max-concurrency={args.max_concurrency}, "
+          f"rerun-from={args.rerun_from}, rerun-all={args.rerun_all}, split={args.split}", flush=True)
+
+    # Same stage and OpenSfM step lines as ODM, spread over the run
+    stages = ["dataset", "opensfm", "odm_filterpoints", "odm_meshing", "mvs_texturing",
+              "odm_georeferencing", "odm_orthophoto", "odm_report"]
+    opensfm_steps = ["extract_metadata", "detect_features", "match_features", "create_tracks", "reconstruct"]
+    pause = float(os.getenv("FAKE_ODM_SECONDS", 2)) / (len(stages) + len(opensfm_steps))
+    for stage in stages:
+        print(f"[INFO]    Running {stage} stage", flush=True)
+        if stage == "dataset":
+            print(f"[INFO]    Found {images} usable images", flush=True)
+        if stage == "opensfm":
+            for step in opensfm_steps:
+                print(f'[INFO]    running "/code/SuperBuild/install/bin/opensfm/bin/opensfm" {step} '
+                      f'"{project}/opensfm"', flush=True)
+                time.sleep(pause)
+        if stage == "odm_meshing" and os.getenv("FAKE_ODM_FAIL") == "1":
+            print("[ERROR]   fake-odm: simulated failure", flush=True)
+            return 1
+        time.sleep(pause)
+        print(f"[INFO]    Finished {stage} stage", flush=True)
+
+    with open(os.path.join(project, "images.json"), "w") as f:
+        json.dump(sorted(os.listdir(images_dir)) if images else [], f)
+
+    os.makedirs(os.path.join(project, "odm_orthophoto"), exist_ok=True)
+    with open(os.path.join(project, "odm_orthophoto", "odm_orthophoto.png"), "wb") as f:
+        f.write(tiny_png())
+    write_geotiff(os.path.join(project, "odm_orthophoto", "odm_orthophoto.tif"),
+                  FAKE_DEM_SIZE, FAKE_DEM_SIZE, fake_ortho_rows(), samples=3, float32=False)
+
+    ground = float(os.getenv("FAKE_GROUND_Z", 100))
+    os.makedirs(os.path.join(project, "odm_dem"), exist_ok=True)
+    for name, box in (("dsm.tif", True), ("dtm.tif", False)):
+        write_geotiff(os.path.join(project, "odm_dem", name), FAKE_DEM_SIZE, FAKE_DEM_SIZE,
+                      fake_dem_rows(ground, box), nodata=FAKE_NODATA)
+
+    os.makedirs(os.path.join(project, "odm_report"), exist_ok=True)
+    with open(os.path.join(project, "odm_report", "stats.json"), "w") as f:
+        json.dump({"volume": round(100.0 + images * 2.5, 2),
+                   "reconstruction_statistics": {"initial_shots_count": images,
+                                                 "reconstructed_shots_count": images}}, f)
+
+    print("[fake-odm] done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import base64
+import bisect
+import collections
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+
+# =========================
+# PAGINATED DIRECTORY LISTINGS
+# =========================
+CAPTURE_NAME = re.compile(r"^(\d{8}_\d{6})")
+SURVEY_NAME = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(timestamp, name, kind) key from a page cursor; ValueError for anything else."""
+    if not cursor:
+        return None
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != 3:
+        raise ValueError("Invalid cursor")
+    ts, name, kind = key
+    # Compared against (float, str, str) listing keys: a wrong type would raise TypeError in bisect
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)) or not math.isfinite(ts):
+        raise ValueError("Invalid cursor")
+    if not isinstance(name, str) or not isinstance(kind, str):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+def capture_time_from_name(name):
+    """Capture time encoded in our YYYYMMDD_HHMMSS_* file names, or None."""
+    match = CAPTURE_NAME.match(name)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+        except ValueError:
+            pass
+    return None
+
+
+def _capture_time(entry):
+    # Parsing the name saves a stat call per file
+    ts = capture_time_from_name(entry.name)
+    return ts if ts is not None else entry.stat().st_mtime
+
+
+class DirectoryIndex:
+    """Sorted, cached directory listings with keyset (cursor) pagination.
+
+    A listing is built once with ``os.scandir`` and reused until the
+    directory's mtime changes (or ``ttl`` expires for filesystems with coarse
+    mtimes). Each page is then a bisect plus a slice, so the cost of a page
+    does not grow with the number of files in the survey.
+    """
+
+    def __init__(self, max_dirs=64, ttl=30):
+        self.max_dirs = max_dirs
+        self.ttl = ttl
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key, directory, scan):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == mtime and now - cached[1] < self.ttl:
+                self._cache.move_to_end(key)
+                return cached[2]
+
+        items = scan()
+        with self._lock:
+            self._cache[key] = (mtime, now, items)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_dirs:
+                self._cache.popitem(last=False)
+        return items
+
+    def _listing(self, directory, kind, extensions):
+        def scan():
+            items = []
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.lower().endswith(extensions):
+                        items.append((_capture_time(entry), entry.name, kind))
+            items.sort()
+            return items
+
+        return self._cached((directory, kind), directory, scan)
+
+    def count(self, directory, kind, extensions):
+        return len(self._listing(directory, kind, extensions))
+
+    def page(self, sources, cursor=None, limit=50, descending=False):
+        """One page across one or more (directory, kind, extensions) sources.
+
+        Returns (items, next_cursor, total); items are (timestamp, name, kind)
+        and the cursor is the key of the last item returned.
+        """
+        after = decode_cursor(cursor)
+        tails = []
+        total = 0
+        for directory, kind, extensions in sources:
+            items = self._listing(directory, kind, extensions)
+            total += len(items)
+            if descending:
+                pos = bisect.bisect_left(items, after) if after else len(items)
+                tails.append(map(items.__getitem__, range(pos - 1, -1, -1)))
+            else:
+                pos = bisect.bisect_right(items, after) if after else 0
+                tails.append(map(items.__getitem__, range(pos, len(items))))
+
+        merged = heapq.merge(*tails, reverse=descending)
+        page = list(itertools.islice(merged, limit + 1))
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(list(page[-1]))
+        return page, next_cursor, total
+
+    def surveys(self, storage_path, cursor=None, limit=50):
+        """Survey date folders (YYYY-MM-DD), newest first."""
+        def scan():
+            with os.scandir(storage_path) as it:
+                return sorted((0, e.name, "survey") for e in it
+                              if e.is_dir() and SURVEY_NAME.match(e.name))
+
+        dates = self._cached((storage_path, "surveys"), storage_path, scan)
+        after = decode_cursor(cursor)
+        pos = bisect.bisect_left(dates, after) if after else len(dates)
+        page = dates[max(0, pos - limit - 1):pos][::-1]
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(list(page[-1]))
+        return page, next_cursor, len(dates)
@@ -0,0 +1,541 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# =========================
+# DURABLE MAPPING JOB QUEUE
+# =========================
+JOB_STATES = ("queued", "running", "reconstructed", "finishing", "completed", "failed")
+ACTIVE_STATES = ("queued", "running", "reconstructed", "finishing")
+
+# stage -> (state it claims from, state while working, state on success)
+STAGES = {
+    "all": ("queued", "running", "completed"),            # ODM + report in one process
+    "odm": ("queued", "running", "reconstructed"),        # dedicated ODM worker service
+    "finish": ("reconstructed", "finishing", "completed"),  # volume, PDF and email in the web app
+}
+
+JOB_COLUMNS = (
+    "id", "date_folder", "requester", "phone", "state", "attempts", "worker",
+    "created_at", "started_at", "finished_at", "lease_until",
+    "volume", "map_image", "geo_image", "pdf_path", "output_path", "error",
+    "cores", "mem_mb", "odm_action", "peak_mem_mb", "finish_attempts",
+)
+RESULT_COLUMNS = ("volume", "map_image", "geo_image", "pdf_path", "output_path", "odm_action")
+# Progress events that end a job's event stream
+FINAL_EVENTS = ("completed", "failed")
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    if job["started_at"]:
+        end = job["finished_at"] or time.time()
+        job["duration_s"] = round(end - job["started_at"], 1)
+    else:
+        job["duration_s"] = None
+    return job
+
+
+def _row_to_event(job_id, row):
+    return {"id": row[0], "job_id": job_id, "stage": row[1], "message": row[2],
+            "data": json.loads(row[3]) if row[3] else {}, "created_at": row[4]}
+
+
+class MappingJobQueue:
+    """Mapping jobs persisted in SQLite and executed by a small worker pool.
+
+    Every process runs its own pool against the same table; a job is claimed
+    inside a write transaction, so it only ever runs once, and ``max_running``
+    caps concurrent jobs in this pool's stage across all processes. Running
+    jobs hold a lease that their worker keeps renewing; if the process dies
+    the lease expires and the job goes back to the stage's input state; each
+    stage is retried up to ``max_attempts`` times (``attempts`` counts ODM
+    runs, ``finish_attempts`` the finish stage), then the job fails.
+
+    ``stage`` splits the work: "odm" is consumed by the ODM worker service,
+    "finish" by the web app, "all" does both in one place. ``admission``
+    (optional) is asked to ``reserve(job)`` before a claim and returns the
+    column values to record (e.g. cores/memory) or None to leave the job
+    queued; ``release(job)`` is called when it finishes.
+    """
+
+    def __init__(self, db_path, runner, workers=1, max_running=2, poll_interval=2,
+                 lease_seconds=120, max_attempts=2, stage="all", admission=None):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown mapping stage: {stage}")
+        self.db_path = db_path
+        self.runner = runner
+        self.workers = workers
+        self.max_running = max_running
+        self.stage = stage
+        self.source_state, self.active_state, self.done_state = STAGES[stage]
+        self.attempts_column = "attempts" if self.source_state == "queued" else "finish_attempts"
+        self.admission = admission
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._progress = threading.Condition()   # wakes this process's event-stream readers
+        self._threads = []
+        self._active = {}   # job id -> thread name, for lease renewal
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def init_schema(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS mapping_jobs (
+            id TEXT PRIMARY KEY,
+            date_folder TEXT NOT NULL,
+            requester TEXT,
+            phone TEXT,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            worker TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            lease_until REAL,
+            volume TEXT,
+            map_image TEXT,
+            geo_image TEXT,
+            pdf_path TEXT,
+            output_path TEXT,
+            error TEXT,
+            cores INTEGER,
+            mem_mb INTEGER,
+            odm_action TEXT,
+            peak_mem_mb INTEGER,
+            odm_telemetry TEXT,
+            finish_attempts INTEGER DEFAULT 0
+        )
+        """)
+        # Databases created before these columns existed
+        c.execute("PRAGMA table_info(mapping_jobs)")
+        existing = {row[1] for row in c.fetchall()}
+        for column, kind in (("cores", "INTEGER"), ("mem_mb", "INTEGER"), ("odm_action", "TEXT"),
+                             ("peak_mem_mb", "INTEGER"), ("odm_telemetry", "TEXT"),
+                             ("finish_attempts", "INTEGER DEFAULT 0")):
+            if column not in existing:
+                c.execute(f"ALTER TABLE mapping_jobs ADD COLUMN {column} {kind}")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_mapping_jobs_state ON mapping_jobs(state, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_mapping_jobs_requester ON mapping_jobs(requester, created_at)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS mapping_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            message TEXT,
+            data TEXT,
+            created_at REAL NOT NULL
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_mapping_events_job ON mapping_events(job_id, id)")
+        conn.close()
+
+    # ---------- producer side ----------
+    def submit(self, date_folder, requester=None, phone=None):
+        """Queue a mapping run; returns (job, created). An active job for the same date is reused."""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(f"""
+        SELECT {", ".join(JOB_COLUMNS)} FROM mapping_jobs
+        WHERE date_folder = ? AND state IN ({", ".join("?" * len(ACTIVE_STATES))})
+        ORDER BY created_at LIMIT 1
+        """, (date_folder, *ACTIVE_STATES))
+        existing = c.fetchone()
+        if existing:
+            c.execute("COMMIT")
+            conn.close()
+            return _row_to_job(existing), False
+
+        job_id = uuid.uuid4().hex[:12]
+        c.execute("""
+        INSERT INTO mapping_jobs (id, date_folder, requester, phone, state, created_at)
+        VALUES (?, ?, ?, ?, 'queued', ?)
+        """, (job_id, date_folder, requester, phone, time.time()))
+        c.execute("COMMIT")
+        conn.close()
+
+        self._wakeup.set()
+        self.record_event(job_id, "queued", f"Queued mapping for {date_folder}")
+        print(f"📥 Mapping job {job_id} queued for {date_folder}")
+        return self.get(job_id), True
+
+    def record_completed(self, date_folder, requester=None, phone=None, result=None, odm_action=None):
+        """Insert a job that is already done (e.g. served from the result cache)."""
+        result = dict(result or {}, odm_action=odm_action)
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        conn = self._connect()
+        conn.execute("""
+        INSERT INTO mapping_jobs (id, date_folder, requester, phone, state, created_at, started_at, finished_at)
+        VALUES (?, ?, ?, ?, 'completed', ?, ?, ?)
+        """, (job_id, date_folder, requester, phone, now, now, now))
+        conn.close()
+        self.update_result(job_id, result)
+        self.record_event(job_id, "completed", "Served from the mapping result cache", volume=result.get("volume"))
+        return self.get(job_id)
+
+    def update_result(self, job_id, result):
+        assignments, params = [], []
+        for column in RESULT_COLUMNS:
+            if result.get(column) is not None:
+                assignments.append(f"{column} = ?")
+                params.append(str(result[column]) if column == "volume" else result[column])
+        if not assignments:
+            return
+        conn = self._connect()
+        conn.execute(f"UPDATE mapping_jobs SET {', '.join(assignments)} WHERE id = ?", (*params, job_id))
+        conn.close()
+
+    def update_telemetry(self, job_id, telemetry):
+        """Store an ODM run summary (``OdmLogParser.summary``) on the job; never fails the job."""
+        try:
+            conn = self._connect()
+            conn.execute("UPDATE mapping_jobs SET odm_telemetry = ?, peak_mem_mb = ? WHERE id = ?",
+                         (json.dumps(telemetry), telemetry.get("peak_mem_mb"), job_id))
+            conn.close()
+        except Exception as e:
+            print(f"⚠️ ODM telemetry not recorded ({job_id}): {e}")
+
+    # ---------- progress events ----------
+    def record_event(self, job_id, stage, message=None, **data):
+        """Append a progress event (any process: web app, ODM worker); never fails the job."""
+        try:
+            conn = self._connect()
+            conn.execute("""
+            INSERT INTO mapping_events (job_id, stage, message, data, created_at) VALUES (?, ?, ?, ?, ?)
+            """, (job_id, stage, message, json.dumps(data) if data else None, time.time()))
+            conn.close()
+        except Exception as e:
+            print(f"⚠️ Mapping event not recorded ({job_id} {stage}): {e}")
+            return
+        with self._progress:
+            self._progress.notify_all()
+
+    def events(self, job_id, after_id=0):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        SELECT id, stage, message, data, created_at FROM mapping_events
+        WHERE job_id = ? AND id > ? ORDER BY id
+        """, (job_id, after_id))
+        rows = c.fetchall()
+        conn.close()
+        return [_row_to_event(job_id, row) for row in rows]
+
+    def latest_event(self, job_id):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        SELECT id, stage, message, data, created_at FROM mapping_events
+        WHERE job_id = ? ORDER BY id DESC LIMIT 1
+        """, (job_id,))
+        row = c.fetchone()
+        conn.close()
+        return _row_to_event(job_id, row) if row else None
+
+    def subscribe(self, job_id, after_id=0, poll_interval=1, heartbeat=15):
+        """SSE stream of a job's progress events, replaying those after ``after_id``; ends with the job.
+
+        Events written by this process wake the stream at once; the ODM
+        worker's land in SQLite and are picked up on the next poll.
+        """
+        last_beat = time.time()
+        while True:
+            events = self.events(job_id, after_id)
+            for event in events:
+                after_id = event["id"]
+                yield f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                if event["stage"] in FINAL_EVENTS:
+                    return
+            if not events:
+                job = self.get(job_id)
+                if job is None:
+                    return
+                if job["state"] in FINAL_EVENTS and not self.events(job_id, after_id):
+                    # Finished before events were recorded (or they were pruned)
+                    event = {"id": None, "job_id": job_id, "stage": job["state"], "message": job["error"],
+                             "data": {"volume": job["volume"]}, "created_at": job["finished_at"]}
+                    yield f"event: {job['state']}\ndata: {json.dumps(event)}\n\n"
+                    return
+            if time.time() - last_beat >= heartbeat:
+                last_beat = time.time()
+                yield ": keep-alive\n\n"
+            with self._progress:
+                self._progress.wait(poll_interval)
+
+    # ---------- reads ----------
+    def telemetry(self, job_id):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT odm_telemetry FROM mapping_jobs WHERE id = ?", (job_id,))
+        row = c.fetchone()
+        conn.close()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def stage_timings(self, limit=50):
+        """Wall time and memory per ODM stage (and OpenSfM step) over the last ``limit`` recorded runs."""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        SELECT odm_telemetry FROM mapping_jobs
+        WHERE odm_telemetry IS NOT NULL AND state != 'failed'
+        ORDER BY created_at DESC LIMIT ?
+        """, (limit,))
+        runs = [json.loads(row[0]) for row in c.fetchall()]
+        conn.close()
+
+        stages, steps = {}, {}
+        for run in runs:
+            for stage in run.get("stages", []):
+                if stage["status"] != "done" or stage["seconds"] is None:
+                    continue
+                entry = stages.setdefault(stage["stage"], {"seconds": [], "mem": []})
+                entry["seconds"].append(stage["seconds"])
+                if stage.get("peak_mem_mb"):
+                    entry["mem"].append(stage["peak_mem_mb"])
+                for step in stage.get("steps", []):
+                    if step["seconds"] is not None:
+                        steps.setdefault(f"{stage['stage']}.{step['step']}", {"seconds": [], "mem": []})["seconds"].append(step["seconds"])
+
+        def summarize(name, entry, total):
+            values = sorted(entry["seconds"])
+            return {
+                "name": name,
+                "runs": len(values),
+                "avg_s": round(sum(values) / len(values), 1),
+                "p95_s": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max_s": values[-1],
+                "share": round(sum(values) / total, 3) if total else None,
+                "peak_mem_mb": max(entry["mem"]) if entry["mem"] else None,
+            }
+
+        total = sum(sum(e["seconds"]) for e in stages.values())
+        return {
+            "runs": len(runs),
+            "stages": [summarize(name, entry, total) for name, entry in stages.items()],
+            "steps": [summarize(name, entry, total) for name, entry in steps.items()],
+        }
+
+    def get(self, job_id):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM mapping_jobs WHERE id = ?", (job_id,))
+        row = c.fetchone()
+        conn.close()
+        return _row_to_job(row)
+
+    def list(self, requester=None, state=None, limit=50):
+        where, params = [], []
+        if requester:
+            where.append("requester = ?")
+            params.append(requester)
+        if state:
+            where.append("state = ?")
+            params.append(state)
+        sql = f"SELECT {', '.join(JOB_COLUMNS)} FROM mapping_jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(sql, params)
+        rows = c.fetchall()
+        conn.close()
+        return [_row_to_job(r) for r in rows]
+
+    def latest(self, requester=None, state=None):
+        jobs = self.list(requester=requester, state=state, limit=1)
+        return jobs[0] if jobs else None
+
+    def counts(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT state, COUNT(*) FROM mapping_jobs GROUP BY state")
+        counts = {state: 0 for state in JOB_STATES}
+        counts.update(dict(c.fetchall()))
+        conn.close()
+        return counts
+
+    # ---------- worker side ----------
+    def _requeue_expired(self, c):
+        now = time.time()
+        c.execute(f"""
+        UPDATE mapping_jobs SET state = 'failed', finished_at = ?, error = 'Worker lost (lease expired)'
+        WHERE state = ? AND lease_until < ? AND COALESCE({self.attempts_column}, 0) >= ?
+        """, (now, self.active_state, now, self.max_attempts))
+        c.execute("""
+        UPDATE mapping_jobs SET state = ?, worker = NULL, lease_until = NULL
+        WHERE state = ? AND lease_until < ?
+        """, (self.source_state, self.active_state, now))
+
+    def _claim(self, thread_name):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        reserved = None
+        try:
+            self._requeue_expired(c)
+            c.execute("SELECT COUNT(*) FROM mapping_jobs WHERE state = ?", (self.active_state,))
+            if c.fetchone()[0] >= self.max_running:
+                c.execute("COMMIT")
+                return None
+
+            c.execute(f"""
+            SELECT {", ".join(JOB_COLUMNS)} FROM mapping_jobs
+            WHERE state = ? ORDER BY created_at LIMIT 1
+            """, (self.source_state,))
+            job = _row_to_job(c.fetchone())
+            if job is None:
+                c.execute("COMMIT")
+                return None
+
+            extra = {}
+            if self.admission is not None:
+                # Strict FIFO: the head of the queue waits for capacity rather than being overtaken
+                reserved = self.admission.reserve(job)
+                if reserved is None:
+                    c.execute("COMMIT")
+                    return None
+                extra = reserved
+
+            now = time.time()
+            first_stage = self.source_state == "queued"
+            assignments = ["state = ?", "worker = ?", "lease_until = ?", "error = NULL",
+                           f"{self.attempts_column} = COALESCE({self.attempts_column}, 0) + 1"]
+            params = [self.active_state, f"{self.worker_id}/{thread_name}", now + self.lease_seconds]
+            if first_stage:
+                assignments += ["started_at = ?", "finished_at = NULL"]
+                params.append(now)
+            for column, value in extra.items():
+                assignments.append(f"{column} = ?")
+                params.append(value)
+            c.execute(f"""
+            UPDATE mapping_jobs SET {", ".join(assignments)}
+            WHERE id = ? AND state = ?
+            """, (*params, job["id"], self.source_state))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            if reserved is not None:
+                self.admission.release(job)
+            raise
+        finally:
+            conn.close()
+        self.record_event(job["id"], self.active_state, f"{self.stage} stage picked up by {self.worker_id}",
+                          cores=extra.get("cores"), mem_mb=extra.get("mem_mb"))
+        return self.get(job["id"])
+
+    def _finish(self, job, state, result=None, error=None):
+        """Record the outcome, unless the job was re-claimed after our lease lapsed."""
+        result = result or {}
+        assignments = ["state = ?", "lease_until = NULL", "error = ?"]
+        params = [state, error]
+        if state in ("completed", "failed"):
+            assignments.append("finished_at = ?")
+            params.append(time.time())
+        for column in RESULT_COLUMNS:
+            if result.get(column) is not None:
+                assignments.append(f"{column} = ?")
+                params.append(str(result[column]) if column == "volume" else result[column])
+
+        conn = self._connect()
+        conn.execute(f"""
+        UPDATE mapping_jobs SET {", ".join(assignments)}
+        WHERE id = ? AND worker = ?
+        """, (*params, job["id"], job["worker"]))
+        conn.close()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                job_ids = list(self._active)
+            if not job_ids:
+                continue
+            try:
+                conn = self._connect()
+                conn.executemany(
+                    "UPDATE mapping_jobs SET lease_until = ? WHERE id = ? AND state = ?",
+                    [(time.time() + self.lease_seconds, job_id, self.active_state) for job_id in job_ids]
+                )
+                conn.close()
+            except Exception as e:
+                print(f"⚠️ Mapping lease renewal error: {e}")
+
+    def _work(self):
+        name = threading.current_thread().name
+        while True:
+            try:
+                job = self._claim(name)
+            except Exception as e:
+                print(f"⚠️ Mapping queue error: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            with self._lock:
+                self._active[job["id"]] = name
+            print(f"🚀 Mapping job {job['id']} {self.active_state} for {job['date_folder']} (attempt {job[self.attempts_column]})")
+            try:
+                result = self.runner(job)
+                self._finish(job, self.done_state, result=result)
+                self.record_event(job["id"], self.done_state, f"Mapping {self.done_state}",
+                                  volume=(result or {}).get("volume"))
+                print(f"✅ Mapping job {job['id']} {self.done_state}")
+            except Exception as e:
+                print(f"❌ Mapping job {job['id']} failed: {e}")
+                self._finish(job, "failed", error=str(e))
+                self.record_event(job["id"], "failed", str(e))
+            finally:
+                with self._lock:
+                    self._active.pop(job["id"], None)
+                if self.admission is not None:
+                    self.admission.release(job)
+                # Capacity (or a follow-up stage) may be free now
+                self._wakeup.set()
+
+    def start(self):
+        self.init_schema()
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"mapping-{self.stage}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        threading.Thread(target=self._renew_leases, name="mapping-leases", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            active = dict(self._active)
+        return {
+            "worker_id": self.worker_id,
+            "stage": self.stage,
+            "workers": self.workers,
+            "max_running": self.max_running,
+            "active_here": active,
+            "counts": self.counts(),
+            "admission": self.admission.stats() if self.admission is not None else None,
+        }
@@ -0,0 +1,84 @@
+import os
+from datetime import datetime
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+
+
+# =========================
+# MEDIA SERVING
+# =========================
+MEDIA_ROOT = "storage"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# "" (Flask streams the file), "x-sendfile" (Apache/lighttpd) or "x-accel" (nginx)
+MEDIA_OFFLOAD = os.getenv("MEDIA_OFFLOAD", "").lower()
+# nginx internal location that maps onto MEDIA_ROOT, e.g. "location /protected-media/ { internal; alias /app/storage/; }"
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media")
+
+
+def init_media(app):
+    # Flask's send_file emits X-Sendfile itself when this flag is on
+    app.use_x_sendfile = MEDIA_OFFLOAD == "x-sendfile"
+
+
+def strong_etag(path):
+    """Size + nanosecond mtime: stable across gunicorn workers, changes on any rewrite."""
+    st = os.stat(path)
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def is_past_survey(date):
+    """Survey folders from earlier days are never written to again."""
+    return date < datetime.now().strftime("%Y-%m-%d")
+
+
+def _apply_cache_headers(rv, immutable, max_age):
+    rv.cache_control.max_age = max_age
+    if immutable:
+        rv.cache_control.public = True
+        rv.cache_control.immutable = True
+    else:
+        # Always revalidate, which is a cheap 304 thanks to the ETag
+        rv.cache_control.no_cache = True
+        rv.cache_control.private = True
+
+
+def _accel_redirect(path, mimetype, as_attachment, download_name, etag, immutable, max_age):
+    rel_path = os.path.relpath(os.path.abspath(path), os.path.abspath(MEDIA_ROOT))
+    rv = Response(mimetype=mimetype or "application/octet-stream")
+    rv.headers["X-Accel-Redirect"] = f"{MEDIA_ACCEL_PREFIX}/{quote(rel_path.replace(os.sep, '/'))}"
+    if as_attachment:
+        rv.headers.set("Content-Disposition", "attachment", filename=download_name or os.path.basename(path))
+    rv.set_etag(etag)
+    rv.last_modified = datetime.fromtimestamp(os.path.getmtime(path))
+    _apply_cache_headers(rv, immutable, max_age)
+    # nginx serves the bytes and handles Range; we only answer 304s
+    return rv.make_conditional(request)
+
+
+def send_media(path, mimetype=None, as_attachment=False, download_name=None, immutable=False):
+    """send_file with strong ETags, 304 handling, byte ranges and cache policy.
+
+    Immutable content (dated captures, timestamped PDFs) is cacheable for a
+    year; everything else must revalidate. With MEDIA_OFFLOAD set, the
+    transfer is handed to the front proxy so the worker is freed at once.
+    """
+    etag = strong_etag(path)
+    max_age = IMMUTABLE_MAX_AGE if immutable else 0
+
+    inside_root = not os.path.relpath(os.path.abspath(path), os.path.abspath(MEDIA_ROOT)).startswith("..")
+    if MEDIA_OFFLOAD == "x-accel" and inside_root:
+        return _accel_redirect(path, mimetype, as_attachment, download_name, etag, immutable, max_age)
+
+    rv = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=etag,
+        max_age=max_age,
+    )
+    _apply_cache_headers(rv, immutable, max_age)
+    return rv
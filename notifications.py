@@ -0,0 +1,406 @@
+import os
+import random
+import smtplib
+import socket
+import sqlite3
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import make_msgid
+
+import requests
+
+
+# =========================
+# NOTIFICATION OUTBOX
+# =========================
+NOTIFICATION_STATES = ("pending", "sending", "sent", "failed")
+NOTIFICATION_COLUMNS = (
+    "id", "channel", "recipient", "subject", "body", "attachment_path", "attachment_name", "media_url",
+    "state", "attempts", "next_attempt_at", "worker", "lease_until", "provider_id", "error",
+    "created_at", "sent_at", "send_ms",
+)
+
+
+class NotConfigured(Exception):
+    """A channel without credentials; its messages fail at once instead of retrying."""
+
+
+class SmtpTransport:
+    """One authenticated SMTP session, kept open between messages and batches.
+
+    The connection is probed with NOOP after ``idle_seconds`` without use and
+    reopened when the server has dropped it. With no ``user`` configured it
+    sends without logging in (local relays and test sinks).
+    """
+
+    def __init__(self, host, port, user=None, password=None, sender=None, use_ssl=True, starttls=False,
+                 timeout=30, idle_seconds=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender or user
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self._smtp = None
+        self._last_used = 0
+        self.connects = 0
+
+    @property
+    def configured(self):
+        return bool(self.host and self.sender and (self.password or not self.user))
+
+    def _open(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+        self.connects += 1
+        return smtp
+
+    def _connection(self):
+        if self._smtp is not None and time.time() - self._last_used > self.idle_seconds:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP failed")
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self._smtp is None:
+            self._smtp = self._open()
+        return self._smtp
+
+    def _build(self, message):
+        msg = EmailMessage()
+        msg["Subject"] = message["subject"] or ""
+        msg["From"] = self.sender
+        msg["To"] = message["recipient"]
+        msg["Message-ID"] = make_msgid(domain=self.sender.rpartition("@")[2] or None)
+        msg.set_content(message["body"])
+        path = message["attachment_path"]
+        if path:
+            with open(path, "rb") as f:
+                msg.add_attachment(f.read(), maintype="application", subtype="pdf",
+                                   filename=message["attachment_name"] or os.path.basename(path))
+        return msg
+
+    def send(self, message):
+        if not self.configured:
+            raise NotConfigured("Email credentials not configured")
+        msg = self._build(message)
+        try:
+            self._connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Dropped between the probe and the send: one fresh session
+            self.close()
+            self._connection().send_message(msg)
+        self._last_used = time.time()
+        return msg["Message-ID"]
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+class TwilioTransport:
+    """WhatsApp messages through Twilio's REST API on one keep-alive HTTP session.
+
+    ``base_url`` points at the API host, so a local stub server can stand in
+    for Twilio.
+    """
+
+    def __init__(self, account_sid, auth_token, sender, base_url="https://api.twilio.com", timeout=30):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.sender = sender
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def configured(self):
+        return bool(self.account_sid and self.auth_token and self.sender)
+
+    def _connection(self):
+        if self._session is None:
+            session = requests.Session()
+            session.auth = (self.account_sid, self.auth_token)
+            self._session = session
+        return self._session
+
+    def send(self, message):
+        if not self.configured:
+            raise NotConfigured("Twilio credentials not configured")
+        data = {"From": self.sender, "To": message["recipient"], "Body": message["body"]}
+        if message["media_url"]:
+            data["MediaUrl"] = message["media_url"]
+        response = self._connection().post(
+            f"{self.base_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json",
+            data=data, timeout=self.timeout
+        )
+        if response.status_code >= 400:
+            raise RuntimeError(f"Twilio HTTP {response.status_code}: {response.text[:200]}")
+        return response.json().get("sid")
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class NotificationOutbox:
+    """Email/WhatsApp messages persisted in SQLite and delivered in the background.
+
+    ``enqueue`` only inserts a row. A dispatcher thread per process claims
+    due messages in batches (a short ``batch_window`` lets a burst gather
+    first), sends each channel's batch over that channel's long-lived
+    transport and records the provider id, send time and end-to-end latency.
+    Failures are retried with exponential backoff up to ``max_attempts``;
+    claims hold a lease, so messages of a crashed process are picked up
+    again by any other.
+    """
+
+    def __init__(self, db_path, transports, batch_size=20, batch_window=0.2, poll_interval=5,
+                 max_attempts=5, backoff_base=5, backoff_max=600, lease_seconds=120):
+        self.db_path = db_path
+        self.transports = transports
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            attachment_path TEXT,
+            attachment_name TEXT,
+            media_url TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,
+            worker TEXT,
+            lease_until REAL,
+            provider_id TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            send_ms REAL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(state, next_attempt_at)")
+        conn.close()
+
+    # ---------- producer side ----------
+    def enqueue(self, channel, recipient, body, subject=None, attachment_path=None, attachment_name=None,
+                media_url=None):
+        """Persist a message for delivery; returns its id."""
+        if channel not in self.transports:
+            raise ValueError(f"Unknown notification channel: {channel}")
+        now = time.time()
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        INSERT INTO notifications (channel, recipient, subject, body, attachment_path, attachment_name,
+                                   media_url, state, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+        """, (channel, recipient, subject, body, attachment_path, attachment_name, media_url, now, now))
+        notification_id = c.lastrowid
+        conn.close()
+        self._wakeup.set()
+        print(f"📮 {channel} to {recipient} queued (#{notification_id})")
+        return notification_id
+
+    # ---------- reads ----------
+    def get(self, notification_id):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(NOTIFICATION_COLUMNS)} FROM notifications WHERE id = ?", (notification_id,))
+        row = c.fetchone()
+        conn.close()
+        return dict(zip(NOTIFICATION_COLUMNS, row)) if row else None
+
+    def stats(self, window=500):
+        """Backlog per state and latency/failure figures per channel over recent deliveries."""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT state, COUNT(*) FROM notifications GROUP BY state")
+        counts = {state: 0 for state in NOTIFICATION_STATES}
+        counts.update(dict(c.fetchall()))
+        channels = {}
+        for channel in self.transports:
+            c.execute("""
+            SELECT sent_at - created_at, send_ms FROM notifications
+            WHERE channel = ? AND state = 'sent' ORDER BY id DESC LIMIT ?
+            """, (channel, window))
+            rows = c.fetchall()
+            latencies = sorted(r[0] for r in rows)
+            c.execute("SELECT COUNT(*) FROM notifications WHERE channel = ? AND state = 'failed'", (channel,))
+            failed = c.fetchone()[0]
+            c.execute("""
+            SELECT error FROM notifications WHERE channel = ? AND error IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+            """, (channel,))
+            last_error = c.fetchone()
+            channels[channel] = {
+                "sent": len(rows),
+                "failed": failed,
+                "latency_avg_s": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "latency_p95_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+                                 if latencies else None,
+                "send_avg_ms": round(sum(r[1] for r in rows) / len(rows), 1) if rows else None,
+                "last_error": last_error[0] if last_error else None,
+            }
+        conn.close()
+        return {"states": counts, "channels": channels}
+
+    # ---------- dispatcher ----------
+    def _claim(self):
+        now = time.time()
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # Messages claimed by a process that died
+            c.execute("""
+            UPDATE notifications SET state = 'pending', worker = NULL, lease_until = NULL
+            WHERE state = 'sending' AND lease_until < ?
+            """, (now,))
+            c.execute(f"""
+            SELECT {", ".join(NOTIFICATION_COLUMNS)} FROM notifications
+            WHERE state = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT ?
+            """, (now, self.batch_size))
+            batch = [dict(zip(NOTIFICATION_COLUMNS, row)) for row in c.fetchall()]
+            if batch:
+                c.execute(f"""
+                UPDATE notifications SET state = 'sending', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id IN ({", ".join("?" * len(batch))})
+                """, (self.worker_id, now + self.lease_seconds, *[m["id"] for m in batch]))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        for message in batch:
+            message["attempts"] += 1
+        return batch
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _record(self, conn, message, provider_id=None, error=None, send_ms=None, permanent=False):
+        now = time.time()
+        if error is None:
+            conn.execute("""
+            UPDATE notifications SET state = 'sent', provider_id = ?, sent_at = ?, send_ms = ?, error = NULL,
+                                     lease_until = NULL
+            WHERE id = ? AND worker = ?
+            """, (provider_id, now, send_ms, message["id"], self.worker_id))
+        elif permanent or message["attempts"] >= self.max_attempts:
+            conn.execute("""
+            UPDATE notifications SET state = 'failed', error = ?, lease_until = NULL WHERE id = ? AND worker = ?
+            """, (error, message["id"], self.worker_id))
+        else:
+            conn.execute("""
+            UPDATE notifications SET state = 'pending', error = ?, next_attempt_at = ?, worker = NULL,
+                                     lease_until = NULL
+            WHERE id = ? AND worker = ?
+            """, (error, now + self._backoff(message["attempts"]), message["id"], self.worker_id))
+
+    def _deliver(self, batch):
+        by_channel = {}
+        for message in batch:
+            by_channel.setdefault(message["channel"], []).append(message)
+
+        conn = self._connect()
+        for channel, messages in by_channel.items():
+            transport = self.transports[channel]
+            for i, message in enumerate(messages):
+                started = time.perf_counter()
+                try:
+                    provider_id = transport.send(message)
+                    send_ms = round((time.perf_counter() - started) * 1000, 1)
+                    self._record(conn, message, provider_id=provider_id, send_ms=send_ms)
+                    print(f"✅ {channel} #{message['id']} sent to {message['recipient']} ({send_ms} ms)")
+                except NotConfigured as e:
+                    self._record(conn, message, error=str(e), permanent=True)
+                    print(f"❌ {channel} #{message['id']}: {e}")
+                except Exception as e:
+                    self._record(conn, message, error=str(e))
+                    print(f"⚠️ {channel} #{message['id']} attempt {message['attempts']} failed: {e}")
+                    # The session is suspect: reconnect and put the rest of this batch back
+                    transport.close()
+                    for rest in messages[i + 1:]:
+                        conn.execute("""
+                        UPDATE notifications SET state = 'pending', worker = NULL, lease_until = NULL,
+                                                 attempts = attempts - 1
+                        WHERE id = ? AND worker = ?
+                        """, (rest["id"], self.worker_id))
+                    break
+        conn.close()
+
+    def _work(self):
+        while True:
+            try:
+                batch = self._claim()
+            except Exception as e:
+                print(f"⚠️ Notification outbox error: {e}")
+                batch = []
+
+            if not batch:
+                self._wakeup.wait(self.poll_interval)
+                if self._wakeup.is_set():
+                    self._wakeup.clear()
+                    time.sleep(self.batch_window)   # let a burst of enqueues land in one batch
+                continue
+
+            try:
+                self._deliver(batch)
+            except Exception as e:
+                print(f"⚠️ Notification delivery error: {e}")
+
+    def flush(self):
+        """Deliver everything that is due now, in the calling thread (scripts and tests)."""
+        delivered = 0
+        while True:
+            batch = self._claim()
+            if not batch:
+                return delivered
+            self._deliver(batch)
+            delivered += len(batch)
+
+    def start(self):
+        self.init_schema()
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._work, name="notification-outbox", daemon=True)
+        self._thread.start()
@@ -0,0 +1,273 @@
+"""Per-stage timings, peak memory and image counts of ODM runs, read from ODM's console output.
+
+The worker feeds every output line to ``OdmLogParser`` as it arrives and a
+``MemorySampler`` reports the container's memory use; the resulting summary
+is stored on the mapping job. A captured log can be replayed to check what
+the parser makes of it (without wall times, which only exist live):
+
+    python odm_telemetry.py storage/2024-05-01/odm.log
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+
+# =========================
+# LOG PARSING
+# =========================
+# [INFO]    Running opensfm stage / [INFO]    Finished opensfm stage
+ODM_STAGE_START = re.compile(r"\bRunning (\w+) stage\b")
+ODM_STAGE_END = re.compile(r"\bFinished (\w+) stage\b")
+# [INFO]    running "/code/SuperBuild/install/bin/opensfm/bin/opensfm" detect_features "/datasets/code/opensfm"
+OPENSFM_STEP = re.compile(r"\brunning\b.*\bopensfm\b\S*\s+(\w+)")
+ODM_USABLE_IMAGES = re.compile(r"\bFound (\d+) usable images\b")
+ODM_ERROR = re.compile(r"\[ERROR\]\s*(.+)")
+
+
+def _seconds(start, end):
+    if start is None or end is None:
+        return None
+    return round(end - start, 1)
+
+
+class OdmLogParser:
+    """Stage boundaries of one ODM run, fed one output line at a time.
+
+    A stage ends at its "Finished" line or, failing that, when the next one
+    starts. OpenSfM's sub-commands (feature extraction, matching, tracks,
+    reconstruction) are kept as the opensfm stage's steps. Memory samples
+    go to whichever stage is running.
+    """
+
+    def __init__(self, images=None, clock=time.time):
+        self.images = images
+        self.clock = clock
+        self.stages = []
+        self.peak_mem_mb = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        if self.stages and self.stages[-1]["status"] == "running":
+            return self.stages[-1]
+        return None
+
+    @staticmethod
+    def _close_step(stage, at):
+        if stage["steps"] and stage["steps"][-1]["finished_at"] is None:
+            stage["steps"][-1]["finished_at"] = at
+
+    def _close(self, stage, at, status="done"):
+        self._close_step(stage, at)
+        stage["finished_at"] = at
+        stage["status"] = status
+
+    def feed(self, line, at=None):
+        """Take one output line; returns the stage name when a new stage starts."""
+        at = self.clock() if at is None and self.clock else at
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = at
+            match = ODM_STAGE_START.search(line)
+            if match:
+                current = self._current()
+                if current:
+                    self._close(current, at)
+                self.stages.append({"stage": match.group(1), "started_at": at, "finished_at": None,
+                                    "status": "running", "peak_mem_mb": None, "images": None, "steps": []})
+                return match.group(1)
+
+            current = self._current()
+            match = ODM_STAGE_END.search(line)
+            if match:
+                if current and current["stage"] == match.group(1):
+                    self._close(current, at)
+                return None
+            match = OPENSFM_STEP.search(line)
+            if match and current:
+                self._close_step(current, at)
+                current["steps"].append({"step": match.group(1), "started_at": at, "finished_at": None})
+                return None
+            match = ODM_USABLE_IMAGES.search(line)
+            if match:
+                self.images = int(match.group(1))
+                if current:
+                    current["images"] = self.images
+                return None
+            match = ODM_ERROR.search(line)
+            if match:
+                self.error = match.group(1).strip()[:500]
+        return None
+
+    def note_memory(self, mb):
+        """One memory sample (MB) of the running container."""
+        with self._lock:
+            self.peak_mem_mb = max(self.peak_mem_mb or 0, mb)
+            current = self._current()
+            if current:
+                current["peak_mem_mb"] = max(current["peak_mem_mb"] or 0, mb)
+
+    def finish(self, returncode, at=None):
+        """Close the run: the stage still running ends "done" on success, "failed" otherwise."""
+        at = self.clock() if at is None and self.clock else at
+        with self._lock:
+            self.finished_at = at
+            current = self._current()
+            if current:
+                self._close(current, at, "done" if returncode == 0 else "failed")
+
+    def set_images(self, stage, count):
+        """Image count reported after the fact (e.g. reconstructed shots from the ODM report)."""
+        with self._lock:
+            for item in self.stages:
+                if item["stage"] == stage:
+                    item["images"] = count
+
+    def summary(self):
+        """JSON-ready run record: totals plus one entry per stage, in run order."""
+        with self._lock:
+            now = self.clock() if self.clock else None
+            stages = []
+            for item in self.stages:
+                end = item["finished_at"] if item["finished_at"] is not None else now
+                stages.append({
+                    "stage": item["stage"],
+                    "status": item["status"],
+                    "started_at": item["started_at"],
+                    "seconds": _seconds(item["started_at"], end),
+                    "peak_mem_mb": item["peak_mem_mb"],
+                    "images": item["images"],
+                    "steps": [{"step": s["step"],
+                               "seconds": _seconds(s["started_at"], s["finished_at"] if s["finished_at"] is not None else end)}
+                              for s in item["steps"]],
+                })
+            return {
+                "images": self.images,
+                "peak_mem_mb": self.peak_mem_mb,
+                "wall_s": _seconds(self.started_at, self.finished_at if self.finished_at is not None else now),
+                "error": self.error,
+                "stages": stages,
+            }
+
+
+def report_image_counts(project_dir):
+    """(images given to SfM, images reconstructed) from ODM's report, or (None, None)."""
+    try:
+        with open(os.path.join(project_dir, "odm_report", "stats.json")) as f:
+            stats = json.load(f).get("reconstruction_statistics") or {}
+    except (OSError, ValueError, AttributeError):
+        return None, None
+    return stats.get("initial_shots_count"), stats.get("reconstructed_shots_count")
+
+
+# =========================
+# MEMORY SAMPLING
+# =========================
+_MEM_UNITS = {"b": 1 / 1024 ** 2, "kib": 1 / 1024, "kb": 1 / 1024, "mib": 1, "mb": 1,
+              "gib": 1024, "gb": 1024, "tib": 1024 ** 2, "tb": 1024 ** 2}
+
+
+def parse_mem_usage(text):
+    """MB from ``docker stats`` MemUsage ("1.5GiB / 8GiB"), None when unreadable."""
+    match = re.match(r"\s*([\d.]+)\s*([a-zA-Z]+)", text or "")
+    if not match or match.group(2).lower() not in _MEM_UNITS:
+        return None
+    return round(float(match.group(1)) * _MEM_UNITS[match.group(2).lower()])
+
+
+def docker_memory_mb(container):
+    try:
+        out = subprocess.run(["docker", "stats", "--no-stream", "--format", "{{.MemUsage}}", container],
+                             capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return parse_mem_usage(out.stdout) if out.returncode == 0 else None
+
+
+def process_tree_rss_mb(pid):
+    """Resident memory (MB) of a process and all its descendants, from /proc (Linux only)."""
+    children = {}
+    rss = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        child = int(entry)
+        children.setdefault(int(fields.get("PPid", "0").strip() or 0), []).append(child)
+        rss[child] = int(fields.get("VmRSS", "0 kB").split()[0])
+
+    if pid not in rss:
+        return None
+    total_kb, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total_kb += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+    return round(total_kb / 1024)
+
+
+class MemorySampler:
+    """Calls ``read_mb()`` every ``interval`` seconds and hands non-None results to ``on_sample``."""
+
+    def __init__(self, read_mb, on_sample, interval=5):
+        self.read_mb = read_mb
+        self.on_sample = on_sample
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="odm-memory", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                mb = self.read_mb()
+                if mb is not None:
+                    self.on_sample(mb)
+            except Exception as e:
+                print(f"⚠️ ODM memory sample failed: {e}")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 35)
+
+
+def main(paths):
+    if not paths:
+        print(__doc__.strip())
+        return 2
+    for path in paths:
+        parser = OdmLogParser(clock=None)
+        with open(path, errors="replace") as f:
+            for line in f:
+                parser.feed(line.rstrip("\n"))
+        parser.finish(0 if parser.error is None else 1)
+        run = parser.summary()
+        print(f"{path}: {len(run['stages'])} stages, {run['images']} usable images"
+              + (f", error: {run['error']}" if run["error"] else ""))
+        for stage in run["stages"]:
+            steps = ", ".join(s["step"] for s in stage["steps"])
+            print(f"  {stage['stage']:<20} {stage['status']:<7} {stage['images'] or '':>6}  {steps}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,414 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from mapping_jobs import MappingJobQueue
+from odm_telemetry import MemorySampler, OdmLogParser, docker_memory_mb, process_tree_rss_mb, report_image_counts
+
+# Standalone service reads the same .env as the web app
+load_dotenv()
+
+
+ODM_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+# Days with more images than this are split into submodels of about ODM_SPLIT_SIZE images
+ODM_SPLIT_THRESHOLD = int(os.getenv("ODM_SPLIT_THRESHOLD", 600))
+ODM_SPLIT_SIZE = int(os.getenv("ODM_SPLIT_SIZE", 300))
+ODM_SPLIT_OVERLAP = int(os.getenv("ODM_SPLIT_OVERLAP", 80))   # metres
+# ClusterODM URL; submodels are then reconstructed on its nodes in parallel (without it, sequentially)
+ODM_SM_CLUSTER = os.getenv("ODM_SM_CLUSTER", "")
+
+
+def list_dataset_images(images_dir):
+    try:
+        with os.scandir(images_dir) as it:
+            return sorted((e for e in it if e.is_file() and e.name.lower().endswith(ODM_IMAGE_EXTENSIONS)),
+                          key=lambda e: e.name)
+    except OSError:
+        return []
+
+
+# =========================
+# HOST RESOURCES
+# =========================
+def host_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def host_memory_mb():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
+class ResourceScheduler:
+    """Hands out cores and memory to ODM jobs; a job only starts if its share is free.
+
+    ``reserve_cores``/``reserve_mem_mb`` are kept back for the web app and
+    the OS. A job's request is estimated from its image count and clamped
+    to what the host can ever offer, so an oversized survey still runs
+    (alone) instead of waiting forever.
+    """
+
+    def __init__(self, storage_root, total_cores=None, total_mem_mb=None, reserve_cores=1,
+                 reserve_mem_mb=2048, max_cores_per_job=None, mem_per_image_mb=48, min_job_mem_mb=2048):
+        self.storage_root = storage_root
+        self.total_cores = max(1, (total_cores or host_cores()) - reserve_cores)
+        self.total_mem_mb = max(1024, (total_mem_mb or host_memory_mb()) - reserve_mem_mb)
+        self.max_cores_per_job = min(max_cores_per_job or self.total_cores, self.total_cores)
+        self.mem_per_image_mb = mem_per_image_mb
+        self.min_job_mem_mb = min_job_mem_mb
+        self._lock = threading.Lock()
+        self._used = {}   # job id -> (cores, mem_mb)
+        self.waits = 0
+
+    def estimate(self, job):
+        images = len(list_dataset_images(os.path.join(self.storage_root, job["date_folder"], "images")))
+        if images > ODM_SPLIT_THRESHOLD:
+            # Split runs only hold one submodel in memory at a time
+            images = ODM_SPLIT_SIZE
+        mem_mb = max(self.min_job_mem_mb, images * self.mem_per_image_mb)
+        return self.max_cores_per_job, min(mem_mb, self.total_mem_mb)
+
+    def reserve(self, job):
+        cores, mem_mb = self.estimate(job)
+        with self._lock:
+            used_cores = sum(c for c, _ in self._used.values())
+            used_mem = sum(m for _, m in self._used.values())
+            free_cores = self.total_cores - used_cores
+            free_mem = self.total_mem_mb - used_mem
+            if mem_mb > free_mem or free_cores < 1:
+                self.waits += 1
+                return None
+            # Take fewer cores rather than wait; ODM scales down fine
+            cores = min(cores, free_cores)
+            self._used[job["id"]] = (cores, mem_mb)
+        return {"cores": cores, "mem_mb": mem_mb}
+
+    def release(self, job):
+        with self._lock:
+            self._used.pop(job["id"], None)
+
+    def stats(self):
+        with self._lock:
+            used = dict(self._used)
+        return {
+            "total_cores": self.total_cores,
+            "total_mem_mb": self.total_mem_mb,
+            "used_cores": sum(c for c, _ in used.values()),
+            "used_mem_mb": sum(m for _, m in used.values()),
+            "jobs": {job_id: {"cores": c, "mem_mb": m} for job_id, (c, m) in used.items()},
+            "waits": self.waits,
+        }
+
+
+# =========================
+# ODM EXECUTION
+# =========================
+ODM_IMAGE = os.getenv("ODM_IMAGE", "opendronemap/odm")
+# Run a local executable instead of Docker, e.g. "python fake_odm.py" in development
+ODM_COMMAND = os.getenv("ODM_COMMAND", "")
+ODM_TIMEOUT = int(os.getenv("ODM_TIMEOUT_SECONDS", 6 * 3600))
+# Reconstruction yields the CPU to the web app when both want it:
+# a niceness for local ODM_COMMAND runs, relative CPU shares (default 1024) for the container
+ODM_NICE = int(os.getenv("ODM_NICE", 10))
+ODM_CPU_SHARES = int(os.getenv("ODM_CPU_SHARES", 256))
+# docker stats takes a second or two per call, so sample sparingly
+ODM_MEM_SAMPLE_SECONDS = float(os.getenv("ODM_MEM_SAMPLE_SECONDS", 10))
+# --dsm gives the volume engine a surface model to measure,
+# --build-overviews lets the map tile server read zoomed-out tiles from internal overviews
+ODM_OPTIONS = ["--fast-orthophoto", "--dsm", "--build-overviews", "--resize-to", "1200", "--matcher-neighbors", "4"]
+
+
+# Pipeline stages (in order) and the file each one leaves behind with ODM_OPTIONS
+ODM_STAGE_OUTPUTS = [
+    ("dataset", "images.json"),
+    ("opensfm", os.path.join("opensfm", "reconstruction.json")),
+    ("odm_filterpoints", os.path.join("odm_filterpoints", "point_cloud.ply")),
+    ("odm_meshing", os.path.join("odm_meshing", "odm_25dmesh.ply")),
+    ("mvs_texturing", os.path.join("odm_texturing_25d", "odm_textured_model_geo.obj")),
+    ("odm_georeferencing", os.path.join("odm_georeferencing", "odm_georeferenced_model.laz")),
+    ("odm_dem", os.path.join("odm_dem", "dsm.tif")),   # --dsm: the surface the volume engine measures
+    ("odm_orthophoto", os.path.join("odm_orthophoto", "odm_orthophoto.tif")),
+    ("odm_report", os.path.join("odm_report", "stats.json")),
+]
+RUN_MANIFEST = "odm_run.json"
+
+
+def dataset_fingerprint(images_dir, options):
+    """Hash of the image set (names, sizes, mtimes) and the ODM options used on it."""
+    h = hashlib.sha256()
+    h.update(json.dumps(options).encode())
+    count = 0
+    for entry in list_dataset_images(images_dir):
+        st = entry.stat()
+        h.update(f"{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+        count += 1
+    return h.hexdigest(), count
+
+
+def read_run_manifest(project_dir):
+    try:
+        with open(os.path.join(project_dir, RUN_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_run_manifest(project_dir, **fields):
+    path = os.path.join(project_dir, RUN_MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(fields, f, indent=2)
+    os.replace(tmp, path)
+
+
+def first_missing_stage(project_dir):
+    for stage, output in ODM_STAGE_OUTPUTS:
+        if not os.path.exists(os.path.join(project_dir, output)):
+            return stage
+    return None
+
+
+def has_mapping_outputs(project_dir):
+    """Orthophoto and DSM both present (a run is only reusable when volumes can be measured)."""
+    if not os.path.exists(os.path.join(project_dir, "odm_dem", "dsm.tif")):
+        return False
+    return any(os.path.exists(os.path.join(project_dir, "odm_orthophoto", name))
+               for name in ("odm_orthophoto.tif", "odm_orthophoto.png"))
+
+
+def plan_odm_run(project_dir, fingerprint, options):
+    """Decide how much of the pipeline to (re)run; returns (action, extra ODM args).
+
+    - "skip": same inputs and options as a completed run whose outputs exist
+    - "resume": same inputs, previous run died part-way: rerun from the first stage with no output
+    - "full": first run, images added/changed, or the ODM options changed; every stage runs
+
+    Only "skip" and "resume" save work. There is deliberately no incremental
+    path for added images: ODM cannot fold new images into an existing
+    reconstruction, so adding images to a survey costs a full reprocess
+    (run in place with --rerun-from dataset when the options are unchanged,
+    rather than wiping the project with --rerun-all). Large days are split
+    into submodels, but those only run in parallel when ODM_SM_CLUSTER
+    points at a ClusterODM; otherwise they run one after another here.
+    """
+    manifest = read_run_manifest(project_dir)
+    if manifest and manifest.get("fingerprint") == fingerprint:
+        if manifest.get("status") == "completed" and has_mapping_outputs(project_dir):
+            return "skip", []
+        # "update" is what in-place reprocesses were called in older manifests
+        if manifest.get("action") == "update" or manifest.get("args", [])[:2] == ["--rerun-from", "dataset"]:
+            # Later stages may still hold outputs from the old image set: reprocess again
+            return "full", ["--rerun-from", "dataset"]
+        stage = first_missing_stage(project_dir)
+        return "resume", ["--rerun-from", stage or "odm_report"]
+
+    if manifest and manifest.get("options") == options and os.path.exists(os.path.join(project_dir, "images.json")):
+        return "full", ["--rerun-from", "dataset"]
+
+    return "full", ["--rerun-all"] if manifest else []
+
+
+def split_args(image_count):
+    if image_count <= ODM_SPLIT_THRESHOLD:
+        return []
+    args = ["--split", str(ODM_SPLIT_SIZE), "--split-overlap", str(ODM_SPLIT_OVERLAP)]
+    if ODM_SM_CLUSTER:
+        args += ["--sm-cluster", ODM_SM_CLUSTER]
+    return args
+
+
+def build_odm_command(storage_path, date_folder, cores, mem_mb, extra_args=(), container=None):
+    odm_args = ODM_OPTIONS + ["--max-concurrency", str(cores)] + list(extra_args)
+    if ODM_COMMAND:
+        # nice in argv rather than os.nice in preexec_fn, which is not fork-safe in a threaded process
+        nice = ["nice", "-n", str(ODM_NICE)] if ODM_NICE and shutil.which("nice") else []
+        return nice + shlex.split(ODM_COMMAND) + ["--project-path", storage_path] + odm_args + [date_folder]
+
+    return [
+        "docker", "run", "--rm",
+    ] + (["--name", container] if container else []) + [
+        "--cpus", str(cores),
+        "--cpu-shares", str(ODM_CPU_SHARES),
+        "--memory", f"{mem_mb}m",
+        "--memory-swap", f"{mem_mb}m",   # no swap: fail fast instead of thrashing the host
+        "-v", f"{storage_path}:/datasets",
+        ODM_IMAGE,
+        "--project-path", "/datasets",
+    ] + odm_args + [date_folder]
+
+
+def docker_available():
+    if not shutil.which("docker"):
+        return False
+    return subprocess.run(["docker", "ps"], capture_output=True).returncode == 0
+
+
+def _pump_output(stream, log, on_line):
+    """Copy ODM's output to the log file line by line, handing each line to ``on_line``."""
+    for raw in iter(stream.readline, b""):
+        log.write(raw)
+        log.flush()
+        try:
+            on_line(raw.decode("utf-8", "replace").rstrip())
+        except Exception as e:
+            print(f"⚠️ ODM output handler error: {e}")
+
+
+def run_odm(date_folder, storage_root="storage", cores=None, mem_mb=None, progress=None, telemetry=None):
+    """Run (or reuse) one ODM reconstruction with explicit CPU/memory caps.
+
+    Returns (output folder, action) where action is one of plan_odm_run's.
+    ``progress(stage, message, **data)`` is told about the dataset scan and
+    each ODM stage as the container reports it. ``telemetry(summary)`` gets
+    the per-stage timings, memory peaks and image counts at every stage
+    boundary and once more when ODM exits (also on failure); the final
+    summary is kept in the run manifest too.
+    """
+    progress = progress or (lambda *args, **kwargs: None)
+    telemetry = telemetry or (lambda summary: None)
+    storage_path = os.path.abspath(storage_root)
+    output_folder = os.path.join(storage_path, date_folder)
+    cores = cores or host_cores()
+    mem_mb = mem_mb or host_memory_mb()
+
+    if not ODM_COMMAND and not docker_available():
+        print("⚠️ Docker not found or not running. Entering SIMULATION MODE.")
+        time.sleep(3) # Simulate some processing time
+        return output_folder, "simulated" # Return path even if empty for simulation
+
+    fingerprint, image_count = dataset_fingerprint(os.path.join(output_folder, "images"), ODM_OPTIONS)
+    action, rerun_args = plan_odm_run(output_folder, fingerprint, ODM_OPTIONS)
+    progress("dataset_scan", f"{image_count} images, ODM run: {action}", images=image_count, action=action)
+    if action == "skip":
+        print(f"♻️ ODM outputs for {date_folder} are current ({image_count} images), skipping run")
+        return output_folder, action
+
+    extra_args = rerun_args + split_args(image_count)
+    container = None if ODM_COMMAND else f"odm-{re.sub(r'[^A-Za-z0-9_.-]', '_', date_folder)}-{uuid.uuid4().hex[:8]}"
+    cmd = build_odm_command(storage_path, date_folder, cores, mem_mb, extra_args, container=container)
+    log_path = os.path.join(output_folder, "odm.log")
+    os.makedirs(output_folder, exist_ok=True)
+    write_run_manifest(output_folder, fingerprint=fingerprint, options=ODM_OPTIONS, images=image_count,
+                       status="running", action=action, args=extra_args, started_at=time.time())
+
+    print(f"🚀 Running ODM Mapping for: {date_folder} ({action}, {image_count} images, "
+          f"{cores} cores, {mem_mb} MB) {' '.join(extra_args)}")
+    parser = OdmLogParser(images=image_count)
+
+    def on_line(line):
+        stage = parser.feed(line)
+        if stage:
+            progress("odm_stage", f"ODM {stage} stage", step=stage)
+            telemetry(parser.summary())
+
+    started = time.time()
+    with open(log_path, "ab") as log:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        pump = threading.Thread(target=_pump_output, args=(proc.stdout, log, on_line),
+                                name=f"odm-log-{date_folder}", daemon=True)
+        pump.start()
+        sampler = MemorySampler(
+            (lambda: docker_memory_mb(container)) if container else (lambda: process_tree_rss_mb(proc.pid)),
+            parser.note_memory, interval=ODM_MEM_SAMPLE_SECONDS
+        )
+        sampler.start()
+        try:
+            returncode = proc.wait(timeout=ODM_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            if container:
+                # Killing the docker client leaves the container running
+                subprocess.run(["docker", "kill", container], capture_output=True)
+            returncode = None
+        sampler.stop()
+        pump.join(timeout=10)
+
+    parser.finish(returncode)
+    sfm_images, reconstructed = report_image_counts(output_folder)
+    if reconstructed is not None:
+        parser.set_images("opensfm", reconstructed)
+    summary = dict(parser.summary(), sfm_images=sfm_images, reconstructed_images=reconstructed)
+    telemetry(summary)
+
+    status = "completed" if returncode == 0 else "failed"
+    write_run_manifest(output_folder, fingerprint=fingerprint, options=ODM_OPTIONS, images=image_count,
+                       status=status, action=action, args=extra_args, started_at=started,
+                       finished_at=time.time(), returncode=returncode, telemetry=summary)
+
+    if returncode is None:
+        raise RuntimeError(f"ODM timed out after {ODM_TIMEOUT}s")
+    if returncode != 0:
+        raise RuntimeError(f"ODM exited with code {returncode} (see {log_path})")
+    return output_folder, action
+
+
+# =========================
+# WORKER SERVICE
+# =========================
+def run_odm_job(job, storage_root="storage", progress=None, telemetry=None):
+    output_path, action = run_odm(job["date_folder"], storage_root, job.get("cores"), job.get("mem_mb"),
+                                  progress=progress, telemetry=telemetry)
+    return {"output_path": output_path, "odm_action": action}
+
+
+def make_scheduler(storage_root="storage"):
+    return ResourceScheduler(
+        storage_root,
+        reserve_cores=int(os.getenv("ODM_RESERVE_CORES", 1)),
+        reserve_mem_mb=int(os.getenv("ODM_RESERVE_MEM_MB", 2048)),
+        max_cores_per_job=int(os.getenv("ODM_MAX_CORES_PER_JOB", 0)) or None,
+        mem_per_image_mb=int(os.getenv("ODM_MEM_PER_IMAGE_MB", 48)),
+        min_job_mem_mb=int(os.getenv("ODM_MIN_JOB_MEM_MB", 2048))
+    )
+
+
+def main():
+    db_path = os.getenv("DB_NAME", "database.db")
+    storage_root = os.getenv("STORAGE_ROOT", "storage")
+
+    scheduler = make_scheduler(storage_root)
+    queue = MappingJobQueue(
+        db_path,
+        lambda job: run_odm_job(job, storage_root,
+                                progress=lambda *args, **kwargs: queue.record_event(job["id"], *args, **kwargs),
+                                telemetry=lambda summary: queue.update_telemetry(job["id"], summary)),
+        stage="odm",
+        admission=scheduler,
+        # The scheduler is the real limit; threads only bound how many can be in flight
+        workers=int(os.getenv("ODM_WORKER_SLOTS", scheduler.total_cores)),
+        max_running=int(os.getenv("ODM_MAX_RUNNING", 1000))
+    )
+    queue.start()
+    print(f"🛠️ ODM worker ready: {scheduler.total_cores} cores, {scheduler.total_mem_mb} MB schedulable")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("👋 ODM worker stopped")
+
+
+if __name__ == "__main__":
+    main()
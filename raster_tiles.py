@@ -0,0 +1,682 @@
+import collections
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# =========================
+# MEMORY-MAPPED GEOTIFF
+# =========================
+# Baseline TIFF / GeoTIFF tags we need to locate and decode blocks
+TAG_NEW_SUBFILE_TYPE = 254
+TAG_WIDTH = 256
+TAG_HEIGHT = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIG = 284
+TAG_PREDICTOR = 317
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_SAMPLE_FORMAT = 339
+GEOTIFF_PIXEL_SCALE = 33550
+GEOTIFF_TIEPOINT = 33922
+GDAL_NODATA = 42113
+
+# TIFF field type -> struct code
+FIELD_TYPES = {1: "B", 2: "s", 3: "H", 4: "I", 5: "II", 6: "b", 7: "B", 8: "h",
+               9: "i", 10: "ii", 11: "f", 12: "d", 16: "Q", 17: "q", 18: "Q"}
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+
+SUBFILE_REDUCED = 0x1
+SUBFILE_MASK = 0x4
+
+
+class UnsupportedTiff(ValueError):
+    """The file uses a layout this reader does not decode (install rasterio for those)."""
+
+
+class TiffLevel:
+    """One image directory: full resolution or one of its overviews."""
+
+    def __init__(self, tags, byte_order):
+        self.width = int(tags[TAG_WIDTH][0])
+        self.height = int(tags[TAG_HEIGHT][0])
+        self.samples = int(tags.get(TAG_SAMPLES_PER_PIXEL, (1,))[0])
+        bits = int(tags.get(TAG_BITS_PER_SAMPLE, (1,))[0])
+        fmt = int(tags.get(TAG_SAMPLE_FORMAT, (1,))[0])
+        self.compression = int(tags.get(TAG_COMPRESSION, (COMPRESSION_NONE,))[0])
+        self.predictor = int(tags.get(TAG_PREDICTOR, (1,))[0])
+
+        if int(tags.get(TAG_PLANAR_CONFIG, (1,))[0]) != 1:
+            raise UnsupportedTiff("planar (band-separate) TIFFs are not supported")
+        if self.compression != COMPRESSION_NONE and self.compression not in COMPRESSION_DEFLATE:
+            raise UnsupportedTiff(f"TIFF compression {self.compression} is not supported")
+        if bits not in (8, 16, 32, 64):
+            raise UnsupportedTiff(f"{bits}-bit samples are not supported")
+        kind = {1: "u", 2: "i", 3: "f"}.get(fmt)
+        if kind is None:
+            raise UnsupportedTiff(f"sample format {fmt} is not supported")
+        self.dtype = np.dtype(f"{byte_order}{kind}{bits // 8}")
+
+        if TAG_TILE_OFFSETS in tags:
+            self.block_w = int(tags[TAG_TILE_WIDTH][0])
+            self.block_h = int(tags[TAG_TILE_LENGTH][0])
+            self.offsets = tags[TAG_TILE_OFFSETS]
+            self.counts = tags[TAG_TILE_BYTE_COUNTS]
+            self.tiled = True
+        else:
+            self.block_w = self.width
+            self.block_h = min(int(tags.get(TAG_ROWS_PER_STRIP, (self.height,))[0]), self.height)
+            self.offsets = tags[TAG_STRIP_OFFSETS]
+            self.counts = tags[TAG_STRIP_BYTE_COUNTS]
+            self.tiled = False
+        self.blocks_across = -(-self.width // self.block_w)
+        self.blocks_down = -(-self.height // self.block_h)
+
+
+class MappedTiff:
+    """A GeoTIFF memory-mapped read-only and decoded block by block on demand.
+
+    Only the TIFF blocks (tiles or strips) that intersect a requested window
+    are decompressed, and a small LRU keeps the recently used ones, so reading
+    a window from a multi-gigabyte orthophoto costs a few blocks of memory
+    instead of the whole image. Internal overviews (``gdaladdo`` / ODM
+    ``--build-overviews``) are exposed as extra levels for zoomed-out reads.
+    Handles classic and BigTIFF, pixel-interleaved, uncompressed or Deflate
+    with horizontal/floating-point predictors, i.e. what ODM writes.
+    """
+
+    def __init__(self, path, cache_bytes=64 * 1024 * 1024):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise UnsupportedTiff("empty file")
+        self._lock = threading.Lock()
+        self._blocks = collections.OrderedDict()
+        self._cache_bytes = 0
+        self.cache_limit = cache_bytes
+
+        try:
+            directories = self._parse()
+        except Exception:
+            self.close()
+            raise
+        first = directories[0]
+        self.levels = [TiffLevel(first, self._order)]
+        for tags in directories[1:]:
+            subfile = int(tags.get(TAG_NEW_SUBFILE_TYPE, (0,))[0])
+            if subfile & SUBFILE_REDUCED and not subfile & SUBFILE_MASK:
+                self.levels.append(TiffLevel(tags, self._order))
+        self.levels.sort(key=lambda level: -level.width)
+
+        base = self.levels[0]
+        self.width, self.height, self.samples, self.dtype = base.width, base.height, base.samples, base.dtype
+        scale = first.get(GEOTIFF_PIXEL_SCALE, (1.0, 1.0, 0.0))
+        tie = first.get(GEOTIFF_TIEPOINT, (0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+        self.pixel_w, self.pixel_h = float(scale[0]), float(scale[1])
+        self.origin_x = float(tie[3]) - float(tie[0]) * self.pixel_w
+        self.origin_y = float(tie[4]) + float(tie[1]) * self.pixel_h
+        nodata = first.get(GDAL_NODATA)
+        nodata = nodata.decode(errors="ignore").strip("\x00 ") if isinstance(nodata, bytes) else None
+        self.nodata = float(nodata) if nodata else None
+
+    # ---------- header parsing ----------
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self._order + fmt, self._mm, offset)
+
+    def _parse(self):
+        mm = self._mm
+        if mm[:2] == b"II":
+            self._order = "<"
+        elif mm[:2] == b"MM":
+            self._order = ">"
+        else:
+            raise UnsupportedTiff("not a TIFF file")
+
+        magic = self._unpack("H", 2)[0]
+        if magic == 42:
+            self._big = False
+            offset = self._unpack("I", 4)[0]
+        elif magic == 43:
+            self._big = True
+            offset = self._unpack("Q", 8)[0]
+        else:
+            raise UnsupportedTiff(f"bad TIFF magic {magic}")
+
+        directories = []
+        seen = set()
+        while offset and offset not in seen and len(directories) < 64:
+            seen.add(offset)
+            tags, offset = self._read_ifd(offset)
+            directories.append(tags)
+        if not directories:
+            raise UnsupportedTiff("TIFF has no image directory")
+        return directories
+
+    def _read_ifd(self, offset):
+        if self._big:
+            count, entry_size, head = self._unpack("Q", offset)[0], 20, 8
+            entry_fmt, inline = "HHQ", 8
+        else:
+            count, entry_size, head = self._unpack("H", offset)[0], 12, 2
+            entry_fmt, inline = "HHI", 4
+
+        tags = {}
+        for i in range(count):
+            pos = offset + head + i * entry_size
+            tag, ftype, n = self._unpack(entry_fmt, pos)
+            code = FIELD_TYPES.get(ftype)
+            if code is None:
+                continue
+            size = struct.calcsize(code) * n
+            value_pos = pos + 4 + (8 if self._big else 4)
+            if size > inline:
+                value_pos = self._unpack("Q" if self._big else "I", value_pos)[0]
+
+            if code == "s":
+                tags[tag] = bytes(self._mm[value_pos:value_pos + n])
+            elif code in ("II", "ii"):
+                raw = self._unpack(code[0] * (2 * n), value_pos)
+                tags[tag] = tuple(raw[k] / raw[k + 1] if raw[k + 1] else 0.0 for k in range(0, len(raw), 2))
+            elif n > 16:
+                # Offset / byte-count tables can hold millions of entries: view them, don't box them
+                tags[tag] = np.frombuffer(self._mm, dtype=np.dtype(self._order + code), count=n, offset=value_pos)
+            else:
+                tags[tag] = self._unpack(code * n, value_pos)
+
+        next_pos = offset + head + count * entry_size
+        next_offset = self._unpack("Q" if self._big else "I", next_pos)[0]
+        return tags, next_offset
+
+    # ---------- block decoding ----------
+    def _decode(self, level, index):
+        offset, count = int(level.offsets[index]), int(level.counts[index])
+        rows = level.block_h
+        if not level.tiled:
+            rows = min(level.block_h, level.height - (index // level.blocks_across) * level.block_h)
+        shape = (rows, level.block_w, level.samples)
+        itemsize = level.dtype.itemsize
+        expected = rows * level.block_w * level.samples * itemsize
+
+        if count == 0:   # sparse block (GDAL SPARSE_OK): nothing was ever written here
+            return np.zeros(shape, dtype=level.dtype)
+        raw = memoryview(self._mm)[offset:offset + count]
+        if level.compression == COMPRESSION_NONE:
+            if level.predictor == 1:
+                # Uncompressed: a zero-copy view straight onto the mapped file
+                return np.frombuffer(raw, dtype=level.dtype, count=expected // itemsize).reshape(shape)
+            data = bytes(raw)
+        else:
+            data = zlib.decompress(raw)
+        buf = np.frombuffer(data, dtype=np.uint8, count=expected)
+
+        if level.predictor == 3:
+            # Floating-point predictor: byte-wise differencing over byte-planed (big-endian) rows
+            row_bytes = buf.reshape(rows, -1)
+            row_bytes = np.cumsum(row_bytes, axis=1, dtype=np.uint8)
+            planes = row_bytes.reshape(rows, itemsize, level.block_w * level.samples)
+            values = np.ascontiguousarray(planes.transpose(0, 2, 1)).view(level.dtype.newbyteorder(">"))
+            return values.reshape(shape)
+
+        block = buf.view(level.dtype).reshape(shape)
+        if level.predictor == 2:
+            # Horizontal differencing: integer wrap-around is exactly what the encoder relied on
+            block = np.cumsum(block, axis=1, dtype=level.dtype)
+        return block
+
+    def _block(self, level_index, index):
+        key = (level_index, index)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                return block
+
+        block = self._decode(self.levels[level_index], index)
+
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self._cache_bytes += block.nbytes
+                while self._cache_bytes > self.cache_limit and len(self._blocks) > 1:
+                    _, old = self._blocks.popitem(last=False)
+                    self._cache_bytes -= old.nbytes
+        return block
+
+    # ---------- windows ----------
+    def read_window(self, r0, r1, c0, c1, level=0):
+        """Pixels [r0:r1, c0:c1] of one level as a (rows, cols, bands) array."""
+        lv = self.levels[level]
+        r0, r1 = max(0, r0), min(lv.height, r1)
+        c0, c1 = max(0, c0), min(lv.width, c1)
+        out = np.zeros((max(0, r1 - r0), max(0, c1 - c0), lv.samples), dtype=lv.dtype.newbyteorder("="))
+        if r1 <= r0 or c1 <= c0:
+            return out
+
+        for by in range(r0 // lv.block_h, (r1 - 1) // lv.block_h + 1):
+            top = by * lv.block_h
+            for bx in range(c0 // lv.block_w, (c1 - 1) // lv.block_w + 1):
+                left = bx * lv.block_w
+                block = self._block(level, by * lv.blocks_across + bx)
+                br0, br1 = max(r0, top), min(r1, top + block.shape[0])
+                bc0, bc1 = max(c0, left), min(c1, left + block.shape[1])
+                out[br0 - r0:br1 - r0, bc0 - c0:bc1 - c0] = block[br0 - top:br1 - top, bc0 - left:bc1 - left]
+        return out
+
+    def read_decimated(self, step, level=0):
+        """Every ``step``-th pixel of a level, read one block row at a time."""
+        lv = self.levels[level]
+        rows = []
+        for top in range(0, lv.height, lv.block_h):
+            strip = self.read_window(top, min(top + lv.block_h, lv.height), 0, lv.width, level=level)
+            first = (-top) % step
+            rows.append(strip[first::step, ::step])
+        return np.concatenate(rows, axis=0)
+
+    def level_for_scale(self, scale):
+        """Index of the coarsest level whose downsampling factor is still <= ``scale``."""
+        best = 0
+        for i, lv in enumerate(self.levels):
+            if self.width / lv.width <= scale + 1e-9:
+                best = i
+        return best
+
+    def band(self, index=0):
+        return TiffBand(self, index)
+
+    def close(self):
+        with self._lock:
+            self._blocks.clear()
+            self._cache_bytes = 0
+        try:
+            self._mm.close()
+        except (AttributeError, BufferError):
+            pass   # zero-copy views still alive; the mapping goes with them
+        self._file.close()
+
+
+class TiffBand:
+    """One band of a MappedTiff, sliceable like a 2-D array (``[r0:r1, c0:c1]`` or ``[rows, cols]``)."""
+
+    def __init__(self, tiff, index=0):
+        self.tiff = tiff
+        self.index = index
+        self.shape = (tiff.height, tiff.width)
+        self.dtype = tiff.dtype
+
+    def __getitem__(self, key):
+        rows, cols = key
+        if isinstance(rows, slice) and isinstance(cols, slice):
+            r0, r1, _ = rows.indices(self.shape[0])
+            c0, c1, _ = cols.indices(self.shape[1])
+            return self.tiff.read_window(r0, r1, c0, c1)[:, :, self.index]
+
+        # Point lookups: group by block so each block is decoded once
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        lv = self.tiff.levels[0]
+        out = np.empty(rows.shape, dtype=self.dtype.newbyteorder("="))
+        block_ids = (rows // lv.block_h) * lv.blocks_across + cols // lv.block_w
+        for block_id in np.unique(block_ids):
+            sel = block_ids == block_id
+            block = self.tiff._block(0, int(block_id))
+            top = (block_id // lv.blocks_across) * lv.block_h
+            left = (block_id % lv.blocks_across) * lv.block_w
+            out[sel] = block[rows[sel] - top, cols[sel] - left, self.index]
+        return out
+
+    def close(self):
+        self.tiff.close()
+
+
+def open_geotiff(path):
+    return MappedTiff(path)
+
+
+# =========================
+# RENDERING
+# =========================
+# Elevation ramp for DEM tiles: (fraction of the value range, RGB)
+DEM_RAMP = [
+    (0.00, (32, 96, 48)),
+    (0.25, (120, 170, 80)),
+    (0.50, (230, 220, 140)),
+    (0.75, (180, 120, 70)),
+    (1.00, (250, 250, 250)),
+]
+
+
+def to_rgba(pixels, value_range=None, nodata=None):
+    """(rows, cols, bands) raster window -> uint8 RGBA for display."""
+    rows, cols, bands = pixels.shape
+    rgba = np.zeros((rows, cols, 4), dtype=np.uint8)
+
+    if bands >= 3 and pixels.dtype == np.uint8:
+        rgba[..., :3] = pixels[..., :3]
+        if bands >= 4:
+            rgba[..., 3] = pixels[..., 3]
+        else:
+            rgba[..., 3] = np.where(pixels[..., :3].any(axis=2), 255, 0)
+        return rgba
+
+    values = pixels[..., 0].astype(np.float64)
+    valid = np.isfinite(values) & (values > -9000)   # ODM fills empty DEM cells with -9999
+    if nodata is not None:
+        valid &= values != nodata
+    if value_range is None:
+        value_range = (float(values[valid].min()), float(values[valid].max())) if valid.any() else (0.0, 1.0)
+    lo, hi = value_range
+    t = np.clip((values - lo) / ((hi - lo) or 1.0), 0, 1)
+    stops = [s for s, _ in DEM_RAMP]
+    for channel in range(3):
+        rgba[..., channel] = np.interp(t, stops, [c[channel] for _, c in DEM_RAMP]).astype(np.uint8)
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def render_preview(source, target, max_side=2048):
+    """Downscaled PNG of a whole GeoTIFF without decoding it at full resolution in one go."""
+    from PIL import Image
+
+    tiff = MappedTiff(source)
+    try:
+        scale = max(tiff.width, tiff.height) / max_side
+        level = tiff.level_for_scale(max(1.0, scale))
+        factor = tiff.width / tiff.levels[level].width
+        step = max(1, int(scale / factor))
+        pixels = tiff.read_decimated(step, level=level)
+        value_range = None
+        if pixels.shape[2] < 3 or pixels.dtype != np.uint8:
+            value_range = _value_range(pixels, tiff.nodata)
+        im = Image.fromarray(to_rgba(pixels, value_range, tiff.nodata), "RGBA")
+    finally:
+        tiff.close()
+
+    im.thumbnail((max_side, max_side), Image.BILINEAR)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    tmp = target + ".tmp"
+    im.save(tmp, "PNG")
+    os.replace(tmp, target)
+    return target
+
+
+def _value_range(pixels, nodata=None):
+    values = pixels[..., 0].astype(np.float64)
+    valid = np.isfinite(values) & (values > -9000)
+    if nodata is not None:
+        valid &= values != nodata
+    if not valid.any():
+        return (0.0, 1.0)
+    # 2nd-98th percentile so a few spikes do not flatten the colour ramp
+    lo, hi = np.percentile(values[valid], [2, 98])
+    return (float(lo), float(hi))
+
+
+# =========================
+# TILE PYRAMID
+# =========================
+# Map layers a survey can have, relative to its ODM project folder
+TILE_LAYERS = {
+    "ortho": ("odm_orthophoto", "odm_orthophoto.tif"),
+    "dsm": ("odm_dem", "dsm.tif"),
+    "dtm": ("odm_dem", "dtm.tif"),
+}
+
+
+class TilePyramid:
+    """XYZ tiles of one GeoTIFF in pixel space (Leaflet ``CRS.Simple``).
+
+    Zoom ``max_zoom`` is full resolution; each lower zoom halves it, down to
+    a single tile at zoom 0. A tile is read from the coarsest internal
+    overview that still has enough detail, or, when the file has none, is
+    downsampled from its four already-cached children, so low zooms never
+    touch more than four tiles' worth of pixels at once.
+    """
+
+    def __init__(self, source, cache_dir, tile_size=256):
+        st = os.stat(source)
+        self.source = source
+        self.version = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+        self.cache_dir = os.path.join(cache_dir, self.version)
+        self.tile_size = tile_size
+        self.tiff = MappedTiff(source)
+        self.max_zoom = max(0, int(math.ceil(math.log2(max(self.tiff.width, self.tiff.height) / tile_size))))
+        self.is_color = self.tiff.samples >= 3 and self.tiff.dtype.itemsize == 1
+        self._value_range = None
+        self._lock = threading.Lock()
+
+    def meta(self):
+        t = self.tiff
+        return {
+            "width": t.width,
+            "height": t.height,
+            "bands": t.samples,
+            "tile_size": self.tile_size,
+            "min_zoom": 0,
+            "max_zoom": self.max_zoom,
+            "overviews": len(t.levels) - 1,
+            "version": self.version,
+            "pixel_size": [t.pixel_w, t.pixel_h],
+            "bounds": [t.origin_x, t.origin_y - t.height * t.pixel_h,
+                       t.origin_x + t.width * t.pixel_w, t.origin_y],
+            "value_range": None if self.is_color else self.value_range(),
+        }
+
+    def value_range(self):
+        """Elevation range for the DEM colour ramp, from the coarsest level (computed once)."""
+        with self._lock:
+            if self._value_range is None:
+                path = os.path.join(self.cache_dir, "range.txt")
+                if os.path.exists(path):
+                    with open(path) as f:
+                        self._value_range = tuple(float(v) for v in f.read().split())
+                else:
+                    level = len(self.tiff.levels) - 1
+                    lv = self.tiff.levels[level]
+                    step = max(1, int(max(lv.width, lv.height) / 1024))
+                    self._value_range = _value_range(self.tiff.read_decimated(step, level), self.tiff.nodata)
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    with open(path, "w") as f:
+                        f.write(" ".join(str(v) for v in self._value_range))
+            return self._value_range
+
+    def tile_path(self, z, x, y):
+        return os.path.join(self.cache_dir, str(z), str(x), f"{y}.png")
+
+    def in_range(self, z, x, y):
+        if not 0 <= z <= self.max_zoom:
+            return False
+        span = self.tile_size * 2 ** (self.max_zoom - z)
+        return 0 <= x * span < self.tiff.width and 0 <= y * span < self.tiff.height
+
+    def get(self, z, x, y):
+        """Path of the cached PNG for tile (z, x, y), rendering it on a miss; None if out of range."""
+        if not self.in_range(z, x, y):
+            return None
+        path = self.tile_path(z, x, y)
+        if os.path.exists(path):
+            return path
+        return self._render(z, x, y, path)
+
+    def _render(self, z, x, y, path):
+        from PIL import Image
+
+        ts = self.tile_size
+        scale = 2 ** (self.max_zoom - z)
+        level = self.tiff.level_for_scale(scale)
+        factor = self.tiff.width / self.tiff.levels[level].width
+
+        if z == self.max_zoom or scale / factor <= 2:
+            # Read straight from the best level, at most 2x the tile in each direction
+            lv = self.tiff.levels[level]
+            span = ts * scale / factor
+            r0, c0 = int(y * span), int(x * span)
+            r1, c1 = min(lv.height, int(math.ceil((y + 1) * span))), min(lv.width, int(math.ceil((x + 1) * span)))
+            pixels = self.tiff.read_window(r0, r1, c0, c1, level=level)
+            im = Image.fromarray(to_rgba(pixels, None if self.is_color else self.value_range(), self.tiff.nodata), "RGBA")
+            out_w = max(1, int(round((c1 - c0) / span * ts)))
+            out_h = max(1, int(round((r1 - r0) / span * ts)))
+            if im.size != (out_w, out_h):
+                im = im.resize((out_w, out_h), Image.BILINEAR)
+            tile = Image.new("RGBA", (ts, ts))
+            tile.paste(im, (0, 0))
+        else:
+            # No usable overview: build from the four children one zoom deeper
+            canvas = Image.new("RGBA", (2 * ts, 2 * ts))
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    child = self.get(z + 1, 2 * x + dx, 2 * y + dy)
+                    if child:
+                        with Image.open(child) as im:
+                            canvas.paste(im, (dx * ts, dy * ts))
+            tile = canvas.resize((ts, ts), Image.BILINEAR)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        tile.save(tmp, "PNG")
+        os.replace(tmp, path)
+        return path
+
+    def close(self):
+        self.tiff.close()
+
+
+class TileServer:
+    """Per-survey tile pyramids with an on-disk cache under ``cache_dir/<date>/<layer>/<version>``.
+
+    A pyramid is reopened when its source GeoTIFF changes (new version), and
+    older versions' tiles are removed at that point; the whole cache is also
+    trimmed least-recently-used first once it grows past ``max_bytes``.
+    """
+
+    def __init__(self, storage_root, cache_dir, tile_size=256, max_bytes=2 * 1024 * 1024 * 1024):
+        self.storage_root = storage_root
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pyramids = {}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tile-evict")
+        self._since_evict = 0
+        self.counters = {"hits": 0, "misses": 0, "evicted": 0, "errors": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_path(self, date, layer):
+        subdir, filename = TILE_LAYERS[layer]
+        return os.path.join(self.storage_root, date, subdir, filename)
+
+    def pyramid(self, date, layer="ortho"):
+        """Open pyramid for a survey layer, or None when ODM has not produced it."""
+        if layer not in TILE_LAYERS:
+            raise ValueError(f"Unknown tile layer: {layer}")
+        source = self.source_path(date, layer)
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        version = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+        key = (date, layer)
+        with self._lock:
+            current = self._pyramids.get(key)
+            if current is not None and current.version == version:
+                return current
+
+        pyramid = TilePyramid(source, os.path.join(self.cache_dir, date, layer), self.tile_size)
+        with self._lock:
+            current = self._pyramids.get(key)
+            if current is not None and current.version == pyramid.version:
+                pyramid.close()
+                return current
+            self._pyramids[key] = pyramid
+        if current is not None:
+            current.close()
+        self._drop_stale(os.path.join(self.cache_dir, date, layer), pyramid.version)
+        return pyramid
+
+    def _drop_stale(self, layer_dir, version):
+        if not os.path.isdir(layer_dir):
+            return
+        for name in os.listdir(layer_dir):
+            if name != version:
+                shutil.rmtree(os.path.join(layer_dir, name), ignore_errors=True)
+
+    def tile(self, date, layer, z, x, y):
+        pyramid = self.pyramid(date, layer)
+        if pyramid is None:
+            return None
+        path = pyramid.tile_path(z, x, y)
+        if os.path.exists(path):
+            self.counters["hits"] += 1
+            try:
+                os.utime(path)   # mtime doubles as the LRU clock
+            except OSError:
+                pass
+            return path
+
+        self.counters["misses"] += 1
+        try:
+            path = pyramid.get(z, x, y)
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        self._since_evict += 1
+        if self._since_evict >= 200:
+            self._since_evict = 0
+            self._pool.submit(self.evict)
+        return path
+
+    # ---------- eviction ----------
+    def evict(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+        # Trim to 90% so we are not evicting again on the very next write
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+        self.counters["evicted"] += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            open_pyramids = len(self._pyramids)
+        return {**self.counters, "open_pyramids": open_pyramids, "max_bytes": self.max_bytes}
@@ -0,0 +1,480 @@
+import bisect
+import collections
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+
+# =========================
+# SEGMENT WRITERS
+# =========================
+class SegmentWriter:
+    """One recorded video segment plus a ``.idx`` sidecar of real capture times.
+
+    Each index line is ``<capture timestamp> <byte offset> <byte length>``;
+    offsets are only meaningful for MJPEG segments and are -1 otherwise.
+    """
+
+    extension = ""
+    backend = "base"
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.frames = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.encode_cpu = 0.0
+        self._index = open(path + ".idx", "w")
+
+    def _index_frame(self, timestamp, offset=-1, length=-1):
+        if self.first_ts is None:
+            self.first_ts = timestamp
+        self.last_ts = timestamp
+        self.frames += 1
+        self._index.write(f"{timestamp:.3f} {offset} {length}\n")
+
+    def accepts(self, captured):
+        return True
+
+    @property
+    def bytes_written(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def write(self, captured):
+        """Add one frame; returns False when the frame was skipped rather than encoded."""
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        self._finish()
+        self._index.close()
+        size = self.bytes_written
+        seconds = (self.last_ts - self.first_ts) if self.frames > 1 else 0
+        minutes = seconds / 60 if seconds else 0
+        return {
+            "path": self.path,
+            "backend": self.backend,
+            "frames": self.frames,
+            "bytes": size,
+            "seconds": round(seconds, 1),
+            "fps": round((self.frames - 1) / seconds, 2) if seconds else 0,
+            "mb_per_minute": round(size / (1024 * 1024) / minutes, 2) if minutes else 0,
+            "encode_cpu_s": round(self.encode_cpu, 3) if self.encode_cpu is not None else None,
+        }
+
+
+class OpenCVSegmentWriter(SegmentWriter):
+    """Legacy XVID/AVI via cv2.VideoWriter, at the measured capture FPS."""
+
+    extension = ".avi"
+    backend = "opencv"
+
+    def __init__(self, path, fps, fourcc="XVID"):
+        super().__init__(path, fps)
+        self.fourcc = fourcc
+        self._writer = None
+        self._size = None
+
+    def accepts(self, captured):
+        if self._size is None:
+            return True
+        image = captured.image
+        return image is not None and image.shape[1::-1] == self._size
+
+    def write(self, captured):
+        image = captured.image
+        if image is None:
+            return False
+        t0 = time.thread_time()
+        if self._writer is None:
+            self._size = image.shape[1::-1]
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self._size)
+        self._writer.write(image)
+        self.encode_cpu += time.thread_time() - t0
+        self._index_frame(captured.timestamp)
+        return True
+
+    def _finish(self):
+        if self._writer is not None:
+            self._writer.release()
+
+
+class MjpegSegmentWriter(SegmentWriter):
+    """Camera JPEGs appended as-is; the index makes every frame seekable."""
+
+    extension = ".mjpeg"
+    backend = "mjpeg"
+
+    def __init__(self, path, fps):
+        super().__init__(path, fps)
+        self._file = open(path, "wb")
+        self._offset = 0
+
+    @property
+    def bytes_written(self):
+        return self._offset
+
+    def write(self, captured):
+        t0 = time.thread_time()
+        self._file.write(captured.jpeg)
+        self.encode_cpu += time.thread_time() - t0
+        self._index_frame(captured.timestamp, self._offset, len(captured.jpeg))
+        self._offset += len(captured.jpeg)
+        return True
+
+    def _finish(self):
+        self._file.close()
+
+
+_PASSTHROUGH_ARGS = {}   # ffmpeg binary -> its flags for "keep every input frame as-is"
+
+
+def ffmpeg_version(ffmpeg="ffmpeg"):
+    """(major, minor) from ``ffmpeg -version``; None for git builds or when it cannot run."""
+    try:
+        out = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = re.match(r"ffmpeg version n?(\d+)\.(\d+)", out)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def passthrough_args(ffmpeg="ffmpeg"):
+    """``-fps_mode passthrough`` needs ffmpeg 5.1+; older releases only know ``-vsync``."""
+    if ffmpeg not in _PASSTHROUGH_ARGS:
+        version = ffmpeg_version(ffmpeg)
+        old = version is not None and version < (5, 1)
+        _PASSTHROUGH_ARGS[ffmpeg] = ["-vsync", "passthrough"] if old else ["-fps_mode", "passthrough"]
+    return _PASSTHROUGH_ARGS[ffmpeg]
+
+
+class FragmentedMp4Writer(SegmentWriter):
+    """H.264 in fragmented MP4 through an ffmpeg pipe (plays while still growing).
+
+    The camera's JPEGs go in at a constant ``fps`` and each frame is placed
+    by its capture time: frame slot ``round((timestamp - first) * fps)``.
+    Camera stalls are filled by repeating the last frame and a second
+    capture in the same slot is dropped, so media time tracks the capture
+    clock to within half a frame however late frames reach ffmpeg. A gap
+    longer than ``max_gap`` seconds starts a new segment instead of being
+    padded. A keyframe every ``keyframe_seconds`` starts a fragment, and a
+    global ``sidx`` written on close lets players seek without walking
+    every fragment.
+    """
+
+    extension = ".mp4"
+    backend = "fmp4"
+    max_gap = 10.0
+
+    def __init__(self, path, fps, ffmpeg="ffmpeg", crf=28, preset="veryfast", keyframe_seconds=2):
+        super().__init__(path, fps)
+        self.padded_frames = 0
+        self.dropped_frames = 0
+        self._next_slot = 0
+        self._last_jpeg = None
+        cmd = [
+            ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "mjpeg", "-framerate", str(fps), "-i", "-",
+            "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+            "-g", str(max(1, round(fps * keyframe_seconds))),
+            *passthrough_args(ffmpeg),
+            "-movflags", "+frag_keyframe+empty_moov+default_base_moof+global_sidx",
+            "-f", "mp4", path,
+        ]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def accepts(self, captured):
+        return self.last_ts is None or captured.timestamp - self.last_ts <= self.max_gap
+
+    def write(self, captured):
+        slot = 0 if self.first_ts is None else round((captured.timestamp - self.first_ts) * self.fps)
+        if slot < self._next_slot:
+            self.dropped_frames += 1
+            return False
+        for _ in range(slot - self._next_slot):
+            self._proc.stdin.write(self._last_jpeg)
+            self.padded_frames += 1
+        self._proc.stdin.write(captured.jpeg)
+        self._next_slot = slot + 1
+        self._last_jpeg = captured.jpeg
+        self._index_frame(captured.timestamp)
+        return True
+
+    def close(self):
+        info = super().close()
+        info["padded_frames"] = self.padded_frames
+        info["dropped_frames"] = self.dropped_frames
+        return info
+
+    def _finish(self):
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        if hasattr(os, "wait4"):
+            # wait4 gives the encoder's own CPU usage for this segment
+            _, status, usage = os.wait4(self._proc.pid, 0)
+            self._proc.returncode = os.waitstatus_to_exitcode(status)
+            self.encode_cpu = usage.ru_utime + usage.ru_stime
+        else:
+            self._proc.wait()
+            self.encode_cpu = None
+
+
+SEGMENT_WRITERS = {
+    "opencv": OpenCVSegmentWriter,
+    "mjpeg": MjpegSegmentWriter,
+    "fmp4": FragmentedMp4Writer,
+}
+
+
+def resolve_backend(name):
+    """``auto`` picks fragmented MP4 when ffmpeg is installed, MJPEG otherwise."""
+    if name == "auto":
+        return "fmp4" if shutil.which("ffmpeg") else "mjpeg"
+    if name not in SEGMENT_WRITERS:
+        raise ValueError(f"Unknown recording backend: {name}")
+    return name
+
+
+# =========================
+# MJPEG PLAYBACK
+# =========================
+def read_segment_index(path):
+    """Return [(timestamp, offset, length), ...] from a segment's .idx sidecar."""
+    entries = []
+    index_path = path + ".idx"
+    if not os.path.exists(index_path):
+        return entries
+    with open(index_path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3:
+                entries.append((float(parts[0]), int(parts[1]), int(parts[2])))
+    return entries
+
+
+def mjpeg_playback(path, start=0.0, realtime=True):
+    """Yield multipart MJPEG chunks from ``start`` seconds into a segment.
+
+    Seeks straight to the indexed frame, reads one JPEG at a time and paces
+    output by the recorded capture timestamps.
+    """
+    entries = read_segment_index(path)
+    if not entries:
+        return
+
+    first_ts = entries[0][0]
+    pos = bisect.bisect_left([e[0] for e in entries], first_ts + start)
+
+    with open(path, "rb") as f:
+        wall_start = time.time()
+        media_start = entries[pos][0] if pos < len(entries) else first_ts
+        for ts, offset, length in entries[pos:]:
+            if realtime:
+                delay = (ts - media_start) - (time.time() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+            f.seek(offset)
+            yield (b"--frame\r\n"
+                   b"Content-Type: image/jpeg\r\n\r\n" +
+                   f.read(length) +
+                   b"\r\n")
+
+
+# =========================
+# BACKGROUND RECORDING PIPELINE
+# =========================
+class RecordingPipeline:
+    """Writes video frames and still captures on its own thread.
+
+    The capture thread only enqueues ``CapturedFrame`` objects. Both queues
+    are bounded and never block: when the disk falls behind, new work is
+    dropped and counted instead of stalling the live stream. Stills are
+    drained before video frames because they feed the mapping dataset.
+
+    Video is split into segments that rotate on duration, size, frame size or
+    a change of target directory (e.g. a new survey day).
+    """
+
+    def __init__(self, video_dir, backend="auto", fps=None, default_fps=20.0,
+                 max_frames=64, max_stills=16, segment_seconds=300,
+                 segment_bytes=512 * 1024 * 1024, on_still=None, on_segment=None):
+        # video_dir may be a path or a callable returning the current path
+        self.video_dir = video_dir
+        # on_still(paths) / on_segment(info) run on the writer thread after a file is finished
+        self.on_still = on_still
+        self.on_segment = on_segment
+        self.backend = resolve_backend(backend)
+        # fps: callable returning the measured capture rate, used by the opencv backend
+        self.fps = fps
+        self.default_fps = default_fps
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+
+        self._frames = collections.deque()
+        self._stills = collections.deque()
+        self.max_frames = max_frames
+        self.max_stills = max_stills
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._segment = None
+        self._segment_dir = None
+        self._segment_started = 0
+
+        self.counters = {
+            "frames_written": 0,
+            "frames_dropped": 0,    # queue full
+            "frames_skipped": 0,    # dequeued but not encoded (e.g. second frame in one fMP4 slot)
+            "stills_written": 0,
+            "stills_dropped": 0,
+            "segments": 0,
+            "max_queue_depth": 0,
+            "write_errors": 0,
+        }
+        self.segments = collections.deque(maxlen=50)
+
+        self._thread = threading.Thread(target=self._run, name="recording-pipeline", daemon=True)
+        self._thread.start()
+        print("🎬 Recording backend:", self.backend)
+
+    # ---------- producer side (capture thread) ----------
+    def _offer(self, queue, limit, item, dropped_key):
+        with self._cond:
+            if self._closed or len(queue) >= limit:
+                self.counters[dropped_key] += 1
+                return False
+            queue.append(item)
+            depth = len(self._frames) + len(self._stills)
+            if depth > self.counters["max_queue_depth"]:
+                self.counters["max_queue_depth"] = depth
+            self._cond.notify()
+            return True
+
+    def submit_frame(self, captured):
+        return self._offer(self._frames, self.max_frames, captured, "frames_dropped")
+
+    def submit_still(self, captured, paths):
+        return self._offer(self._stills, self.max_stills, (captured, list(paths)), "stills_dropped")
+
+    # ---------- consumer side (writer thread) ----------
+    def _current_dir(self):
+        return self.video_dir() if callable(self.video_dir) else self.video_dir
+
+    def _current_fps(self):
+        fps = self.fps() if callable(self.fps) else self.fps
+        return round(fps, 1) if fps and fps >= 1 else self.default_fps
+
+    def _open_segment(self, captured):
+        video_dir = self._current_dir()
+        os.makedirs(video_dir, exist_ok=True)
+
+        writer_cls = SEGMENT_WRITERS[self.backend]
+        video_filename = datetime.fromtimestamp(captured.timestamp).strftime("%Y%m%d_%H%M%S") + writer_cls.extension
+        self._segment = writer_cls(os.path.join(video_dir, video_filename), self._current_fps())
+        self._segment_dir = video_dir
+        self._segment_started = captured.timestamp
+        self.counters["segments"] += 1
+        print("New Video Started:", video_filename)
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        info = self._segment.close()
+        self._segment = None
+        self.segments.append(info)
+        if self.on_segment is not None:
+            self.on_segment(info)
+        print(f"🎞️ Segment closed: {os.path.basename(info['path'])} | {info['frames']} frames | "
+              f"{info['mb_per_minute']} MB/min | encode CPU {info['encode_cpu_s']}s")
+
+    def _needs_rotation(self, captured):
+        if self._segment is None:
+            return False
+        if self._current_dir() != self._segment_dir or not self._segment.accepts(captured):
+            return True
+        if captured.timestamp - self._segment_started >= self.segment_seconds:
+            return True
+        # Size can cost a stat call, so only check it every 20 frames
+        if self._segment.frames % 20 == 0:
+            return self._segment.bytes_written >= self.segment_bytes
+        return False
+
+    def _write_frame(self, captured):
+        if self._needs_rotation(captured):
+            self._close_segment()
+        if self._segment is None:
+            self._open_segment(captured)
+        if self._segment.write(captured):
+            self.counters["frames_written"] += 1
+        else:
+            self.counters["frames_skipped"] += 1
+
+    def _write_still(self, captured, paths):
+        # The camera's JPEG is written as-is, no decode/re-encode needed
+        for path in paths:
+            with open(path, "wb") as f:
+                f.write(captured.jpeg)
+        self.counters["stills_written"] += 1
+        if self.on_still is not None:
+            self.on_still(paths)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stills and not self._frames and not self._closed:
+                    self._cond.wait()
+                if self._stills:
+                    kind, item = "still", self._stills.popleft()
+                elif self._frames:
+                    kind, item = "frame", self._frames.popleft()
+                else:
+                    break
+
+            try:
+                if kind == "still":
+                    self._write_still(*item)
+                else:
+                    self._write_frame(item)
+            except Exception as e:
+                self.counters["write_errors"] += 1
+                print(f"⚠️ Recording write error: {e}")
+                if kind == "frame":
+                    # Start a fresh segment rather than keep writing into a broken one
+                    try:
+                        self._close_segment()
+                    except Exception:
+                        self._segment = None
+
+        self._close_segment()
+
+    def close(self, timeout=10):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            depth = {"frames": len(self._frames), "stills": len(self._stills)}
+        segment = self._segment
+        return {
+            **self.counters,
+            "backend": self.backend,
+            "queue_depth": depth,
+            "current_segment": segment.path if segment is not None else None,
+            "recent_segments": list(self.segments)[-5:],
+        }
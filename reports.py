@@ -0,0 +1,631 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+# =========================
+# PRELOADED REPORT ASSETS
+# =========================
+LOGO_PATH = os.path.join("static", "logo.png")
+# Optional TTF (e.g. one with emoji/Indic glyphs) used for body text instead of Helvetica
+REPORT_FONT_PATH = os.getenv("REPORT_FONT_PATH", "")
+
+INFO_TABLE_STYLE = TableStyle([
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+    ("BACKGROUND", (0,0), (0,-1), colors.lightgrey),
+    ("FONTNAME", (0,0), (0,-1), "Helvetica-Bold"),
+    ("ALIGN", (0,0), (-1,-1), "LEFT"),
+])
+
+REQUEST_TABLE_STYLE = TableStyle([
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+    ("BACKGROUND", (0,0), (0,-1), colors.lightgrey),
+    ("FONTNAME", (0,0), (0,-1), "Helvetica-Bold"),
+    ("ALIGN", (0,0), (-1,-1), "LEFT"),
+    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+])
+
+VOLUME_TABLE_STYLE = TableStyle([
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+    ("BACKGROUND", (0,0), (0,-1), colors.lightblue),
+    ("FONTNAME", (0,0), (0,-1), "Helvetica-Bold"),
+    ("ALIGN", (0,0), (-1,-1), "LEFT"),
+    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+])
+
+PILE_TABLE_STYLE = TableStyle([
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+    ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
+    ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+    ("FONTNAME", (0,-1), (-1,-1), "Helvetica-Bold"),
+    ("ALIGN", (1,0), (-1,-1), "RIGHT"),
+])
+
+SIGN_TABLE_STYLE = TableStyle([
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+    ("BACKGROUND", (0,0), (0,-1), colors.lightgrey),
+])
+
+
+class Logo(Flowable):
+    """Draws an already-decoded ImageReader, so every report shares one copy of the logo."""
+
+    def __init__(self, reader, width, height):
+        Flowable.__init__(self)
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.hAlign = "CENTER"
+
+    def wrap(self, avail_width, avail_height):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask="auto")
+
+
+class ReportAssets:
+    """Style sheet, fonts and logo, built once per process instead of once per PDF."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.styles = None
+        self.logo = None
+        self.load_seconds = None
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return self
+            started = time.perf_counter()
+            styles = getSampleStyleSheet()
+            if REPORT_FONT_PATH and os.path.exists(REPORT_FONT_PATH):
+                try:
+                    pdfmetrics.registerFont(TTFont("ReportFont", REPORT_FONT_PATH))
+                    for name in ("Normal", "Italic", "Title", "Heading1", "Heading2"):
+                        styles[name].fontName = "ReportFont"
+                except Exception as e:
+                    print(f"⚠️ Report font not loaded: {e}")
+            self.styles = styles
+
+            if os.path.exists(LOGO_PATH):
+                try:
+                    reader = ImageReader(LOGO_PATH)
+                    reader.getRGBData()   # decode now, not during the first render
+                    self.logo = reader
+                except Exception as e:
+                    print(f"⚠️ Report logo not loaded: {e}")
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self._loaded = True
+            return self
+
+    def header(self, story):
+        if self.logo is not None:
+            story.append(Logo(self.logo, 2*inch, 1*inch))
+
+
+assets = ReportAssets()
+
+
+# =========================
+# REPORT LAYOUTS
+# =========================
+def render_volume_report(pdf_path, volume_value, user_email="Unknown", location="Mining Site",
+                         survey_date=None, piles=None):
+    """Mapping volume report (optionally with the per-stockpile table)."""
+    styles = assets.load().styles
+    survey_date = survey_date or datetime.now().strftime("%Y-%m-%d")
+    doc = SimpleDocTemplate(pdf_path, pagesize=A4, invariant=True)
+    story = []
+
+    # ============================
+    # ✅ Company Logo + Header
+    # ============================
+    assets.header(story)
+    story.append(Paragraph(
+        "<b>Garuda Aerospace Pvt Ltd</b><br/>AI Drone Mining Monitoring System",
+        styles["Heading2"]
+    ))
+    story.append(Spacer(1, 15))
+
+    # ============================
+    # ✅ Report Title
+    # ============================
+    story.append(Paragraph("📌 Drone Mining Survey Volume Report", styles["Title"]))
+    story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Client + Survey Info Table
+    # ============================
+    info_data = [
+        ["Report Generated For", user_email],
+        ["Survey Location", location],
+        ["Survey Date", survey_date],
+        ["Processing Engine", "OpenDroneMap + AI Volume Estimation"]
+    ]
+    info_table = Table(info_data, colWidths=[180, 270])
+    info_table.setStyle(INFO_TABLE_STYLE)
+    story.append(info_table)
+    story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Volume Highlight Box
+    # ============================
+    story.append(Paragraph(
+        f"<b>📊 Estimated Stockpile Volume:</b> "
+        f"<font size=14 color='blue'>{volume_value} m³</font>",
+        styles["Heading1"]
+    ))
+    story.append(Spacer(1, 25))
+
+    # ============================
+    # ✅ Per-Stockpile Table
+    # ============================
+    if piles:
+        story.append(Paragraph("⛰ Stockpile Breakdown", styles["Heading2"]))
+        pile_data = [["Stockpile", "Volume (m³)", "Fill (m³)", "Area (m²)", "Max Height (m)"]]
+        for pile in piles:
+            height = pile.get("max_height_m")
+            pile_data.append([pile["pile"], f"{pile['cut_m3']:,.2f}", f"{pile['fill_m3']:,.2f}",
+                              f"{pile['area_m2']:,.1f}", f"{height:.2f}" if height is not None else "-"])
+        pile_data.append(["Total", f"{sum(p['cut_m3'] for p in piles):,.2f}", "", "", ""])
+
+        pile_table = Table(pile_data, colWidths=[120, 90, 80, 90, 90])
+        pile_table.setStyle(PILE_TABLE_STYLE)
+        story.append(pile_table)
+        story.append(Spacer(1, 25))
+
+    # ============================
+    # ✅ Summary Paragraph
+    # ============================
+    story.append(Paragraph("📝 Survey Summary", styles["Heading2"]))
+    story.append(Paragraph(
+        f"""
+        This report was automatically generated using drone imagery and AI-powered
+        3D mapping technology.
+
+        The calculated stockpile volume for the mining site is estimated as:
+
+        <b>{volume_value} cubic meters</b>.
+        """,
+        styles["Normal"]
+    ))
+    story.append(Spacer(1, 25))
+
+    # ============================
+    # ✅ Signature & Stamp Section
+    # ============================
+    story.append(Paragraph("✍ Authorized Signature", styles["Heading2"]))
+    story.append(Spacer(1, 25))
+
+    sign_data = [
+        ["Project Engineer", "____________________"],
+        ["Approved By (Admin)", "____________________"],
+        ["Company Stamp", "____________________"]
+    ]
+    sign_table = Table(sign_data, colWidths=[200, 250])
+    sign_table.setStyle(SIGN_TABLE_STYLE)
+    story.append(sign_table)
+    story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Footer
+    # ============================
+    story.append(Paragraph(
+        "Generated by Garuda Aerospace AI Drone Monitoring System | Confidential Report",
+        styles["Italic"]
+    ))
+
+    doc.build(story)
+    return pdf_path
+
+
+def render_survey_request(pdf_path, mission_objectives, operator_email, timestamp, volume=None,
+                          requested_at=None):
+    """Survey request form, with the latest mapped volume when there is one."""
+    styles = assets.load().styles
+    requested_at = requested_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    doc = SimpleDocTemplate(pdf_path, pagesize=A4, invariant=True)
+    story = []
+
+    # ============================
+    # ✅ Company Header
+    # ============================
+    assets.header(story)
+    story.append(Paragraph(
+        "<b>Garuda Aerospace Pvt Ltd</b><br/>Drone Survey Request Form",
+        styles["Heading2"]
+    ))
+    story.append(Spacer(1, 15))
+
+    # ============================
+    # ✅ Survey Request Title
+    # ============================
+    story.append(Paragraph("📋 Drone Survey Mission Request", styles["Title"]))
+    story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Request Details Table
+    # ============================
+    request_data = [
+        ["Request ID", timestamp],
+        ["Operator Email", operator_email],
+        ["Request Date", requested_at[:10]],
+        ["Request Time", requested_at[11:]],
+        ["Status", "Processing" if volume else "Pending Processing"]
+    ]
+    req_table = Table(request_data, colWidths=[180, 270])
+    req_table.setStyle(REQUEST_TABLE_STYLE)
+    story.append(req_table)
+    story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Volume Calculation (if available)
+    # ============================
+    if volume:
+        story.append(Paragraph("📊 Volume Calculation Results", styles["Heading2"]))
+        story.append(Spacer(1, 10))
+
+        volume_data = [
+            ["Estimated Stockpile Volume", f"<b>{volume} m³</b>"],
+            ["Calculation Method", "OpenDroneMap + AI Volume Estimation"],
+            ["Confidence Level", "High (3D Point Cloud Analysis)"]
+        ]
+        volume_table = Table(volume_data, colWidths=[180, 270])
+        volume_table.setStyle(VOLUME_TABLE_STYLE)
+        story.append(volume_table)
+        story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Mission Objectives
+    # ============================
+    story.append(Paragraph("📌 Mission Objectives & Coordinates", styles["Heading2"]))
+    story.append(Paragraph(
+        mission_objectives if mission_objectives else "No specific coordinates provided",
+        styles["Normal"]
+    ))
+    story.append(Spacer(1, 20))
+
+    # ============================
+    # ✅ Instructions
+    # ============================
+    story.append(Paragraph("📝 Next Steps", styles["Heading2"]))
+    if volume:
+        next_steps = """
+        1. <b>Volume Confirmed:</b> Your survey volume has been calculated and is shown above.
+        <br/><br/>
+        2. <b>Documentation:</b> This PDF serves as your official survey report with volume confirmation.
+        <br/><br/>
+        3. <b>Delivery:</b> Complete 3D maps, detailed analysis, and geotagged images will be sent within 24 hours.
+        <br/><br/>
+        4. <b>Contact:</b> For questions, reply to this email or contact our team.
+        """
+    else:
+        next_steps = """
+        1. <b>Confirmation:</b> Your survey request has been received and logged in our system.
+        <br/><br/>
+        2. <b>Processing:</b> Our team will begin drone mapping operations at the specified location.
+        <br/><br/>
+        3. <b>Delivery:</b> 3D maps, volume analysis, and geotagged images will be sent within 24-48 hours.
+        <br/><br/>
+        4. <b>Contact:</b> For updates, reply to this email or contact our team.
+        """
+    story.append(Paragraph(next_steps, styles["Normal"]))
+    story.append(Spacer(1, 25))
+
+    # ============================
+    # ✅ Footer with Contact Info
+    # ============================
+    story.append(Paragraph(
+        "<b>Contact Information:</b><br/>Email: support@garuda.aero<br/>WhatsApp: +91-XXXXXXXXXX<br/><br/>"
+        "Generated by Garuda Aerospace AI Drone Monitoring System | Confidential Report",
+        styles["Italic"]
+    ))
+
+    doc.build(story)
+    return pdf_path
+
+
+# =========================
+# REPORT ARTIFACTS
+# =========================
+# The pile fields the volume report prints (rows from the volume store carry more)
+REPORT_PILE_FIELDS = ("pile", "cut_m3", "fill_m3", "area_m2", "max_height_m")
+ARTIFACT_COLUMNS = ("owner", "kind", "input_key", "sha256", "size", "download_name", "created_at")
+
+
+def report_piles(piles):
+    return [{k: p.get(k) for k in REPORT_PILE_FIELDS} for p in piles or []]
+
+
+class ReportArtifactStore:
+    """Content-addressed report PDFs with a manifest in SQLite.
+
+    Each PDF is stored once as ``objects/<ab>/<sha256>.pdf`` and never
+    rewritten, so downloads can be cached forever. The manifest maps an
+    owner (``mapping:<job id>``, ``request:<id>``) to its file and records
+    a hash of the render inputs: asking again with the same inputs reuses
+    the stored file without rendering, and since the PDFs are rendered
+    invariant (no timestamps or random ids), identical inputs reaching the
+    renderer still end up as one file on disk.
+    """
+
+    def __init__(self, db_path, root):
+        self.db_path = db_path
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_schema(self):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_artifacts (
+            owner TEXT PRIMARY KEY,
+            kind TEXT,
+            input_key TEXT,
+            sha256 TEXT,
+            size INTEGER,
+            download_name TEXT,
+            created_at REAL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_report_artifacts_input ON report_artifacts (input_key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_report_artifacts_sha ON report_artifacts (sha256)")
+        conn.commit()
+        conn.close()
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}.pdf")
+
+    @staticmethod
+    def input_key(kind, inputs):
+        payload = json.dumps({"kind": kind, "inputs": inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _query(self, where, args):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(ARTIFACT_COLUMNS)} FROM report_artifacts {where}", args)
+        row = c.fetchone()
+        conn.close()
+        if row is None:
+            return None
+        artifact = dict(zip(ARTIFACT_COLUMNS, row))
+        artifact["path"] = self.object_path(artifact["sha256"])
+        return artifact
+
+    def _store(self, tmp_path):
+        digest = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        path = self.object_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)           # same bytes already stored
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return sha256
+
+    def render(self, owner, kind, render_to, inputs, download_name):
+        """Artifact for ``owner``; ``render_to(path, **inputs)`` only runs for unseen inputs."""
+        key = self.input_key(kind, inputs)
+        existing = self._query("WHERE input_key = ? ORDER BY created_at DESC LIMIT 1", (key,))
+        if existing and os.path.exists(existing["path"]):
+            sha256 = existing["sha256"]
+            reused = True
+        else:
+            tmp_path = os.path.join(self.tmp_dir, f"{os.getpid()}_{threading.get_ident()}_{key[:16]}.pdf")
+            try:
+                render_to(tmp_path, **inputs)
+                sha256 = self._store(tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            reused = False
+
+        path = self.object_path(sha256)
+        conn = self._connect()
+        conn.execute(f"""
+        INSERT OR REPLACE INTO report_artifacts ({", ".join(ARTIFACT_COLUMNS)})
+        VALUES ({", ".join("?" * len(ARTIFACT_COLUMNS))})
+        """, (owner, kind, key, sha256, os.path.getsize(path), download_name, time.time()))
+        conn.commit()
+        conn.close()
+        if reused:
+            print(f"♻️ Report for {owner} reused {sha256[:12]}")
+        return path
+
+    def get(self, owner):
+        return self._query("WHERE owner = ?", (owner,))
+
+    def by_sha(self, sha256):
+        return self._query("WHERE sha256 = ? ORDER BY created_at DESC LIMIT 1", (sha256,))
+
+    def stats(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*), COUNT(DISTINCT sha256) FROM report_artifacts")
+        owners, files = c.fetchone()
+        c.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM report_artifacts)")
+        stored = c.fetchone()[0]
+        conn.close()
+        return {"artifacts": owners, "files": files, "bytes": stored}
+
+
+# =========================
+# RENDER QUEUE
+# =========================
+REPORT_JOB_COLUMNS = ("id", "kind", "state", "requester", "pdf_path", "render_ms", "delivery",
+                      "error", "created_at", "started_at", "finished_at")
+STALE_RENDER_SECONDS = 15 * 60
+
+
+class ReportRenderQueue:
+    """Background PDF rendering with per-report timings in SQLite.
+
+    ``submit`` records a job and returns its id at once; a small thread pool
+    renders it and then runs the optional ``deliver`` step (email, WhatsApp)
+    whose return value is stored as the job's delivery result. ``run`` renders
+    inline for callers that are already in the background (mapping jobs) but
+    still records the timing. Job rows are shared through SQLite, so any
+    gunicorn worker can answer a status poll.
+    """
+
+    def __init__(self, db_path, workers=2):
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-render")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            state TEXT,
+            requester TEXT,
+            pdf_path TEXT,
+            render_ms REAL,
+            delivery TEXT,
+            error TEXT,
+            created_at REAL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_report_jobs_kind ON report_jobs (kind, finished_at)")
+        # Renders lost to a restart (the pool is per process, jobs are not resumed)
+        conn.execute("""
+        UPDATE report_jobs SET state = 'failed', error = 'interrupted', finished_at = ?
+        WHERE state IN ('queued', 'rendering') AND created_at < ?
+        """, (time.time(), time.time() - STALE_RENDER_SECONDS))
+        conn.commit()
+        conn.close()
+
+    def start(self):
+        self.init_schema()
+        # Warm the shared styles and logo so the first report is not the slow one
+        self._pool.submit(assets.load)
+
+    def _update(self, job_id, **fields):
+        conn = self._connect()
+        conn.execute(f"UPDATE report_jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                     (*fields.values(), job_id))
+        conn.commit()
+        conn.close()
+
+    def _create(self, kind, requester, state):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("INSERT INTO report_jobs (kind, state, requester, created_at) VALUES (?, ?, ?, ?)",
+                  (kind, state, requester, time.time()))
+        job_id = c.lastrowid
+        conn.commit()
+        conn.close()
+        return job_id
+
+    def _render(self, job_id, render):
+        started = time.time()
+        self._update(job_id, state="rendering", started_at=started)
+        t0 = time.perf_counter()
+        pdf_path = render()
+        render_ms = round((time.perf_counter() - t0) * 1000, 1)
+        self._update(job_id, pdf_path=pdf_path, render_ms=render_ms)
+        return pdf_path, render_ms
+
+    def _process(self, job_id, kind, render, deliver):
+        try:
+            pdf_path, render_ms = self._render(job_id, render)
+            print(f"📄 Report #{job_id} ({kind}) rendered in {render_ms} ms")
+        except Exception as e:
+            print(f"❌ Report #{job_id} ({kind}) failed: {e}")
+            self._update(job_id, state="failed", error=str(e), finished_at=time.time())
+            return
+
+        delivery = None
+        if deliver is not None:
+            try:
+                delivery = deliver(pdf_path)
+            except Exception as e:
+                print(f"⚠️ Report #{job_id} delivery error: {e}")
+                delivery = {"error": str(e)}
+        self._update(job_id, state="completed", delivery=json.dumps(delivery) if delivery is not None else None,
+                     finished_at=time.time())
+
+    def submit(self, kind, render, requester=None, deliver=None):
+        """Queue ``render()`` (returns the PDF path), then ``deliver(pdf_path)``; returns the job id."""
+        job_id = self._create(kind, requester, "queued")
+        self._pool.submit(self._process, job_id, kind, render, deliver)
+        return job_id
+
+    def run(self, kind, render, requester=None):
+        """Render in the calling thread (already off the request path); returns the PDF path."""
+        job_id = self._create(kind, requester, "queued")
+        try:
+            pdf_path, _ = self._render(job_id, render)
+        except Exception as e:
+            self._update(job_id, state="failed", error=str(e), finished_at=time.time())
+            raise
+        self._update(job_id, state="completed", finished_at=time.time())
+        return pdf_path
+
+    def get(self, job_id):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(REPORT_JOB_COLUMNS)} FROM report_jobs WHERE id = ?", (job_id,))
+        row = c.fetchone()
+        conn.close()
+        if row is None:
+            return None
+        job = dict(zip(REPORT_JOB_COLUMNS, row))
+        job["delivery"] = json.loads(job["delivery"]) if job["delivery"] else None
+        return job
+
+    def stats(self, window=500):
+        """Render-time summary per report kind over the last ``window`` finished jobs of each."""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT state, COUNT(*) FROM report_jobs GROUP BY state")
+        states = dict(c.fetchall())
+        c.execute("SELECT DISTINCT kind FROM report_jobs")
+        kinds = {}
+        for (kind,) in c.fetchall():
+            c.execute("""
+            SELECT render_ms FROM report_jobs
+            WHERE kind = ? AND render_ms IS NOT NULL
+            ORDER BY id DESC LIMIT ?
+            """, (kind, window))
+            times = sorted(row[0] for row in c.fetchall())
+            if not times:
+                continue
+            kinds[kind] = {
+                "count": len(times),
+                "avg_ms": round(sum(times) / len(times), 1),
+                "p50_ms": times[len(times) // 2],
+                "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))],
+                "max_ms": times[-1],
+            }
+        conn.close()
+        return {"states": states, "render": kinds, "assets_load_seconds": assets.load_seconds}
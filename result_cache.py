@@ -0,0 +1,182 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+
+# =========================
+# MAPPING RESULT CACHE
+# =========================
+class MappingResultCache:
+    """Finished mapping results keyed by dataset fingerprint (image set + ODM options).
+
+    Each entry keeps its own copy of the orthophoto preview and ODM stats plus
+    the computed volume, so a repeat request for an unchanged dataset is
+    answered without ODM, ``extract_volume`` or a new report. Entries expire
+    after ``max_age_days`` and the least recently used are evicted once the
+    cache grows past ``max_bytes``. Hit/miss counters live in SQLite so the
+    hit rate covers every gunicorn worker.
+    """
+
+    ARTIFACTS = {
+        "orthophoto": ("odm_orthophoto", "odm_orthophoto.png"),
+        "stats": ("odm_report", "stats.json"),
+    }
+
+    def __init__(self, db_path, cache_dir, max_bytes=5 * 1024 * 1024 * 1024, max_age_days=90):
+        self.db_path = db_path
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_schema(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS mapping_cache (
+            key TEXT PRIMARY KEY,
+            date_folder TEXT,
+            volume TEXT,
+            bytes INTEGER DEFAULT 0,
+            created_at REAL,
+            last_hit REAL,
+            hits INTEGER DEFAULT 0
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS mapping_cache_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER DEFAULT 0
+        )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _bump(self, c, name):
+        c.execute("""
+        INSERT INTO mapping_cache_counters (name, value) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1
+        """, (name,))
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    # ---------- lookups ----------
+    def get(self, key):
+        """Cached result for ``key`` or None; counts a hit or a miss."""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT date_folder, volume, created_at FROM mapping_cache WHERE key = ?", (key,))
+        row = c.fetchone()
+
+        entry_dir = self._entry_dir(key)
+        expired = row and time.time() - row[2] > self.max_age_days * 86400
+        if row is None or expired or not os.path.isdir(entry_dir):
+            if row is not None:
+                c.execute("DELETE FROM mapping_cache WHERE key = ?", (key,))
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            self._bump(c, "misses")
+            conn.commit()
+            conn.close()
+            return None
+
+        c.execute("UPDATE mapping_cache SET hits = hits + 1, last_hit = ? WHERE key = ?", (time.time(), key))
+        self._bump(c, "hits")
+        conn.commit()
+        conn.close()
+
+        result = {"key": key, "date_folder": row[0], "volume": row[1], "created_at": row[2]}
+        for name, (_, filename) in self.ARTIFACTS.items():
+            path = os.path.join(entry_dir, filename)
+            result[name] = path if os.path.exists(path) else None
+        return result
+
+    # ---------- writes ----------
+    def put(self, key, date_folder, output_path, volume):
+        """Copy a finished run's artifacts into the cache under ``key``."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = entry_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        total = 0
+        for subdir, filename in self.ARTIFACTS.values():
+            src = os.path.join(output_path, subdir, filename)
+            if os.path.exists(src):
+                shutil.copy(src, os.path.join(tmp_dir, filename))
+                total += os.path.getsize(src)
+        with open(os.path.join(tmp_dir, "result.json"), "w") as f:
+            json.dump({"date_folder": date_folder, "volume": volume}, f)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+        now = time.time()
+        conn = self._connect()
+        conn.execute("""
+        INSERT OR REPLACE INTO mapping_cache (key, date_folder, volume, bytes, created_at, last_hit, hits)
+        VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, (key, date_folder, str(volume), total, now, now))
+        conn.commit()
+        conn.close()
+        self.evict()
+
+    def evict(self, clear=False):
+        """Drop expired entries, then least recently used ones until under ``max_bytes``."""
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT key, bytes, created_at FROM mapping_cache ORDER BY last_hit")
+            rows = c.fetchall()
+
+            cutoff = time.time() - self.max_age_days * 86400
+            total = sum(r[1] for r in rows)
+            evicted = 0
+            for key, size, created_at in rows:
+                if not clear and created_at >= cutoff and total <= self.max_bytes:
+                    continue
+                c.execute("DELETE FROM mapping_cache WHERE key = ?", (key,))
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+                evicted += 1
+
+            if evicted:
+                c.execute("""
+                INSERT INTO mapping_cache_counters (name, value) VALUES ('evicted', ?)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+                """, (evicted,))
+            conn.commit()
+            conn.close()
+        return evicted
+
+    # ---------- admin ----------
+    def stats(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0), MIN(created_at) FROM mapping_cache")
+        entries, total, oldest = c.fetchone()
+        c.execute("SELECT name, value FROM mapping_cache_counters")
+        counters = dict(c.fetchall())
+        conn.close()
+
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "bytes": total,
+            "size_mb": round(total / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "max_age_days": self.max_age_days,
+            "oldest_entry": oldest,
+            "hits": hits,
+            "misses": misses,
+            "evicted": counters.get("evicted", 0),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        }
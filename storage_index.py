@@ -0,0 +1,309 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from listing import SURVEY_NAME, capture_time_from_name
+
+
+# =========================
+# PERSISTENT STORAGE INDEX
+# =========================
+class StorageIndex:
+    """SQLite index of per-survey image/video counts, bytes and capture span.
+
+    ``storage_dirs`` holds one row per directory under ``storage/<date>``
+    (direct files only) together with the directory's mtime and its
+    sub-directory names. ``survey_stats`` holds the per-survey totals that
+    the dashboard endpoints read in a single indexed lookup.
+
+    New captures update both tables as they are written. The reconciliation
+    pass only re-lists directories whose mtime changed, and follows
+    unchanged directories through the stored sub-directory names, so a quiet
+    archive costs one stat per directory instead of one per file.
+    """
+
+    def __init__(self, db_path, storage_root, image_extensions, video_extensions,
+                 reconcile_interval=60, full_rescan_every=60):
+        self.db_path = db_path
+        self.storage_root = storage_root
+        self.image_extensions = image_extensions
+        self.video_extensions = video_extensions
+        self.reconcile_interval = reconcile_interval
+        self.full_rescan_every = full_rescan_every
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_reconcile = None
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_schema(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS storage_dirs (
+            path TEXT PRIMARY KEY,
+            survey TEXT NOT NULL,
+            mtime_ns INTEGER,
+            subdirs TEXT DEFAULT '[]',
+            images INTEGER DEFAULT 0,
+            videos INTEGER DEFAULT 0,
+            bytes INTEGER DEFAULT 0,
+            first_capture REAL,
+            last_capture REAL
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_storage_dirs_survey ON storage_dirs(survey)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS survey_stats (
+            survey TEXT PRIMARY KEY,
+            images INTEGER DEFAULT 0,
+            videos INTEGER DEFAULT 0,
+            bytes INTEGER DEFAULT 0,
+            first_capture REAL,
+            last_capture REAL,
+            updated_at REAL
+        )
+        """)
+        conn.commit()
+        conn.close()
+
+    # ---------- helpers ----------
+    def _rel(self, path):
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.storage_root))
+        return rel.replace(os.sep, "/")
+
+    def _kind(self, rel_dir):
+        parts = rel_dir.split("/")
+        return parts[1] if len(parts) == 2 else None
+
+    def _scan_dir(self, abs_dir, rel_dir):
+        """Stat the direct files of one directory; returns (row values, subdir names)."""
+        kind = self._kind(rel_dir)
+        images = videos = total = 0
+        first = last = None
+        subdirs = []
+        with os.scandir(abs_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat()
+                total += st.st_size
+                name = entry.name.lower()
+                if kind == "images" and name.endswith(self.image_extensions):
+                    images += 1
+                elif kind == "videos" and name.endswith(self.video_extensions):
+                    videos += 1
+                else:
+                    continue
+                ts = capture_time_from_name(entry.name) or st.st_mtime
+                first = ts if first is None else min(first, ts)
+                last = ts if last is None else max(last, ts)
+        return (images, videos, total, first, last), sorted(subdirs)
+
+    def _store_dir(self, c, rel_dir, mtime_ns, values, subdirs):
+        images, videos, total, first, last = values
+        c.execute("""
+        INSERT OR REPLACE INTO storage_dirs
+            (path, survey, mtime_ns, subdirs, images, videos, bytes, first_capture, last_capture)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (rel_dir, rel_dir.split("/")[0], mtime_ns, json.dumps(subdirs),
+              images, videos, total, first, last))
+
+    def _refresh_survey(self, c, survey):
+        c.execute("""
+        SELECT COUNT(*), SUM(images), SUM(videos), SUM(bytes), MIN(first_capture), MAX(last_capture)
+        FROM storage_dirs WHERE survey = ?
+        """, (survey,))
+        dirs, images, videos, total, first, last = c.fetchone()
+        if not dirs:
+            c.execute("DELETE FROM survey_stats WHERE survey = ?", (survey,))
+            return
+        c.execute("""
+        INSERT OR REPLACE INTO survey_stats
+            (survey, images, videos, bytes, first_capture, last_capture, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (survey, images or 0, videos or 0, total or 0, first, last, time.time()))
+
+    # ---------- incremental updates ----------
+    def record_file(self, path, rescan_dir=False):
+        """Account for one newly written file without rescanning its directory.
+
+        Use ``rescan_dir`` for files that grew after they were created (video
+        segments), which a reconcile pass may already have counted part of.
+        """
+        rel_dir = self._rel(os.path.dirname(path))
+        survey = rel_dir.split("/")[0]
+        if rel_dir.startswith("..") or not SURVEY_NAME.match(survey):
+            return
+
+        try:
+            st = os.stat(path)
+            dir_mtime = os.stat(os.path.dirname(path)).st_mtime_ns
+        except OSError:
+            return
+
+        kind = self._kind(rel_dir)
+        name = os.path.basename(path).lower()
+        is_image = kind == "images" and name.endswith(self.image_extensions)
+        is_video = kind == "videos" and name.endswith(self.video_extensions)
+        ts = (capture_time_from_name(os.path.basename(path)) or st.st_mtime) if is_image or is_video else None
+
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT mtime_ns FROM storage_dirs WHERE path = ?", (rel_dir,))
+            row = c.fetchone()
+            if row is None or rescan_dir:
+                # New directory, or a file that may already be partly counted: rescan it
+                values, subdirs = self._scan_dir(os.path.dirname(path), rel_dir)
+                self._store_dir(c, rel_dir, dir_mtime, values, subdirs)
+            elif row[0] == dir_mtime:
+                # A reconcile pass already saw the directory with this file in it
+                pass
+            else:
+                c.execute("""
+                UPDATE storage_dirs SET
+                    mtime_ns = ?,
+                    images = images + ?,
+                    videos = videos + ?,
+                    bytes = bytes + ?,
+                    first_capture = COALESCE(MIN(first_capture, ?), first_capture, ?),
+                    last_capture = COALESCE(MAX(last_capture, ?), last_capture, ?)
+                WHERE path = ?
+                """, (dir_mtime, int(is_image), int(is_video), st.st_size, ts, ts, ts, ts, rel_dir))
+            self._refresh_survey(c, survey)
+            conn.commit()
+            conn.close()
+
+    def rescan_dirs(self, dirs):
+        """Re-index specific directories (e.g. from a watcher); returns surveys touched."""
+        touched = set()
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            for abs_dir in dirs:
+                rel_dir = self._rel(abs_dir)
+                survey = rel_dir.split("/")[0]
+                if rel_dir.startswith("..") or not SURVEY_NAME.match(survey):
+                    continue
+                try:
+                    mtime = os.stat(abs_dir).st_mtime_ns
+                    values, subdirs = self._scan_dir(abs_dir, rel_dir)
+                    self._store_dir(c, rel_dir, mtime, values, subdirs)
+                except OSError:
+                    # Directory is gone: drop it and everything below it
+                    c.execute("DELETE FROM storage_dirs WHERE path = ? OR path LIKE ?",
+                              (rel_dir, rel_dir + "/%"))
+                touched.add(survey)
+            for survey in touched:
+                self._refresh_survey(c, survey)
+            conn.commit()
+            conn.close()
+        return touched
+
+    # ---------- reconciliation ----------
+    def reconcile(self, full=False):
+        """Rescan directories whose mtime changed (or everything if ``full``)."""
+        started = time.time()
+        rescanned = 0
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute("SELECT path, mtime_ns, subdirs FROM storage_dirs")
+            known = {row[0]: (row[1], json.loads(row[2] or "[]")) for row in c.fetchall()}
+
+            seen = set()
+            touched = set()
+            surveys = []
+            if os.path.isdir(self.storage_root):
+                with os.scandir(self.storage_root) as it:
+                    surveys = [e.name for e in it if e.is_dir() and SURVEY_NAME.match(e.name)]
+
+            for survey in surveys:
+                stack = [survey]
+                while stack:
+                    rel_dir = stack.pop()
+                    abs_dir = os.path.join(self.storage_root, *rel_dir.split("/"))
+                    try:
+                        mtime = os.stat(abs_dir).st_mtime_ns
+                    except OSError:
+                        continue
+                    seen.add(rel_dir)
+
+                    cached = known.get(rel_dir)
+                    if full or cached is None or cached[0] != mtime:
+                        values, subdirs = self._scan_dir(abs_dir, rel_dir)
+                        self._store_dir(c, rel_dir, mtime, values, subdirs)
+                        touched.add(survey)
+                        rescanned += 1
+                    else:
+                        subdirs = cached[1]
+                    stack.extend(f"{rel_dir}/{name}" for name in subdirs)
+
+            for rel_dir in set(known) - seen:
+                c.execute("DELETE FROM storage_dirs WHERE path = ?", (rel_dir,))
+                touched.add(rel_dir.split("/")[0])
+
+            for survey in touched:
+                self._refresh_survey(c, survey)
+            conn.commit()
+            conn.close()
+
+        self.last_reconcile = {
+            "at": started,
+            "full": full,
+            "dirs_checked": len(seen),
+            "dirs_rescanned": rescanned,
+            "seconds": round(time.time() - started, 3),
+        }
+        return rescanned
+
+    def _run(self):
+        cycle = 0
+        while True:
+            try:
+                self.reconcile(full=cycle > 0 and cycle % self.full_rescan_every == 0)
+            except Exception as e:
+                print(f"⚠️ Storage reconcile error: {e}")
+            cycle += 1
+            time.sleep(self.reconcile_interval)
+
+    def start(self):
+        self.init_schema()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-index", daemon=True)
+            self._thread.start()
+
+    # ---------- reads ----------
+    def survey_stats(self, survey):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        SELECT images, videos, bytes, first_capture, last_capture
+        FROM survey_stats WHERE survey = ?
+        """, (survey,))
+        row = c.fetchone()
+        conn.close()
+        if not row:
+            return {"images": 0, "videos": 0, "bytes": 0, "first_capture": None, "last_capture": None}
+        return {"images": row[0], "videos": row[1], "bytes": row[2],
+                "first_capture": row[3], "last_capture": row[4]}
+
+    def all_surveys(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+        SELECT survey, images, videos, bytes, first_capture, last_capture
+        FROM survey_stats ORDER BY survey
+        """)
+        rows = c.fetchall()
+        conn.close()
+        return [{"date": r[0], "images": r[1], "videos": r[2], "bytes": r[3],
+                 "first_capture": r[4], "last_capture": r[5]} for r in rows]
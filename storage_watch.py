@@ -0,0 +1,293 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+from listing import SURVEY_NAME
+
+
+# =========================
+# LIVE STORAGE COUNTERS
+# =========================
+class StatsBroker:
+    """In-memory per-survey counters that fan deltas out to SSE subscribers."""
+
+    def __init__(self, storage_index, max_queue=100):
+        self.storage_index = storage_index
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._subscribers = set()
+
+    def seed(self):
+        with self._lock:
+            self._counters = {
+                s["date"]: {"images": s["images"], "videos": s["videos"], "bytes": s["bytes"]}
+                for s in self.storage_index.all_surveys()
+            }
+
+    def snapshot(self, survey):
+        with self._lock:
+            counts = dict(self._counters.get(survey, {"images": 0, "videos": 0, "bytes": 0}))
+        return self._event(survey, counts, None)
+
+    @staticmethod
+    def _event(survey, counts, delta):
+        return {
+            "survey": survey,
+            "images": counts["images"],
+            "videos": counts["videos"],
+            "storage_mb": round(counts["bytes"] / (1024 * 1024), 2),
+            "delta": delta,
+        }
+
+    def refresh(self, surveys):
+        """Pull fresh totals for ``surveys`` from the index and publish any change."""
+        self._publish((survey, self.storage_index.survey_stats(survey)) for survey in surveys)
+
+    def refresh_all(self):
+        self._publish((s["date"], s) for s in self.storage_index.all_surveys())
+
+    def _publish(self, rows):
+        for survey, new in rows:
+            counts = {"images": new["images"], "videos": new["videos"], "bytes": new["bytes"]}
+            with self._lock:
+                old = self._counters.get(survey, {"images": 0, "videos": 0, "bytes": 0})
+                delta = {k: counts[k] - old[k] for k in counts}
+                if not any(delta.values()):
+                    continue
+                self._counters[survey] = counts
+                subscribers = list(self._subscribers)
+
+            event = self._event(survey, counts, delta)
+            for q in subscribers:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    # Slow client: drop its oldest event rather than block the watcher
+                    try:
+                        q.get_nowait()
+                        q.put_nowait(event)
+                    except (queue.Empty, queue.Full):
+                        pass
+
+    def subscribe(self, survey, heartbeat=15):
+        """Yield SSE frames for one client: a snapshot first, then deltas for ``survey``."""
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+        try:
+            yield f"data: {json.dumps(self.snapshot(survey))}\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["survey"] == survey:
+                    yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+# =========================
+# INOTIFY (LINUX) VIA CTYPES
+# =========================
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Watches every survey directory under the storage root with inotify."""
+
+    def __init__(self, root):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.root = os.path.abspath(root)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths = {}   # watch descriptor -> directory path
+        self.add_watch(self.root)
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            print(f"⚠️ inotify watch failed for {path}: {os.strerror(err)}")
+            return None
+        self._paths[wd] = path
+        return wd
+
+    def add_tree(self, path):
+        """Watch ``path`` and all directories below it; returns the directories added."""
+        added = []
+        for dirpath, dirnames, _ in os.walk(path):
+            if self.add_watch(dirpath) is not None:
+                added.append(dirpath)
+        return added
+
+    def _is_survey_path(self, path):
+        rel = os.path.relpath(path, self.root)
+        return not rel.startswith("..") and SURVEY_NAME.match(rel.split(os.sep)[0]) is not None
+
+    def watch_surveys(self):
+        added = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_dir() and SURVEY_NAME.match(entry.name):
+                    added.extend(self.add_tree(entry.path))
+        return added
+
+    def read_dirty(self, timeout):
+        """Block up to ``timeout`` seconds; return (dirty directories, overflowed)."""
+        dirty = set()
+        overflow = False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return dirty, overflow
+
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+
+            parent = self._paths.get(wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, name) if name else parent
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self._is_survey_path(path):
+                # New directory: watch it and everything already inside
+                dirty.update(self.add_tree(path))
+            if self._is_survey_path(parent):
+                dirty.add(parent)
+            if mask & IN_DELETE_SELF or (mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM)):
+                dirty.add(path)
+        return dirty, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+# =========================
+# WATCHER SERVICE
+# =========================
+class StorageWatcher:
+    """Keeps the storage index and live counters current as files change.
+
+    Uses inotify where available and debounces bursts of events into one
+    rescan per directory. Falls back to mtime polling through the storage
+    index reconcile pass (non-Linux hosts, network filesystems, or
+    ``STORAGE_WATCH=poll``).
+    """
+
+    def __init__(self, storage_index, broker, root, mode="auto", debounce=0.25, poll_interval=5):
+        self.storage_index = storage_index
+        self.broker = broker
+        self.root = root
+        self.mode = mode
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.backend = None
+        self.events = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        self.storage_index.reconcile()
+        self.broker.seed()
+
+        watcher = None
+        if self.mode in ("auto", "inotify"):
+            try:
+                watcher = InotifyWatcher(self.root)
+                watcher.watch_surveys()
+            except (OSError, AttributeError) as e:
+                print(f"⚠️ inotify unavailable ({e}), falling back to polling")
+                watcher = None
+
+        self.backend = "inotify" if watcher else "poll"
+        target = self._run_inotify if watcher else self._run_poll
+        self._thread = threading.Thread(target=target, args=(watcher,) if watcher else (),
+                                        name="storage-watcher", daemon=True)
+        self._thread.start()
+        print("👁️ Storage watcher:", self.backend)
+
+    def _run_inotify(self, watcher):
+        pending = set()
+        deadline = None
+        while True:
+            try:
+                timeout = self.debounce if pending else 1.0
+                dirty, overflow = watcher.read_dirty(timeout)
+                if overflow:
+                    self.storage_index.reconcile()
+                    self.broker.refresh_all()
+                    pending.clear()
+                    continue
+                if dirty:
+                    self.events += len(dirty)
+                    pending |= dirty
+                    deadline = deadline or time.time() + self.debounce
+                if pending and time.time() >= deadline:
+                    touched = self.storage_index.rescan_dirs(sorted(pending))
+                    self.broker.refresh(touched)
+                    pending.clear()
+                    deadline = None
+            except Exception as e:
+                print(f"⚠️ Storage watcher error: {e}")
+                time.sleep(1)
+
+    def _run_poll(self):
+        while True:
+            try:
+                # Captures update the index directly, so compare totals every pass
+                self.storage_index.reconcile()
+                self.broker.refresh_all()
+            except Exception as e:
+                print(f"⚠️ Storage poll error: {e}")
+            time.sleep(self.poll_interval)
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "events": self.events,
+            "subscribers": self.broker.subscriber_count(),
+            "last_reconcile": self.storage_index.last_reconcile,
+        }
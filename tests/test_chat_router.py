@@ -0,0 +1,70 @@
+import pytest
+
+from chat_router import IntentRouter, ResponseCache
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter()
+
+
+@pytest.mark.parametrize("message", [
+    "how many images do i need for a good map",
+    "how many photos should i take for a quarry",
+    "what is the volume of the moon",
+    "what is the volume of a cylinder",
+    "how is the stockpile volume calculated",
+    "how accurate is the volume estimation",
+    "how much storage does a 4k video need",
+    "explain photogrammetry",
+    "tell me the current weather",
+    "what was the last survey result",
+    "is the processing of lidar data hard",
+    "count the number of piles you can see in an image",
+    "what is the status of drone laws",
+])
+def test_general_questions_go_to_the_llm(router, message):
+    intent, source, _ = router.route(message)
+    assert (intent, source) == (None, "llm")
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("status", "status"),
+    ("what is the status of my mapping", "status"),
+    ("generate mapping today", "mapping"),
+    ("how many images were captured today", "statistics"),
+    ("how many photos have been taken", "statistics"),
+    ("storage usage", "statistics"),
+    ("latest volume", "volume"),
+    ("volume of the last survey", "volume"),
+])
+def test_commands_route_by_pattern(router, message, intent):
+    assert router.route(message)[:2] == (intent, "pattern")
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("is my mapping done", "status"),
+    ("has the reconstruction finished", "status"),
+    ("number of photos taken today", "statistics"),
+    ("what is the stockpile volume", "volume"),
+    ("how much material is in the pile", "volume"),
+])
+def test_paraphrases_route_by_classifier(router, message, intent):
+    assert router.route(message)[:2] == (intent, "classifier")
+
+
+def test_router_default_confidence_is_what_ships(router):
+    # app.py falls back to the class default; these tests run at that threshold
+    assert router.min_confidence == IntentRouter.default_confidence == 0.9
+
+
+def test_mapping_is_never_started_by_the_classifier(router):
+    # "start it" style paraphrases must not trigger a run
+    assert router.route("could you kick off processing for me")[0] != "mapping"
+
+
+def test_response_cache_shares_normalised_prompts():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put(cache.key("What is GSD?", "m"), "reply", generation_ms=1200)
+    assert cache.get(cache.key("what is  gsd", "m")) == "reply"
+    assert cache.stats()["saved_ms"] == 1200
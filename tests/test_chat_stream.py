@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+
+from chat_stream import ChatStreamer
+
+TOKENS = ["Stock", "pile ", "volumes ", "are ", "measured ", "from ", "the ", "DSM."]
+
+
+class FakeCompletions(BaseHTTPRequestHandler):
+    """OpenAI-style streamed chat completion: one SSE chunk per token."""
+
+    delay = 0.05
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, token in enumerate(TOKENS):
+            chunk = {"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCompletions)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Same variable app.py reads to point the client at a local server
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    yield os.environ["OPENAI_BASE_URL"]
+    server.shutdown()
+    os.environ.pop("OPENAI_BASE_URL", None)
+
+
+def test_tokens_arrive_in_order(base_url):
+    streamer = ChatStreamer("test-key", model="fake", base_url=os.environ["OPENAI_BASE_URL"])
+    events = list(streamer.stream([{"role": "user", "content": "hi"}]))
+    assert events[0][0] == "start"
+    assert [data for kind, data in events if kind == "token"] == TOKENS
+    kind, metrics = events[-1]
+    assert kind == "done" and metrics["status"] == "ok" and metrics["chunks"] == len(TOKENS)
+    assert metrics["ttft_ms"] <= metrics["total_ms"]
+
+
+def test_concurrency_limit_turns_requests_away(base_url):
+    streamer = ChatStreamer("test-key", model="fake", base_url=base_url, max_concurrent=1, queue_wait=0.05)
+    results = []
+
+    # Every first request races to start the shared loop
+    threads = [threading.Thread(target=lambda: results.append(list(
+        streamer.stream([{"role": "user", "content": "hi"}])))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    statuses = sorted(events[-1][1]["status"] for events in results)
+    assert statuses == ["ok", "rejected", "rejected"]
+    assert streamer.stats()["rejected"] == 2
+    assert streamer.stats()["active"] == 0
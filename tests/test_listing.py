@@ -0,0 +1,51 @@
+import base64
+import json
+
+import pytest
+
+from listing import DirectoryIndex, decode_cursor, encode_cursor
+
+
+def raw_cursor(text):
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "!!!not-base64",
+    raw_cursor("{not json"),
+    encode_cursor({"ts": 1}),
+    encode_cursor([1, "a.jpg"]),
+    encode_cursor(["1", "a.jpg", "images"]),
+    encode_cursor([None, "a.jpg", "images"]),
+    encode_cursor([True, "a.jpg", "images"]),
+    encode_cursor([1, 2, "images"]),
+    encode_cursor([1, "a.jpg", ["images"]]),
+    raw_cursor('[NaN, "a.jpg", "images"]'),
+])
+def test_malformed_cursor_is_a_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor([1714550400.0, "20240501_080000_1.jpg", "images"])) == \
+        (1714550400.0, "20240501_080000_1.jpg", "images")
+    assert decode_cursor(encode_cursor([0, "2024-05-01", "survey"])) == (0, "2024-05-01", "survey")
+    assert decode_cursor("") is None
+
+
+def test_pages_follow_the_cursor(tmp_path):
+    for i in range(5):
+        (tmp_path / f"20240501_08000{i}_x.jpg").write_bytes(b"")
+    index = DirectoryIndex()
+    sources = [(str(tmp_path), "images", (".jpg",))]
+
+    first, cursor, total = index.page(sources, limit=3)
+    second, last_cursor, _ = index.page(sources, cursor, limit=3)
+    assert total == 5 and last_cursor is None
+    assert [name for _, name, _ in first + second] == [f"20240501_08000{i}_x.jpg" for i in range(5)]
+
+    with pytest.raises(ValueError):
+        index.page(sources, encode_cursor([None, None, None]), limit=3)
+    with pytest.raises(ValueError):
+        index.surveys(str(tmp_path), raw_cursor(json.dumps(["x", "2024-05-01", "survey"])))
@@ -0,0 +1,61 @@
+import sqlite3
+
+from mapping_jobs import MappingJobQueue
+
+
+def queues(tmp_path, max_attempts=2):
+    db = str(tmp_path / "jobs.db")
+    odm = MappingJobQueue(db, runner=None, stage="odm", max_attempts=max_attempts)
+    odm.init_schema()
+    finish = MappingJobQueue(db, runner=None, stage="finish", max_attempts=max_attempts)
+    return db, odm, finish
+
+
+def expire_leases(db):
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE mapping_jobs SET lease_until = 0 WHERE lease_until IS NOT NULL")
+    conn.commit()
+    conn.close()
+
+
+def test_lost_finish_stage_fails_after_max_attempts(tmp_path):
+    db, odm, finish = queues(tmp_path)
+    job, _ = odm.submit("2024-05-01")
+    claimed = odm._claim("t")
+    odm._finish(claimed, "reconstructed")
+
+    for attempt in (1, 2):
+        claimed = finish._claim("t")
+        assert claimed["state"] == "finishing"
+        assert claimed["finish_attempts"] == attempt
+        expire_leases(db)   # the web app died mid-finish
+
+    assert finish._claim("t") is None
+    lost = finish.get(job["id"])
+    assert lost["state"] == "failed"
+    assert lost["error"] == "Worker lost (lease expired)"
+    assert lost["attempts"] == 1
+
+
+def test_finish_attempts_do_not_use_up_odm_attempts(tmp_path):
+    db, odm, finish = queues(tmp_path)
+    job, _ = odm.submit("2024-05-01")
+    odm._claim("t")
+    expire_leases(db)   # ODM worker lost once
+    claimed = odm._claim("t")
+    assert claimed["attempts"] == 2
+    odm._finish(claimed, "reconstructed")
+
+    claimed = finish._claim("t")
+    assert claimed["finish_attempts"] == 1
+    finish._finish(claimed, "completed")
+    assert finish.get(job["id"])["state"] == "completed"
+
+
+def test_lost_odm_run_is_requeued_then_failed(tmp_path):
+    db, odm, _ = queues(tmp_path, max_attempts=1)
+    job, _ = odm.submit("2024-05-01")
+    odm._claim("t")
+    expire_leases(db)
+    assert odm._claim("t") is None
+    assert odm.get(job["id"])["state"] == "failed"
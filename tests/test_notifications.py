@@ -0,0 +1,208 @@
+import json
+import socketserver
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+pytest.importorskip("requests")
+
+from notifications import NotificationOutbox, SmtpTransport, TwilioTransport
+
+
+class SmtpSink(socketserver.StreamRequestHandler):
+    """Just enough SMTP to take a message; the first ``fail_data`` DATA commands get a 451."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 sink ready")
+        while True:
+            line = self.rfile.readline().decode(errors="replace").strip()
+            verb = line.split(" ", 1)[0].upper()
+            if not line or verb == "QUIT":
+                self.reply("221 bye")
+                return
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 sink")
+            elif verb == "DATA":
+                self.reply("354 go ahead")
+                data = b""
+                while not data.endswith(b"\r\n.\r\n"):
+                    chunk = self.rfile.readline()
+                    if not chunk:
+                        return
+                    data += chunk
+                if self.server.fail_data > 0:
+                    self.server.fail_data -= 1
+                    self.reply("451 try again later")
+                else:
+                    self.server.messages.append(data.decode(errors="replace"))
+                    self.reply("250 queued")
+            else:
+                self.reply("250 ok")
+
+
+class TwilioStub(BaseHTTPRequestHandler):
+    """Twilio's Messages endpoint; the first ``fail_requests`` POSTs get a 503."""
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        if self.server.fail_requests > 0:
+            self.server.fail_requests -= 1
+            status, body = 503, {"message": "Service unavailable"}
+        else:
+            self.server.messages.append({"path": self.path, "auth": self.headers.get("Authorization"),
+                                         "form": {k: v[0] for k, v in form.items()}})
+            status, body = 201, {"sid": f"SM{len(self.server.messages):032d}"}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def smtp_sink():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SmtpSink)
+    server.daemon_threads = True
+    server.messages, server.fail_data = [], 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def twilio_stub(monkeypatch):
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TwilioStub)
+    server.messages, server.fail_requests = [], 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_outbox(tmp_path, smtp_sink=None, twilio_stub=None, **kwargs):
+    """Outbox on the local servers; a channel without one is left unconfigured."""
+    # Same settings app.py takes from SMTP_HOST/SMTP_PORT/SMTP_SSL and TWILIO_API_BASE
+    email = SmtpTransport(None, 0)
+    if smtp_sink:
+        email = SmtpTransport("127.0.0.1", smtp_sink.server_address[1], sender="drone@example.com", use_ssl=False)
+    whatsapp = TwilioTransport(None, None, None)
+    if twilio_stub:
+        whatsapp = TwilioTransport("AC123", "token", "whatsapp:+15550001111",
+                                   base_url=f"http://127.0.0.1:{twilio_stub.server_port}")
+    outbox = NotificationOutbox(str(tmp_path / "outbox.db"), {"email": email, "whatsapp": whatsapp}, **kwargs)
+    outbox.init_schema()
+    return outbox
+
+
+def make_due(outbox):
+    """Skip the backoff wait instead of sleeping through it."""
+    conn = sqlite3.connect(outbox.db_path)
+    conn.execute("UPDATE notifications SET next_attempt_at = ? WHERE state = 'pending'", (time.time(),))
+    conn.commit()
+    conn.close()
+
+
+def test_flush_delivers_both_channels(tmp_path, smtp_sink, twilio_stub):
+    report = tmp_path / "report.pdf"
+    report.write_bytes(b"%PDF-1.4 fake")
+    outbox = make_outbox(tmp_path, smtp_sink, twilio_stub)
+    email_id = outbox.enqueue("email", "client@example.com", "Your volume report", subject="Mapping done",
+                              attachment_path=str(report), attachment_name="volume.pdf")
+    whatsapp_id = outbox.enqueue("whatsapp", "whatsapp:+15552223333", "Mapping done",
+                                 media_url="https://example.com/map.png")
+
+    assert outbox.flush() == 2
+    email, whatsapp = outbox.get(email_id), outbox.get(whatsapp_id)
+    assert email["state"] == whatsapp["state"] == "sent"
+    assert email["attempts"] == whatsapp["attempts"] == 1
+    assert email["provider_id"].endswith("@example.com>") and whatsapp["provider_id"] == "SM" + "1".zfill(32)
+
+    [raw] = smtp_sink.messages
+    assert f"Message-ID: {email['provider_id']}" in raw
+    assert "To: client@example.com" in raw and "Subject: Mapping done" in raw and 'filename="volume.pdf"' in raw
+    [sent] = twilio_stub.messages
+    assert sent["path"] == "/2010-04-01/Accounts/AC123/Messages.json"
+    assert sent["auth"].startswith("Basic ")
+    assert sent["form"] == {"From": "whatsapp:+15550001111", "To": "whatsapp:+15552223333",
+                            "Body": "Mapping done", "MediaUrl": "https://example.com/map.png"}
+    assert outbox.flush() == 0
+
+
+def test_transient_twilio_failure_backs_off_then_retries(tmp_path, twilio_stub):
+    twilio_stub.fail_requests = 1
+    outbox = make_outbox(tmp_path, twilio_stub=twilio_stub, backoff_base=5)
+    message_id = outbox.enqueue("whatsapp", "whatsapp:+15552223333", "Mapping done")
+
+    assert outbox.flush() == 1
+    pending = outbox.get(message_id)
+    assert pending["state"] == "pending" and pending["attempts"] == 1
+    assert "Twilio HTTP 503" in pending["error"]
+    # First retry waits backoff_base seconds, +/- 20% jitter
+    assert 4.0 <= pending["next_attempt_at"] - pending["created_at"] <= 6.5
+    assert outbox.flush() == 0   # not due yet
+
+    make_due(outbox)
+    assert outbox.flush() == 1
+    sent = outbox.get(message_id)
+    assert sent["state"] == "sent" and sent["attempts"] == 2 and sent["error"] is None
+    assert len(twilio_stub.messages) == 1
+
+
+def test_transient_smtp_failure_reconnects_and_retries(tmp_path, smtp_sink):
+    smtp_sink.fail_data = 1
+    outbox = make_outbox(tmp_path, smtp_sink=smtp_sink)
+    first = outbox.enqueue("email", "a@example.com", "one", subject="1")
+    second = outbox.enqueue("email", "b@example.com", "two", subject="2")
+
+    outbox.flush()
+    assert outbox.get(first)["state"] == "pending" and outbox.get(first)["attempts"] == 1
+    # The rest of the batch went back without using up an attempt and was sent on a fresh session
+    assert outbox.get(second)["state"] == "sent" and outbox.get(second)["attempts"] == 1
+    assert outbox.transports["email"].connects == 2
+
+    make_due(outbox)
+    outbox.flush()
+    retried = outbox.get(first)
+    assert retried["state"] == "sent" and retried["attempts"] == 2
+    assert len(smtp_sink.messages) == 2
+    assert outbox.transports["email"].connects == 2
+
+
+def test_failures_stop_at_max_attempts(tmp_path, twilio_stub):
+    twilio_stub.fail_requests = 10
+    outbox = make_outbox(tmp_path, twilio_stub=twilio_stub, max_attempts=2)
+    message_id = outbox.enqueue("whatsapp", "whatsapp:+15552223333", "Mapping done")
+    outbox.flush()
+    make_due(outbox)
+    outbox.flush()
+    failed = outbox.get(message_id)
+    assert failed["state"] == "failed" and failed["attempts"] == 2
+    make_due(outbox)
+    assert outbox.flush() == 0
+
+
+def test_not_configured_fails_without_retry(tmp_path):
+    outbox = make_outbox(tmp_path)
+    email_id = outbox.enqueue("email", "client@example.com", "Your volume report")
+    whatsapp_id = outbox.enqueue("whatsapp", "whatsapp:+15552223333", "Mapping done")
+
+    assert outbox.flush() == 2
+    email, whatsapp = outbox.get(email_id), outbox.get(whatsapp_id)
+    assert (email["state"], email["attempts"], email["error"]) == ("failed", 1, "Email credentials not configured")
+    assert (whatsapp["state"], whatsapp["attempts"], whatsapp["error"]) == \
+        ("failed", 1, "Twilio credentials not configured")
+    make_due(outbox)
+    assert outbox.flush() == 0
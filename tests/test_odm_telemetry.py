@@ -0,0 +1,69 @@
+import os
+
+from odm_telemetry import OdmLogParser, parse_mem_usage
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def replay(name, returncode):
+    """Feed a captured ODM console log through the parser, one second per line."""
+    parser = OdmLogParser(clock=None)
+    with open(os.path.join(FIXTURES, name)) as f:
+        for second, line in enumerate(f):
+            parser.feed(line.rstrip("\n"), at=float(second))
+    parser.finish(returncode, at=float(second + 1))
+    return parser.summary()
+
+
+def test_captured_log_stages_in_run_order():
+    run = replay("odm_console_oom.log", 1)
+    assert [s["stage"] for s in run["stages"]] == [
+        "dataset", "split", "merge", "opensfm", "openmvs", "odm_filterpoints", "odm_meshing",
+    ]
+    assert [s["status"] for s in run["stages"]] == ["done"] * 6 + ["failed"]
+
+
+def test_captured_log_opensfm_steps():
+    run = replay("odm_console_oom.log", 1)
+    opensfm = next(s for s in run["stages"] if s["stage"] == "opensfm")
+    assert [s["step"] for s in opensfm["steps"]] == [
+        "extract_metadata", "detect_features", "match_features", "create_tracks", "reconstruct", "export_geocoords",
+    ]
+    assert all(s["seconds"] > 0 for s in opensfm["steps"])
+    assert sum(s["seconds"] for s in opensfm["steps"]) <= opensfm["seconds"]
+    # Other tools' "running ..." lines are not OpenSfM steps
+    meshing = next(s for s in run["stages"] if s["stage"] == "odm_meshing")
+    assert meshing["steps"] == []
+
+
+def test_captured_log_images_and_error():
+    run = replay("odm_console_oom.log", 1)
+    assert run["images"] == 214
+    assert run["stages"][0]["images"] == 214
+    assert run["error"].startswith("Whoops! You ran out of memory!")
+
+
+def test_stage_timings_follow_line_times():
+    parser = OdmLogParser(clock=None)
+    parser.feed("[INFO]    Running dataset stage", at=100.0)
+    parser.feed("[INFO]    Finished dataset stage", at=112.0)
+    parser.feed("[INFO]    Running opensfm stage", at=112.0)
+    parser.note_memory(900)
+    parser.note_memory(2048)
+    parser.feed("[INFO]    Running odm_meshing stage", at=400.0)   # no "Finished" line: closed by the next stage
+    parser.note_memory(1500)
+    parser.finish(0, at=460.0)
+    run = parser.summary()
+    assert [(s["stage"], s["seconds"], s["peak_mem_mb"], s["status"]) for s in run["stages"]] == [
+        ("dataset", 12.0, None, "done"),
+        ("opensfm", 288.0, 2048, "done"),
+        ("odm_meshing", 60.0, 1500, "done"),
+    ]
+    assert run["wall_s"] == 360.0
+    assert run["peak_mem_mb"] == 2048
+
+
+def test_parse_mem_usage():
+    assert parse_mem_usage("1.5GiB / 8GiB") == 1536
+    assert parse_mem_usage("512MiB / 2GiB") == 512
+    assert parse_mem_usage("--") is None
@@ -0,0 +1,77 @@
+import shutil
+import struct
+import subprocess
+from fractions import Fraction
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from camera import CapturedFrame
+from recorder import FragmentedMp4Writer, RecordingPipeline
+
+pytestmark = pytest.mark.skipif(not shutil.which("ffmpeg"), reason="needs ffmpeg")
+
+T0 = 1_700_000_000.0
+# 10 fps: a stall at 0.2 s (padded), two captures in the 0.3 s slot (second one skipped)
+TIMESTAMPS = [T0, T0 + 0.1, T0 + 0.3, T0 + 0.32, T0 + 0.4]
+
+
+def jpeg(i):
+    image = np.full((64, 64, 3), i * 40 % 256, dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def top_level_boxes(path):
+    boxes = []
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return boxes
+            size, kind = struct.unpack(">I4s", header)
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0] - 8
+            elif size == 0:
+                boxes.append(kind.decode())
+                return boxes
+            boxes.append(kind.decode())
+            f.seek(size - 8, 1)
+
+
+def packet_times(path):
+    """Presentation times (s) of the video packets, via ffmpeg's framemd5 muxer (no ffprobe needed)."""
+    out = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framemd5", "-"],
+                         capture_output=True, text=True, check=True).stdout
+    times, time_base = [], None
+    for line in out.splitlines():
+        if line.startswith("#tb 0:"):
+            time_base = Fraction(line.split(":", 1)[1].strip())
+        elif line and not line.startswith("#"):
+            times.append(float(int(line.split(",")[2]) * time_base))
+    return sorted(times)
+
+
+def test_fmp4_frames_follow_capture_time_with_sidx(tmp_path):
+    path = str(tmp_path / "segment.mp4")
+    writer = FragmentedMp4Writer(path, 10, keyframe_seconds=0.2)
+    written = [writer.write(CapturedFrame(jpeg(i), ts)) for i, ts in enumerate(TIMESTAMPS)]
+    info = writer.close()
+
+    assert written == [True, True, True, False, True]
+    assert (info["frames"], info["padded_frames"], info["dropped_frames"]) == (4, 1, 1)
+    boxes = top_level_boxes(path)
+    assert boxes[:2] == ["ftyp", "moov"] and "sidx" in boxes and "moof" in boxes
+    assert packet_times(path) == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4], abs=1e-3)
+
+
+def test_pipeline_counts_only_encoded_frames(tmp_path):
+    pipeline = RecordingPipeline(str(tmp_path), backend="fmp4", default_fps=10)
+    for i, ts in enumerate(TIMESTAMPS):
+        pipeline.submit_frame(CapturedFrame(jpeg(i), ts))
+    pipeline.close()
+    stats = pipeline.stats()
+    assert (stats["frames_written"], stats["frames_skipped"], stats["write_errors"]) == (4, 1, 0)
+    [segment] = stats["recent_segments"]
+    assert packet_times(segment["path"]) == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4], abs=1e-3)
@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from raster_tiles import MappedTiff
+from volume_engine import BASE_METHODS, Raster, compute_volume, stockpile_volume, stockpile_volumes, survey_change
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def box_dsm(ground=100.0, height=2.0):
+    """1 m grid, flat ground with a 100 x 100 x 2 m box from pixel 30 to 130."""
+    data = np.full((160, 160), ground, dtype=np.float32)
+    data[30:130, 30:130] += height
+    return Raster(data, origin_x=500000.0, origin_y=4000000.0)
+
+
+@pytest.mark.parametrize("base", BASE_METHODS)
+def test_box_volume_every_base(base):
+    dsm = box_dsm()
+    dtm = box_dsm(height=0.0)
+    # Boundary on the ground, 10 m clear of the box
+    polygon = [(500020.0, 3999980.0), (500140.0, 3999980.0), (500140.0, 3999860.0), (500020.0, 3999860.0)]
+    result = compute_volume(dsm, polygon, base=base, dtm=dtm, tile_size=64)
+    assert result["net_m3"] == pytest.approx(20000.0)
+    assert result["cut_m3"] == pytest.approx(20000.0)
+    assert result["fill_m3"] == pytest.approx(0.0)
+    assert result["max_height_m"] == pytest.approx(2.0)
+
+
+def test_dtm_base_needs_dtm():
+    with pytest.raises(ValueError):
+        compute_volume(box_dsm(), base="dtm")
+
+
+def run_fake_odm(project_path, dataset, ground=100):
+    os.makedirs(os.path.join(project_path, dataset, "images"))
+    env = dict(os.environ, FAKE_ODM_SECONDS="0", FAKE_GROUND_Z=str(ground))
+    subprocess.run([sys.executable, os.path.join(REPO, "fake_odm.py"), "--project-path", str(project_path), dataset],
+                   check=True, capture_output=True, env=env)
+    return os.path.join(project_path, dataset)
+
+
+def test_fake_odm_writes_readable_geotiffs(tmp_path):
+    project = run_fake_odm(tmp_path, "2024-05-01")
+    dsm = MappedTiff(os.path.join(project, "odm_dem", "dsm.tif"))
+    ortho = MappedTiff(os.path.join(project, "odm_orthophoto", "odm_orthophoto.tif"))
+    try:
+        assert (dsm.width, dsm.height, dsm.samples, dsm.dtype.kind) == (160, 160, 1, "f")
+        assert (dsm.origin_x, dsm.origin_y, dsm.pixel_w, dsm.nodata) == (500000.0, 4000000.0, 1.0, -9999.0)
+        assert (ortho.samples, ortho.dtype) == (3, np.uint8)
+    finally:
+        dsm.close()
+        ortho.close()
+
+
+@pytest.mark.parametrize("base", BASE_METHODS)
+def test_fake_odm_stockpile_volume(tmp_path, base):
+    project = run_fake_odm(tmp_path, "2024-05-01")
+    assert stockpile_volume(project, base=base)["net_m3"] == pytest.approx(20000.0)
+
+
+def test_fake_odm_stockpile_volumes_and_change(tmp_path):
+    before = run_fake_odm(tmp_path, "2024-05-01")
+    after = run_fake_odm(tmp_path, "2024-06-01", ground=101)
+    polygons = tmp_path / "piles.json"
+    polygons.write_text(json.dumps([[500020.0, 3999980.0], [500140.0, 3999980.0],
+                                    [500140.0, 3999860.0], [500020.0, 3999860.0]]))
+    [pile] = stockpile_volumes(before, str(polygons), workers=1)
+    assert pile["net_m3"] == pytest.approx(20000.0)
+
+    change = survey_change(before, after)
+    assert change["site"]["added_m3"] == pytest.approx(160 * 160 * 1.0)
+    assert change["site"]["removed_m3"] == pytest.approx(0.0)
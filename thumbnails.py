@@ -0,0 +1,205 @@
+import collections
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+# =========================
+# IMAGE DERIVATIVE CACHE
+# =========================
+VARIANTS = {
+    "thumb": 256,      # gallery grid
+    "preview": 1280,   # lightbox / web preview
+}
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class DerivativeCache:
+    """Downscaled thumbnails and previews in a content-addressed, size-bounded cache.
+
+    Files are named by the SHA-256 of the source bytes plus the variant, so a
+    re-captured or edited image gets a new entry and a derivative can be served
+    as immutable forever. Least-recently-used files are evicted once the cache
+    grows past ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 * 1024 * 1024, fmt="WEBP",
+                 quality=80, workers=2):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fmt = fmt.upper()
+        self.extension = ".webp" if self.fmt == "WEBP" else ".jpg"
+        self.mimetype = "image/webp" if self.fmt == "WEBP" else "image/jpeg"
+        self.quality = quality
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="derivatives")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._warmed = {}   # images_dir -> directory mtime at last warm
+        # (path, size, mtime_ns) -> source digest, so warm hits skip rehashing
+        self._digests = collections.OrderedDict()
+        self._total_bytes = None
+        self.counters = {"hits": 0, "misses": 0, "generated": 0, "evicted": 0, "errors": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ---------- keys ----------
+    def _digest(self, source):
+        st = os.stat(source)
+        stat_key = (os.path.abspath(source), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(stat_key)
+            if digest is not None:
+                self._digests.move_to_end(stat_key)
+                return digest
+
+        h = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._digests[stat_key] = digest
+            if len(self._digests) > 50000:
+                self._digests.popitem(last=False)
+        return digest
+
+    def _cache_path(self, digest, variant):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}_{variant}{self.extension}")
+
+    # ---------- generation ----------
+    def _render(self, source, target, variant):
+        max_side = VARIANTS[variant]
+        with Image.open(source) as im:
+            # JPEG draft mode decodes straight at a reduced scale (much cheaper than full decode)
+            im.draft("RGB", (max_side, max_side))
+            im = im.convert("RGB")
+            im.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = target + ".tmp"
+            im.save(tmp, self.fmt, quality=self.quality)
+            os.replace(tmp, target)
+
+        size = os.path.getsize(target)
+        with self._lock:
+            self.counters["generated"] += 1
+            if self._total_bytes is not None:
+                self._total_bytes += size
+
+    def get(self, source, variant):
+        """Return the derivative path for ``source``, building it on a miss."""
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown derivative variant: {variant}")
+
+        target = self._cache_path(self._digest(source), variant)
+        if os.path.exists(target):
+            self.counters["hits"] += 1
+            try:
+                os.utime(target)   # mtime doubles as the LRU clock
+            except OSError:
+                pass
+            return target
+
+        self.counters["misses"] += 1
+        self._render(source, target, variant)
+        self._pool.submit(self.evict)
+        return target
+
+    def _build(self, source):
+        try:
+            digest = self._digest(source)
+            for variant in VARIANTS:
+                target = self._cache_path(digest, variant)
+                if not os.path.exists(target):
+                    self._render(source, target, variant)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"⚠️ Thumbnail error for {source}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(source)
+
+    def submit(self, source):
+        """Queue all variants of one image for background generation."""
+        with self._lock:
+            if source in self._pending:
+                return
+            self._pending.add(source)
+        self._pool.submit(self._build, source)
+
+    def warm(self, images_dir):
+        """Scan and pre-build a survey's derivatives without blocking the caller."""
+        try:
+            mtime = os.stat(images_dir).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            # Nothing added since the last warm-up, nothing to do
+            if self._warmed.get(images_dir) == mtime:
+                return
+            self._warmed[images_dir] = mtime
+        self._pool.submit(self.warm_directory, images_dir)
+
+    def warm_directory(self, images_dir):
+        """Pre-build derivatives for every image in a survey, then trim the cache."""
+        if not os.path.isdir(images_dir):
+            return 0
+        count = 0
+        with os.scandir(images_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    self.submit(entry.path)
+                    count += 1
+        self._pool.submit(self.evict)
+        return count
+
+    # ---------- eviction ----------
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def evict(self):
+        with self._lock:
+            total = self._total_bytes
+        if total is not None and total <= self.max_bytes:
+            return
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # Trim to 90% so we are not evicting again on the very next write
+        target = self.max_bytes * 0.9 if total > self.max_bytes else total
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+
+        with self._lock:
+            self._total_bytes = total
+            self.counters["evicted"] += evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "pending": len(self._pending),
+                "cache_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
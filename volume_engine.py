@@ -0,0 +1,702 @@
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from raster_tiles import GDAL_NODATA, GEOTIFF_PIXEL_SCALE, GEOTIFF_TIEPOINT, MappedTiff, UnsupportedTiff
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:   # optional: GeoTIFFs are memory-mapped with raster_tiles instead
+    rasterio = None
+
+
+# =========================
+# RASTER ACCESS
+# =========================
+BASE_METHODS = ("lowest", "average_edge", "plane", "tin", "dtm")
+
+
+class Raster:
+    """A single-band elevation grid plus its north-up geotransform.
+
+    ``data`` is anything sliceable as [rows, cols] (ndarray, memmap or a
+    memory-mapped GeoTIFF band); rasterio datasets are read window by window
+    instead, so tiles never pull the whole file into memory.
+    """
+
+    def __init__(self, data=None, origin_x=0.0, origin_y=0.0, pixel_w=1.0, pixel_h=1.0,
+                 nodata=None, dataset=None):
+        self.data = data
+        self.dataset = dataset
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.pixel_w = pixel_w
+        self.pixel_h = pixel_h
+        self.nodata = nodata
+        if dataset is not None:
+            self.height, self.width = dataset.height, dataset.width
+        else:
+            self.height, self.width = data.shape
+
+    @property
+    def pixel_area(self):
+        return self.pixel_w * self.pixel_h
+
+    def read(self, r0, r1, c0, c1):
+        if self.dataset is not None:
+            block = self.dataset.read(1, window=Window(c0, r0, c1 - c0, r1 - r0))
+        else:
+            block = self.data[r0:r1, c0:c1]
+        return np.asarray(block, dtype=np.float64)
+
+    def valid(self, block):
+        valid = np.isfinite(block)
+        if self.nodata is not None:
+            valid &= block != self.nodata
+        # ODM fills empty DSM cells with -9999
+        valid &= block > -9000
+        return valid
+
+    def world_to_pixel(self, points):
+        """(x, y) in raster CRS -> (col, row) as floats, pixel corners at integers."""
+        pts = np.asarray(points, dtype=np.float64)
+        cols = (pts[:, 0] - self.origin_x) / self.pixel_w
+        rows = (self.origin_y - pts[:, 1]) / self.pixel_h
+        return np.column_stack([cols, rows])
+
+    def sample(self, cols, rows):
+        """Nearest-pixel values at float pixel positions (NaN where invalid/outside)."""
+        c = np.clip(np.floor(cols).astype(np.int64), 0, self.width - 1)
+        r = np.clip(np.floor(rows).astype(np.int64), 0, self.height - 1)
+        if self.dataset is not None:
+            r0, r1, c0, c1 = r.min(), r.max() + 1, c.min(), c.max() + 1
+            block = self.read(r0, r1, c0, c1)
+            values = block[r - r0, c - c0]
+        else:
+            values = np.asarray(self.data[r, c], dtype=np.float64)
+        values = values.copy()
+        values[~self.valid(values)] = np.nan
+        return values
+
+
+def load_raster(path):
+    """Open a DSM/DTM GeoTIFF (rasterio if installed, else memory-mapped, else Pillow)."""
+    if rasterio is not None:
+        ds = rasterio.open(path)
+        t = ds.transform
+        return Raster(origin_x=t.c, origin_y=t.f, pixel_w=t.a, pixel_h=-t.e, nodata=ds.nodata, dataset=ds)
+
+    try:
+        tiff = MappedTiff(path)
+    except UnsupportedTiff as e:
+        print(f"⚠️ {path} cannot be memory-mapped ({e}), decoding it whole")
+    else:
+        return Raster(tiff.band(0), origin_x=tiff.origin_x, origin_y=tiff.origin_y,
+                      pixel_w=tiff.pixel_w, pixel_h=tiff.pixel_h, nodata=tiff.nodata)
+
+    from PIL import Image
+    with Image.open(path) as im:
+        tags = im.tag_v2
+        data = np.array(im, dtype=np.float32)
+        scale = tags.get(GEOTIFF_PIXEL_SCALE, (1.0, 1.0, 0.0))
+        tie = tags.get(GEOTIFF_TIEPOINT, (0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+        nodata = tags.get(GDAL_NODATA)
+    return Raster(
+        data,
+        origin_x=tie[3] - tie[0] * scale[0],
+        origin_y=tie[4] + tie[1] * scale[1],
+        pixel_w=scale[0],
+        pixel_h=scale[1],
+        nodata=float(str(nodata).strip("\x00")) if nodata not in (None, "") else None
+    )
+
+
+def load_polygon(path):
+    """Stockpile boundary from GeoJSON (Feature/Polygon) or a plain [[x, y], ...] list."""
+    return load_stockpiles(path)[0][1]
+
+
+def _ring(data):
+    points = [(float(p[0]), float(p[1])) for p in data]
+    if len(points) > 1 and points[0] == points[-1]:
+        points = points[:-1]
+    if len(points) < 3:
+        raise ValueError("Stockpile polygon needs at least 3 points")
+    return points
+
+
+def load_stockpiles(path):
+    """Named stockpile boundaries: [(name, points), ...].
+
+    A FeatureCollection gives one pile per Polygon feature, named by its
+    ``name``/``id`` property; a single Feature, Polygon or [[x, y], ...]
+    list is one pile called "stockpile".
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        return [("stockpile", _ring(data))]
+
+    features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+    piles = []
+    for i, feature in enumerate(features):
+        if feature.get("type") == "Feature":
+            props, geometry = feature.get("properties") or {}, feature["geometry"]
+        else:
+            props, geometry = {}, feature
+        if geometry.get("type", "Polygon") != "Polygon":
+            continue
+        default = "stockpile" if len(features) == 1 else f"pile-{i + 1}"
+        name = str(props.get("name") or props.get("id") or default)
+        piles.append((name, _ring(geometry["coordinates"][0])))
+
+    if not piles:
+        raise ValueError("No stockpile polygons found")
+    names = [name for name, _ in piles]
+    if len(set(names)) != len(names):
+        raise ValueError("Stockpile names must be unique")
+    return piles
+
+
+# =========================
+# GEOMETRY HELPERS
+# =========================
+def _polygon_mask(poly_px, r0, r1, c0, c1):
+    """Even-odd point-in-polygon test for every pixel centre of one tile."""
+    ys = (np.arange(r0, r1, dtype=np.float64) + 0.5)[:, None]
+    xs = (np.arange(c0, c1, dtype=np.float64) + 0.5)[None, :]
+    inside = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    n = len(poly_px)
+    for i in range(n):
+        x1, y1 = poly_px[i]
+        x2, y2 = poly_px[(i + 1) % n]
+        if y1 == y2:
+            continue
+        crosses = (y1 > ys) != (y2 > ys)
+        x_at = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (xs < x_at)
+    return inside
+
+
+def _edge_samples(poly_px, spacing=1.0):
+    """Points every ``spacing`` pixels along the closed polygon boundary."""
+    pts = []
+    n = len(poly_px)
+    for i in range(n):
+        x1, y1 = poly_px[i]
+        x2, y2 = poly_px[(i + 1) % n]
+        steps = max(1, int(math.ceil(math.hypot(x2 - x1, y2 - y1) / spacing)))
+        t = np.arange(steps, dtype=np.float64) / steps
+        pts.append(np.column_stack([x1 + (x2 - x1) * t, y1 + (y2 - y1) * t]))
+    return np.vstack(pts)
+
+
+def _signed_area(poly):
+    x, y = poly[:, 0], poly[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _ear_clip(poly):
+    """Triangulate a simple polygon; returns index triples."""
+    idx = list(range(len(poly)))
+    if _signed_area(poly) < 0:
+        idx.reverse()
+    triangles = []
+
+    def is_convex(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0]) > 0
+
+    def contains(a, b, c, p):
+        d1 = (p[0] - b[0]) * (a[1] - b[1]) - (a[0] - b[0]) * (p[1] - b[1])
+        d2 = (p[0] - c[0]) * (b[1] - c[1]) - (b[0] - c[0]) * (p[1] - c[1])
+        d3 = (p[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (p[1] - a[1])
+        return (d1 <= 0 and d2 <= 0 and d3 <= 0) or (d1 >= 0 and d2 >= 0 and d3 >= 0)
+
+    guard = 0
+    while len(idx) > 3 and guard < 10000:
+        guard += 1
+        for k in range(len(idx)):
+            i0, i1, i2 = idx[k - 1], idx[k], idx[(k + 1) % len(idx)]
+            a, b, c = poly[i0], poly[i1], poly[i2]
+            if not is_convex(a, b, c):
+                continue
+            if any(contains(a, b, c, poly[j]) for j in idx if j not in (i0, i1, i2)):
+                continue
+            triangles.append((i0, i1, i2))
+            del idx[k]
+            break
+        else:
+            break   # degenerate polygon: fan out what is left
+    for k in range(1, len(idx) - 1):
+        triangles.append((idx[0], idx[k], idx[k + 1]))
+    return triangles
+
+
+# =========================
+# BASE SURFACES
+# =========================
+class BaseSurface:
+    """Reference surface under the stockpile, evaluated tile by tile."""
+
+    def __init__(self, method, poly_px, edge_px, edge_z, dtm=None):
+        if method not in BASE_METHODS:
+            raise ValueError(f"Unknown base method: {method}")
+        self.method = method
+        self.dtm = dtm
+        self.params = {}
+
+        ok = np.isfinite(edge_z)
+        if method != "dtm" and not ok.any():
+            raise ValueError("No valid DSM elevations along the stockpile boundary")
+        edge_px, edge_z = edge_px[ok], edge_z[ok]
+
+        if method == "lowest":
+            self.level = float(edge_z.min())
+            self.params = {"elevation": round(self.level, 3)}
+        elif method == "average_edge":
+            self.level = float(edge_z.mean())
+            self.params = {"elevation": round(self.level, 3)}
+        elif method == "plane":
+            # Least-squares z = a*col + b*row + c through the boundary samples
+            A = np.column_stack([edge_px[:, 0], edge_px[:, 1], np.ones(len(edge_px))])
+            (self.a, self.b, self.c), *_ = np.linalg.lstsq(A, edge_z, rcond=None)
+            self.params = {"slope_col": float(self.a), "slope_row": float(self.b), "intercept": float(self.c)}
+        elif method == "tin":
+            # Triangulated surface through the polygon vertices' ground elevations
+            vertex_z = np.array([self._vertex_z(p, edge_px, edge_z) for p in poly_px])
+            self.vertices = poly_px
+            self.vertex_z = vertex_z
+            self.triangles = _ear_clip(poly_px)
+            self.params = {"triangles": len(self.triangles)}
+
+    @staticmethod
+    def _vertex_z(point, edge_px, edge_z):
+        # Local plane through the boundary samples around the vertex, evaluated at the vertex
+        d = np.hypot(edge_px[:, 0] - point[0], edge_px[:, 1] - point[1])
+        near = d <= 3.0
+        if np.count_nonzero(near) >= 3:
+            A = np.column_stack([edge_px[near, 0], edge_px[near, 1], np.ones(np.count_nonzero(near))])
+            coef, _, rank, _ = np.linalg.lstsq(A, edge_z[near], rcond=None)
+            if rank == 3:
+                return float(coef[0] * point[0] + coef[1] * point[1] + coef[2])
+        return float(edge_z[np.argmin(d)])
+
+    def evaluate(self, r0, r1, c0, c1):
+        shape = (r1 - r0, c1 - c0)
+        if self.method in ("lowest", "average_edge"):
+            return np.full(shape, self.level)
+        if self.method == "dtm":
+            block = self.dtm.read(r0, r1, c0, c1)
+            block[~self.dtm.valid(block)] = np.nan
+            return block
+
+        ys = (np.arange(r0, r1, dtype=np.float64) + 0.5)[:, None]
+        xs = (np.arange(c0, c1, dtype=np.float64) + 0.5)[None, :]
+        if self.method == "plane":
+            return self.a * xs + self.b * ys + self.c
+
+        base = np.full(shape, np.nan)
+        for i0, i1, i2 in self.triangles:
+            (x0, y0), (x1, y1), (x2, y2) = self.vertices[i0], self.vertices[i1], self.vertices[i2]
+            det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+            if det == 0:
+                continue
+            w0 = ((y1 - y2) * (xs - x2) + (x2 - x1) * (ys - y2)) / det
+            w1 = ((y2 - y0) * (xs - x2) + (x0 - x2) * (ys - y2)) / det
+            w2 = 1.0 - w0 - w1
+            inside = (w0 >= -1e-9) & (w1 >= -1e-9) & (w2 >= -1e-9)
+            z = w0 * self.vertex_z[i0] + w1 * self.vertex_z[i1] + w2 * self.vertex_z[i2]
+            base = np.where(inside & np.isnan(base), z, base)
+        return base
+
+
+# =========================
+# VOLUME COMPUTATION
+# =========================
+def compute_volume(dsm, polygon=None, base="plane", tile_size=1024, dtm=None, polygon_in_pixels=False):
+    """Cut/fill volumes of ``dsm`` against a base surface inside ``polygon``.
+
+    ``cut`` is material above the base (the stockpile), ``fill`` the voids
+    below it, ``net`` = cut - fill, all in cubic raster units. With no
+    polygon the whole raster extent is used. The grid is processed in
+    ``tile_size`` square tiles over the polygon's bounding box, so peak
+    memory is a few tile-sized arrays regardless of raster size.
+    """
+    started = time.perf_counter()
+    if base == "dtm" and dtm is None:
+        raise ValueError("Base method 'dtm' needs a DTM raster")
+
+    if polygon is None:
+        poly_px = np.array([(0, 0), (dsm.width, 0), (dsm.width, dsm.height), (0, dsm.height)], dtype=np.float64)
+    elif polygon_in_pixels:
+        poly_px = np.asarray(polygon, dtype=np.float64)
+    else:
+        poly_px = dsm.world_to_pixel(polygon)
+
+    # Snap boundary samples to the centres of the pixels they read, clamped
+    # inside the raster so full-extent polygons still hit valid pixels
+    edge_px = _edge_samples(poly_px)
+    edge_px[:, 0] = np.clip(np.floor(edge_px[:, 0]), 0, dsm.width - 1) + 0.5
+    edge_px[:, 1] = np.clip(np.floor(edge_px[:, 1]), 0, dsm.height - 1) + 0.5
+    edge_z = dsm.sample(edge_px[:, 0], edge_px[:, 1])
+    surface = BaseSurface(base, poly_px, edge_px, edge_z, dtm=dtm)
+
+    c_min = max(0, int(math.floor(poly_px[:, 0].min())))
+    c_max = min(dsm.width, int(math.ceil(poly_px[:, 0].max())))
+    r_min = max(0, int(math.floor(poly_px[:, 1].min())))
+    r_max = min(dsm.height, int(math.ceil(poly_px[:, 1].max())))
+
+    cut = fill = max_height = 0.0
+    pixels = nodata_pixels = tiles = 0
+    for r0 in range(r_min, r_max, tile_size):
+        r1 = min(r0 + tile_size, r_max)
+        for c0 in range(c_min, c_max, tile_size):
+            c1 = min(c0 + tile_size, c_max)
+            inside = _polygon_mask(poly_px, r0, r1, c0, c1)
+            if not inside.any():
+                continue
+            tiles += 1
+
+            z = dsm.read(r0, r1, c0, c1)
+            ref = surface.evaluate(r0, r1, c0, c1)
+            usable = inside & dsm.valid(z) & np.isfinite(ref)
+            nodata_pixels += int(np.count_nonzero(inside & ~usable))
+
+            diff = (z - ref)[usable]
+            pixels += diff.size
+            cut += float(diff[diff > 0].sum())
+            fill -= float(diff[diff < 0].sum())
+            if diff.size:
+                max_height = max(max_height, float(diff.max()))
+
+    area = dsm.pixel_area
+    return {
+        "cut_m3": round(cut * area, 3),
+        "fill_m3": round(fill * area, 3),
+        "net_m3": round((cut - fill) * area, 3),
+        "area_m2": round(pixels * area, 3),
+        "max_height_m": round(max_height, 3),
+        "pixels": pixels,
+        "nodata_pixels": nodata_pixels,
+        "base": base,
+        "base_params": surface.params,
+        "tile_size": tile_size,
+        "tiles": tiles,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def stockpile_volume(output_path, polygon_path=None, base="plane", tile_size=1024):
+    """Volume for one ODM project folder (odm_dem/dsm.tif, optional dtm.tif), or None without a DSM."""
+    dsm_path = os.path.join(output_path, "odm_dem", "dsm.tif")
+    if not os.path.exists(dsm_path):
+        return None
+    dsm = load_raster(dsm_path)
+    dtm = None
+    dtm_path = os.path.join(output_path, "odm_dem", "dtm.tif")
+    if base == "dtm":
+        if os.path.exists(dtm_path):
+            dtm = load_raster(dtm_path)   # ODM writes DSM and DTM on the same grid
+        else:
+            base = "plane"
+    polygon = load_polygon(polygon_path) if polygon_path and os.path.exists(polygon_path) else None
+    try:
+        return compute_volume(dsm, polygon, base=base, tile_size=tile_size, dtm=dtm)
+    finally:
+        for raster in (dsm, dtm):
+            if raster is not None and raster.dataset is not None:
+                raster.dataset.close()
+            elif raster is not None and hasattr(raster.data, "close"):
+                raster.data.close()
+
+
+# =========================
+# MULTI-STOCKPILE VOLUMES
+# =========================
+_SHARED = {}   # per worker process: name -> (SharedMemory, Raster)
+
+
+def _attach_shared(specs):
+    """Pool initializer: map the parent's shared DSM/DTM windows instead of receiving copies."""
+    for name, spec in specs.items():
+        shm = shared_memory.SharedMemory(name=spec["shm"])
+        data = np.ndarray(spec["shape"], dtype=np.float32, buffer=shm.buf)
+        _SHARED[name] = (shm, Raster(data, origin_x=spec["origin_x"], origin_y=spec["origin_y"],
+                                     pixel_w=spec["pixel_w"], pixel_h=spec["pixel_h"], nodata=spec["nodata"]))
+
+
+def _shared_pile_volume(name, poly_px, base, tile_size):
+    dsm = _SHARED["dsm"][1]
+    dtm = _SHARED["dtm"][1] if "dtm" in _SHARED else None
+    result = compute_volume(dsm, poly_px, base=base, tile_size=tile_size, dtm=dtm, polygon_in_pixels=True)
+    return dict(result, name=name)
+
+
+def _share_window(raster, r0, r1, c0, c1, tile_size):
+    """Copy raster[r0:r1, c0:c1] into a new float32 shared-memory block, one tile strip at a time."""
+    shape = (r1 - r0, c1 - c0)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1] * 4))
+    data = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    for top in range(r0, r1, tile_size):
+        bottom = min(top + tile_size, r1)
+        data[top - r0:bottom - r0] = raster.read(top, bottom, c0, c1)
+    spec = {
+        "shm": shm.name,
+        "shape": shape,
+        "origin_x": raster.origin_x + c0 * raster.pixel_w,
+        "origin_y": raster.origin_y - r0 * raster.pixel_h,
+        "pixel_w": raster.pixel_w,
+        "pixel_h": raster.pixel_h,
+        "nodata": raster.nodata,
+    }
+    return shm, spec
+
+
+def compute_volumes(dsm, piles, base="plane", tile_size=1024, dtm=None, workers=None,
+                    parallel_min_pixels=16 * 1024 * 1024):
+    """Per-pile ``compute_volume`` for [(name, polygon), ...], in parallel worker processes.
+
+    Only the window covering all piles is read, once, into shared memory;
+    workers map it by name, so nothing raster-sized is pickled. A single
+    pile, ``workers=1`` or a window under ``parallel_min_pixels`` (where
+    process start-up costs more than it saves) runs in-process.
+    """
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 2) - 1)
+    workers = min(workers, len(piles))
+
+    # Union bounding box of every pile, padded for the boundary samples
+    pixel_polys = [dsm.world_to_pixel(polygon) for _, polygon in piles]
+    stacked = np.vstack(pixel_polys)
+    c0 = max(0, int(math.floor(stacked[:, 0].min())) - 2)
+    c1 = min(dsm.width, int(math.ceil(stacked[:, 0].max())) + 2)
+    r0 = max(0, int(math.floor(stacked[:, 1].min())) - 2)
+    r1 = min(dsm.height, int(math.ceil(stacked[:, 1].max())) + 2)
+
+    if workers <= 1 or (r1 - r0) * (c1 - c0) < parallel_min_pixels:
+        return [dict(compute_volume(dsm, polygon, base=base, tile_size=tile_size, dtm=dtm), name=name)
+                for name, polygon in piles]
+    if r1 <= r0 or c1 <= c0:
+        raise ValueError("Stockpile polygons are outside the DSM")
+
+    blocks = []
+    try:
+        specs = {}
+        for name, raster in (("dsm", dsm), ("dtm", dtm)):
+            if raster is not None:
+                shm, specs[name] = _share_window(raster, r0, r1, c0, c1, tile_size)
+                blocks.append(shm)
+
+        # fork where available: spawn would re-import the web app (and start its job
+        # queue) in every worker; the children only run NumPy on the shared block
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(method)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_attach_shared, initargs=(specs,)) as pool:
+            futures = [pool.submit(_shared_pile_volume, name, poly - (c0, r0), base, tile_size)
+                       for (name, _), poly in zip(piles, pixel_polys)]
+            return [f.result() for f in futures]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def stockpile_volumes(output_path, polygons_path, base="plane", tile_size=1024, workers=None):
+    """Volumes of every pile in ``polygons_path`` for one ODM project folder, or None without a DSM."""
+    dsm_path = os.path.join(output_path, "odm_dem", "dsm.tif")
+    if not os.path.exists(dsm_path) or not polygons_path or not os.path.exists(polygons_path):
+        return None
+    piles = load_stockpiles(polygons_path)
+    dsm = load_raster(dsm_path)
+    dtm = None
+    dtm_path = os.path.join(output_path, "odm_dem", "dtm.tif")
+    if base == "dtm":
+        if os.path.exists(dtm_path):
+            dtm = load_raster(dtm_path)
+        else:
+            base = "plane"
+    try:
+        return compute_volumes(dsm, piles, base=base, tile_size=tile_size, dtm=dtm, workers=workers)
+    finally:
+        for raster in (dsm, dtm):
+            if raster is not None and raster.dataset is not None:
+                raster.dataset.close()
+            elif raster is not None and hasattr(raster.data, "close"):
+                raster.data.close()
+
+
+# =========================
+# DSM CHANGE DETECTION
+# =========================
+def _change_stats():
+    return {"added": 0.0, "removed": 0.0, "changed_px": 0, "valid_px": 0, "dz_sum": 0.0,
+            "max_rise": 0.0, "max_drop": 0.0}
+
+
+def _accumulate_change(acc, dz, min_change):
+    if not dz.size:
+        return
+    rise = dz > min_change
+    drop = dz < -min_change
+    acc["added"] += float(dz[rise].sum())
+    acc["removed"] -= float(dz[drop].sum())
+    acc["changed_px"] += int(np.count_nonzero(rise | drop))
+    acc["valid_px"] += dz.size
+    acc["dz_sum"] += float(dz.sum())
+    acc["max_rise"] = max(acc["max_rise"], float(dz.max()))
+    acc["max_drop"] = min(acc["max_drop"], float(dz.min()))
+
+
+def _finish_change(acc, pixel_area):
+    return {
+        "added_m3": round(acc["added"] * pixel_area, 3),
+        "removed_m3": round(acc["removed"] * pixel_area, 3),
+        "net_m3": round((acc["added"] - acc["removed"]) * pixel_area, 3),
+        "changed_area_m2": round(acc["changed_px"] * pixel_area, 3),
+        "compared_area_m2": round(acc["valid_px"] * pixel_area, 3),
+        "mean_dz_m": round(acc["dz_sum"] / acc["valid_px"], 4) if acc["valid_px"] else None,
+        "max_rise_m": round(acc["max_rise"], 3),
+        "max_drop_m": round(acc["max_drop"], 3),
+    }
+
+
+def save_change_heatmap(mean_dz, path, min_change=0.05):
+    """Diverging PNG of elevation change: red where material was added, blue where removed."""
+    from PIL import Image
+
+    valid = np.isfinite(mean_dz)
+    clip = float(np.percentile(np.abs(mean_dz[valid]), 98)) if valid.any() else 1.0
+    clip = max(clip, min_change * 2)
+    t = np.clip(np.nan_to_num(mean_dz) / clip, -1, 1)
+
+    rgba = np.zeros(mean_dz.shape + (4,), dtype=np.uint8)
+    up, down = t > 0, t < 0
+    rgba[..., 0] = np.where(down, 255 * (1 + t), 255).astype(np.uint8)
+    rgba[..., 1] = (255 * (1 - np.abs(t))).astype(np.uint8)
+    rgba[..., 2] = np.where(up, 255 * (1 - t), 255).astype(np.uint8)
+    # Changes under the detection threshold stay faint so real movement stands out
+    rgba[..., 3] = np.where(valid, np.where(np.abs(mean_dz) > min_change, 220, 50), 0)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    Image.fromarray(rgba, "RGBA").save(tmp, "PNG")
+    os.replace(tmp, path)
+    return path
+
+
+def dsm_difference(before, after, piles=None, tile_size=1024, min_change=0.05,
+                   heatmap_path=None, heatmap_side=2048):
+    """Elevation change ``after - before`` over the two DSMs' overlap, tile by tile.
+
+    ``after``'s grid is the reference; ``before`` is sampled at its pixel
+    centres (nearest pixel), so the surveys need not share an origin or
+    resolution. Changes within ``min_change`` metres are treated as noise
+    for the added/removed volumes. Stats are returned for the whole overlap
+    and for each (name, polygon) in ``piles``; with ``heatmap_path`` a
+    block-averaged change map of at most ``heatmap_side`` pixels is written.
+    """
+    started = time.perf_counter()
+    ax0 = max(after.origin_x, before.origin_x)
+    ax1 = min(after.origin_x + after.width * after.pixel_w, before.origin_x + before.width * before.pixel_w)
+    ay0 = max(after.origin_y - after.height * after.pixel_h, before.origin_y - before.height * before.pixel_h)
+    ay1 = min(after.origin_y, before.origin_y)
+    if ax1 <= ax0 or ay1 <= ay0:
+        raise ValueError("The two DSMs do not overlap")
+
+    c_min = max(0, int(math.floor((ax0 - after.origin_x) / after.pixel_w)))
+    c_max = min(after.width, int(math.ceil((ax1 - after.origin_x) / after.pixel_w)))
+    r_min = max(0, int(math.floor((after.origin_y - ay1) / after.pixel_h)))
+    r_max = min(after.height, int(math.ceil((after.origin_y - ay0) / after.pixel_h)))
+
+    # Tiles are a whole number of heatmap cells, so each tile reduces into its own cells
+    step = max(1, int(math.ceil(max(r_max - r_min, c_max - c_min) / heatmap_side)))
+    tile = max(step, tile_size // step * step)
+    heat_shape = (-(-(r_max - r_min) // step), -(-(c_max - c_min) // step))
+    heat_sum = np.zeros(heat_shape)
+    heat_count = np.zeros(heat_shape)
+
+    pile_px = [(name, after.world_to_pixel(polygon)) for name, polygon in (piles or [])]
+    site = _change_stats()
+    pile_acc = {name: _change_stats() for name, _ in pile_px}
+
+    for r0 in range(r_min, r_max, tile):
+        r1 = min(r0 + tile, r_max)
+        ys = after.origin_y - (np.arange(r0, r1) + 0.5) * after.pixel_h
+        rb = np.floor((before.origin_y - ys) / before.pixel_h).astype(np.int64)
+        rows_ok = (rb >= 0) & (rb < before.height)
+        for c0 in range(c_min, c_max, tile):
+            c1 = min(c0 + tile, c_max)
+            xs = after.origin_x + (np.arange(c0, c1) + 0.5) * after.pixel_w
+            cb = np.floor((xs - before.origin_x) / before.pixel_w).astype(np.int64)
+            cols_ok = (cb >= 0) & (cb < before.width)
+            if not rows_ok.any() or not cols_ok.any():
+                continue
+
+            z_after = after.read(r0, r1, c0, c1)
+            rbc = np.clip(rb, 0, before.height - 1)
+            cbc = np.clip(cb, 0, before.width - 1)
+            window = before.read(int(rbc.min()), int(rbc.max()) + 1, int(cbc.min()), int(cbc.max()) + 1)
+            z_before = window[np.ix_(rbc - rbc.min(), cbc - cbc.min())]
+
+            usable = after.valid(z_after) & before.valid(z_before) & rows_ok[:, None] & cols_ok[None, :]
+            dz = np.where(usable, z_after - z_before, np.nan)
+            _accumulate_change(site, dz[usable], min_change)
+
+            for name, poly in pile_px:
+                if (poly[:, 0].max() < c0 or poly[:, 0].min() > c1 or
+                        poly[:, 1].max() < r0 or poly[:, 1].min() > r1):
+                    continue
+                inside = _polygon_mask(poly, r0, r1, c0, c1) & usable
+                _accumulate_change(pile_acc[name], dz[inside], min_change)
+
+            # Block-average into heatmap cells (pad the ragged edge tiles with NaN)
+            ph, pw = -(-(r1 - r0) // step) * step, -(-(c1 - c0) // step) * step
+            padded = np.full((ph, pw), np.nan)
+            padded[:r1 - r0, :c1 - c0] = dz
+            cells = padded.reshape(ph // step, step, pw // step, step)
+            hr, hc = (r0 - r_min) // step, (c0 - c_min) // step
+            heat_sum[hr:hr + ph // step, hc:hc + pw // step] += np.nansum(cells, axis=(1, 3))
+            heat_count[hr:hr + ph // step, hc:hc + pw // step] += np.count_nonzero(np.isfinite(cells), axis=(1, 3))
+
+    area = after.pixel_area
+    result = {
+        "site": _finish_change(site, area),
+        "piles": [dict(_finish_change(pile_acc[name], area), name=name) for name, _ in pile_px],
+        "min_change_m": min_change,
+        "bounds": [after.origin_x + c_min * after.pixel_w, after.origin_y - r_max * after.pixel_h,
+                   after.origin_x + c_max * after.pixel_w, after.origin_y - r_min * after.pixel_h],
+        "heatmap": None,
+        "heatmap_step": step,
+    }
+    if heatmap_path:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_dz = np.where(heat_count > 0, heat_sum / np.maximum(heat_count, 1), np.nan)
+        result["heatmap"] = save_change_heatmap(mean_dz, heatmap_path, min_change)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def survey_change(before_path, after_path, polygons_path=None, tile_size=1024, min_change=0.05, heatmap_path=None):
+    """``dsm_difference`` between two ODM project folders, or None unless both have a DSM."""
+    paths = [os.path.join(p, "odm_dem", "dsm.tif") for p in (before_path, after_path)]
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    piles = load_stockpiles(polygons_path) if polygons_path and os.path.exists(polygons_path) else None
+    before, after = load_raster(paths[0]), load_raster(paths[1])
+    try:
+        return dsm_difference(before, after, piles, tile_size=tile_size, min_change=min_change,
+                              heatmap_path=heatmap_path)
+    finally:
+        for raster in (before, after):
+            if raster.dataset is not None:
+                raster.dataset.close()
+            elif hasattr(raster.data, "close"):
+                raster.data.close()
@@ -0,0 +1,245 @@
+import json
+import sqlite3
+import time
+
+
+# =========================
+# STOCKPILE VOLUME STORE
+# =========================
+PILE_COLUMNS = ("date_folder", "pile", "cut_m3", "fill_m3", "net_m3", "area_m2", "max_height_m",
+                "base", "job_id", "computed_at")
+# One point of a volume series: [date, cut, fill, net, area, max height]
+SERIES_FIELDS = ("date", "cut_m3", "fill_m3", "net_m3", "area_m2", "max_height_m")
+SITE_SERIES = "site"
+
+CHANGE_COLUMNS = ("date_from", "date_to", "pile", "added_m3", "removed_m3", "net_m3", "changed_area_m2",
+                  "compared_area_m2", "mean_dz_m", "max_rise_m", "max_drop_m", "heatmap_path", "computed_at")
+
+
+class StockpileVolumeStore:
+    """Per-pile volumes for every survey date, one row per (date, pile).
+
+    A survey's rows are replaced as a whole when it is measured again, so
+    the table always holds the latest measurement of each pile. Alongside,
+    ``volume_series`` keeps each pile's whole history (plus the site total)
+    packed in a single row, so a trend is one primary-key read however many
+    surveys there are; ``dsm_changes`` holds survey-to-survey DSM
+    differences.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS stockpile_volumes (
+            date_folder TEXT,
+            pile TEXT,
+            cut_m3 REAL,
+            fill_m3 REAL,
+            net_m3 REAL,
+            area_m2 REAL,
+            max_height_m REAL,
+            base TEXT,
+            job_id INTEGER,
+            computed_at REAL,
+            PRIMARY KEY (date_folder, pile)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS volume_series (
+            series TEXT PRIMARY KEY,
+            points TEXT,
+            updated_at REAL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS dsm_changes (
+            date_from TEXT,
+            date_to TEXT,
+            pile TEXT,
+            added_m3 REAL,
+            removed_m3 REAL,
+            net_m3 REAL,
+            changed_area_m2 REAL,
+            compared_area_m2 REAL,
+            mean_dz_m REAL,
+            max_rise_m REAL,
+            max_drop_m REAL,
+            heatmap_path TEXT,
+            computed_at REAL,
+            PRIMARY KEY (date_from, date_to, pile)
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_dsm_changes_to ON dsm_changes (date_to)")
+        conn.commit()
+        c = conn.cursor()
+        c.execute("SELECT (SELECT COUNT(*) FROM volume_series), (SELECT COUNT(*) FROM stockpile_volumes)")
+        series_count, pile_rows = c.fetchone()
+        conn.close()
+        # Volumes measured before the series table existed
+        if pile_rows and not series_count:
+            self.rebuild_series()
+
+    def save(self, date_folder, results, job_id=None):
+        """Replace a survey's piles with ``results`` (dicts from ``compute_volumes``)."""
+        now = time.time()
+        rows = [(date_folder, r["name"], r["cut_m3"], r["fill_m3"], r["net_m3"], r["area_m2"],
+                 r.get("max_height_m"), r.get("base"), job_id, now) for r in results]
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM stockpile_volumes WHERE date_folder = ?", (date_folder,))
+            conn.executemany(f"""
+            INSERT INTO stockpile_volumes ({", ".join(PILE_COLUMNS)})
+            VALUES ({", ".join("?" * len(PILE_COLUMNS))})
+            """, rows)
+            self._update_series(conn, date_folder)
+        conn.close()
+
+    # ---------- time series ----------
+    def _update_series(self, conn, date_folder):
+        """Fold one survey's rows into the packed per-pile and site series (same transaction)."""
+        c = conn.cursor()
+        c.execute("SELECT series FROM volume_series")
+        known = {row[0] for row in c.fetchall()}
+        c.execute("""
+        SELECT pile, cut_m3, fill_m3, net_m3, area_m2, max_height_m
+        FROM stockpile_volumes WHERE date_folder = ?
+        """, (date_folder,))
+        current = {f"pile:{row[0]}": [date_folder, *row[1:]] for row in c.fetchall()}
+        if current:
+            totals = [sum(p[i] or 0 for p in current.values()) for i in range(1, 5)]
+            heights = [p[5] for p in current.values() if p[5] is not None]
+            current[SITE_SERIES] = [date_folder, *[round(t, 3) for t in totals], max(heights) if heights else None]
+
+        now = time.time()
+        for series in known | set(current):
+            c.execute("SELECT points FROM volume_series WHERE series = ?", (series,))
+            row = c.fetchone()
+            points = [p for p in (json.loads(row[0]) if row else []) if p[0] != date_folder]
+            if series in current:
+                points.append(current[series])
+                points.sort(key=lambda p: p[0])
+            elif row is None or len(points) == len(json.loads(row[0])):
+                continue   # this survey never touched the series
+            if points:
+                c.execute("INSERT OR REPLACE INTO volume_series (series, points, updated_at) VALUES (?, ?, ?)",
+                          (series, json.dumps(points, separators=(",", ":")), now))
+            else:
+                c.execute("DELETE FROM volume_series WHERE series = ?", (series,))
+
+    def rebuild_series(self):
+        """Recompute every series from ``stockpile_volumes`` (after manual edits or imports)."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM volume_series")
+            c = conn.cursor()
+            c.execute("SELECT DISTINCT date_folder FROM stockpile_volumes ORDER BY date_folder")
+            for (date_folder,) in c.fetchall():
+                self._update_series(conn, date_folder)
+        conn.close()
+
+    def trend(self, pile=None):
+        """All survey points for one pile (or the site total when ``pile`` is None), oldest first."""
+        series = f"pile:{pile}" if pile else SITE_SERIES
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT points, updated_at FROM volume_series WHERE series = ?", (series,))
+        row = c.fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return {
+            "pile": pile,
+            "points": [dict(zip(SERIES_FIELDS, p)) for p in json.loads(row[0])],
+            "updated_at": row[1],
+        }
+
+    def piles(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT series FROM volume_series WHERE series LIKE 'pile:%' ORDER BY series")
+        names = [row[0][len("pile:"):] for row in c.fetchall()]
+        conn.close()
+        return names
+
+    def copy_survey(self, src_date, dst_date, job_id=None):
+        """Reuse another survey's piles (same images served from the result cache)."""
+        if src_date == dst_date:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM stockpile_volumes WHERE date_folder = ?", (dst_date,))
+            conn.execute("""
+            INSERT INTO stockpile_volumes (date_folder, pile, cut_m3, fill_m3, net_m3, area_m2,
+                                           max_height_m, base, job_id, computed_at)
+            SELECT ?, pile, cut_m3, fill_m3, net_m3, area_m2, max_height_m, base, ?, ?
+            FROM stockpile_volumes WHERE date_folder = ?
+            """, (dst_date, job_id, time.time(), src_date))
+            self._update_series(conn, dst_date)
+        conn.close()
+
+    def for_survey(self, date_folder):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(PILE_COLUMNS)} FROM stockpile_volumes WHERE date_folder = ? ORDER BY pile",
+                  (date_folder,))
+        rows = [dict(zip(PILE_COLUMNS, row)) for row in c.fetchall()]
+        conn.close()
+        return rows
+
+    # ---------- DSM changes ----------
+    def save_change(self, date_from, date_to, result):
+        """Store a ``dsm_difference`` result: one row for the site ("") and one per pile."""
+        now = time.time()
+        rows = []
+        for pile, stats in [("", result["site"])] + [(p["name"], p) for p in result["piles"]]:
+            rows.append((date_from, date_to, pile, stats["added_m3"], stats["removed_m3"], stats["net_m3"],
+                         stats["changed_area_m2"], stats["compared_area_m2"], stats["mean_dz_m"],
+                         stats["max_rise_m"], stats["max_drop_m"], result.get("heatmap"), now))
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM dsm_changes WHERE date_from = ? AND date_to = ?", (date_from, date_to))
+            conn.executemany(f"""
+            INSERT INTO dsm_changes ({", ".join(CHANGE_COLUMNS)})
+            VALUES ({", ".join("?" * len(CHANGE_COLUMNS))})
+            """, rows)
+        conn.close()
+
+    def changes(self, date_from=None, date_to=None, limit=50):
+        """Stored survey-to-survey changes, newest first; each with its per-pile rows."""
+        clauses, args = [], []
+        if date_from:
+            clauses.append("date_from = ?")
+            args.append(date_from)
+        if date_to:
+            clauses.append("date_to = ?")
+            args.append(date_to)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(f"""
+        SELECT {", ".join(CHANGE_COLUMNS)} FROM dsm_changes {where}
+        ORDER BY date_to DESC, date_from DESC, pile
+        """, args)
+        grouped = {}
+        for row in c.fetchall():
+            item = dict(zip(CHANGE_COLUMNS, row))
+            key = (item["date_from"], item["date_to"])
+            if key not in grouped:
+                if len(grouped) >= limit:
+                    break
+                grouped[key] = {"date_from": key[0], "date_to": key[1], "heatmap_path": item["heatmap_path"],
+                                "computed_at": item["computed_at"], "site": None, "piles": []}
+            stats = {k: item[k] for k in CHANGE_COLUMNS[3:11]}
+            if item["pile"]:
+                grouped[key]["piles"].append(dict(stats, name=item["pile"]))
+            else:
+                grouped[key]["site"] = stats
+        conn.close()
+        return list(grouped.values())